@@ -0,0 +1,74 @@
+"""
+Замер холодного старта бэкенда: время импорта сервера, время первого и второго запроса
+и время создания каждого клиента из реестра. Каждый прогон выполняется в отдельном процессе.
+
+Пример запуска:
+    python -m benchmarks.cold_start --runs 5 --path /api/profile/1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Код, выполняемый в свежем интерпретаторе для одного прогона
+RUN_SNIPPET = '''
+import json, sys, time
+started = time.perf_counter()
+from llm_integration.server import app
+from utils import clients
+import_seconds = time.perf_counter() - started
+
+method, path, body = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+client = app.test_client()
+requests = []
+for _ in range(2):
+    started = time.perf_counter()
+    response = client.open(path, method=method, json=body or None)
+    requests.append(time.perf_counter() - started)
+print(json.dumps({
+    'import': import_seconds,
+    'first_request': requests[0],
+    'second_request': requests[1],
+    'status': response.status_code,
+    'clients': clients.startup_timings
+}))
+'''
+
+
+def run_once(method: str, path: str, body: dict, env: dict) -> dict:
+    """Один прогон холодного старта в отдельном процессе"""
+    result = subprocess.run(
+        [sys.executable, '-c', RUN_SNIPPET, method, path, json.dumps(body)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер холодного старта бэкенда')
+    parser.add_argument('--runs', type=int, default=5, help='количество прогонов')
+    parser.add_argument('--method', default='GET', help='метод первого запроса')
+    parser.add_argument('--path', default='/api/profile/1', help='адрес первого запроса')
+    parser.add_argument('--body', default='{}', help='JSON-тело первого запроса')
+    parser.add_argument('--warm-up', action='store_true', help='включить фоновый прогрев клиентов')
+    args = parser.parse_args()
+
+    env = {**os.environ, 'WARMUP_CLIENTS': '1' if args.warm_up else '0'}
+    runs = [run_once(args.method, args.path, json.loads(args.body), env) for _ in range(args.runs)]
+
+    print(f'Прогонов: {len(runs)}, статус ответа: {runs[-1]["status"]}')
+    for stage in ('import', 'first_request', 'second_request'):
+        values = [run[stage] * 1000 for run in runs]
+        print(f'{stage:>16}: медиана {statistics.median(values):8.1f} мс, максимум {max(values):8.1f} мс')
+    names = sorted({name for run in runs for name in run['clients']})
+    for name in names:
+        values = [run['clients'][name] * 1000 for run in runs if name in run['clients']]
+        print(f'{"client " + name:>16}: медиана {statistics.median(values):8.1f} мс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Локальные заменители внешних сервисов для бенчмарков без обращения к платным API:
+языковая модель, классификатор, эмбеддинги и база Supabase в памяти.
+Qdrant заменяется собственным режимом клиента в памяти (QdrantClient(':memory:')).
+"""
+import hashlib
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+
+class StageRecorder:
+    """Сбор длительностей обращений к заменителям по этапам"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.durations[stage].append(seconds)
+
+    def timed(self, stage: str, function, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def reset(self):
+        with self._lock:
+            self.durations.clear()
+
+
+recorder = StageRecorder()
+
+
+def _jitter(seconds: float, spread: float = 0.2) -> float:
+    return max(0.0, random.uniform(seconds * (1 - spread), seconds * (1 + spread)))
+
+
+class FakeChatModel:
+    """Языковая модель с настраиваемыми задержкой до первого токена и скоростью генерации"""
+    def __init__(self, name: str, first_token_latency: float = 0.5, tokens_per_second: float = 50.0,
+                 reply_tokens: int = 120, think: bool = False):
+        self.name = name
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.think = think
+
+    def _tokens(self, messages):
+        question = messages[-1]['content'] if messages else ''
+        tokens = ['<think>', 'Думаю ', 'над ', 'ответом', '</think>'] if self.think else []
+        tokens += [f'слово{i} ' for i in range(self.reply_tokens)]
+        tokens.append(f'(ответ на: {question[:40]}) [1]')
+        return tokens
+
+    def stream(self, messages, **kwargs):
+        started = time.perf_counter()
+        time.sleep(_jitter(self.first_token_latency))
+        for token in self._tokens(messages):
+            time.sleep(1 / self.tokens_per_second)
+            yield SimpleNamespace(content=token)
+        recorder.record(self.name, time.perf_counter() - started)
+
+    def invoke(self, messages, **kwargs):
+        return SimpleNamespace(content=''.join(chunk.content for chunk in self.stream(messages, **kwargs)))
+
+
+class FakeClassifier:
+    """Классификатор вопросов с настраиваемой задержкой, выбирающий метку по хэшу вопроса"""
+    def __init__(self, labels: list, latency: float = 0.3, weights: list = None):
+        self.labels = labels
+        self.latency = latency
+        self.weights = weights or [1] * len(labels)
+
+    def run(self, question: str):
+        started = time.perf_counter()
+        time.sleep(_jitter(self.latency))
+        rng = random.Random(hashlib.sha256(question.encode('utf-8')).digest())
+        best = rng.choices(self.labels, weights=self.weights)[0]
+        recorder.record('classifier', time.perf_counter() - started)
+        return [SimpleNamespace(label=label, confidence=1.0 if label == best else 0.0) for label in self.labels]
+
+
+class FakeEmbeddings:
+    """Эмбеддинги с настраиваемой задержкой: детерминированный вектор по хэшу слов текста"""
+    def __init__(self, vector_size: int = 256, latency: float = 0.1):
+        self.vector_size = vector_size
+        self.latency = latency
+
+    def _vector(self, text: str) -> list:
+        vector = [0.0] * self.vector_size
+        for word in text.lower().split():
+            rng = random.Random(hashlib.sha256(word.encode('utf-8')).digest())
+            for i in range(self.vector_size):
+                vector[i] += rng.gauss(0, 1)
+        return vector if any(vector) else [1.0] + [0.0] * (self.vector_size - 1)
+
+    def embed_documents(self, texts: list) -> list:
+        started = time.perf_counter()
+        time.sleep(_jitter(self.latency) * len(texts))
+        vectors = [self._vector(text) for text in texts]
+        recorder.record('embeddings', time.perf_counter() - started)
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+class FakeQuery:
+    """Цепочка запроса к таблице в стиле клиента Supabase (postgrest)"""
+    def __init__(self, database, table: str):
+        self.database = database
+        self.table = table
+        self.action = 'select'
+        self.columns = None
+        self.values = None
+        self.filters = []
+        self.ordering = []
+        self.limit_count = None
+        self.single = False
+
+    def select(self, *columns):
+        self.action = 'select'
+        self.columns = None if not columns or columns == ('*',) else columns
+        return self
+
+    def insert(self, values):
+        self.action, self.values = 'insert', values
+        return self
+
+    def update(self, values):
+        self.action, self.values = 'update', values
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    def _filter(self, column, predicate):
+        self.filters.append((column, predicate))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, lambda v: v == value)
+
+    def neq(self, column, value):
+        return self._filter(column, lambda v: v != value)
+
+    def lt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v < value)
+
+    def lte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v <= value)
+
+    def gt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v > value)
+
+    def gte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v >= value)
+
+    def in_(self, column, values):
+        values = set(values)
+        return self._filter(column, lambda v: v in values)
+
+    def is_(self, column, value):
+        return self._filter(column, lambda v: v is None if value in (None, 'null') else v == value)
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def maybe_single(self):
+        self.single = True
+        self.limit_count = 1
+        return self
+
+    def execute(self):
+        started = time.perf_counter()
+        time.sleep(_jitter(self.database.latency))
+        try:
+            return self.database.execute(self)
+        finally:
+            recorder.record('supabase', time.perf_counter() - started)
+
+
+class FakeSupabase:
+    """База Supabase в памяти с настраиваемой задержкой запросов"""
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self.tables = defaultdict(list)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def _matches(self, query: FakeQuery, row: dict) -> bool:
+        return all(predicate(row.get(column)) for column, predicate in query.filters)
+
+    def execute(self, query: FakeQuery):
+        with self._lock:
+            rows = self.tables[query.table]
+            if query.action == 'insert':
+                values = query.values if isinstance(query.values, list) else [query.values]
+                now = datetime.now(timezone.utc).isoformat()
+                inserted = [{'created_at': now, **value} for value in values]
+                for row in inserted:
+                    row.setdefault('id', next(self._ids))
+                rows.extend(inserted)
+                return SimpleNamespace(data=[dict(row) for row in inserted], error=None)
+            if query.action == 'update':
+                updated = []
+                for row in rows:
+                    if self._matches(query, row):
+                        row.update({k: v for k, v in query.values.items() if v != 'now()'})
+                        updated.append(dict(row))
+                return SimpleNamespace(data=updated, error=None)
+            if query.action == 'delete':
+                deleted = [row for row in rows if self._matches(query, row)]
+                self.tables[query.table] = [row for row in rows if not self._matches(query, row)]
+                return SimpleNamespace(data=deleted, error=None)
+
+            selected = [row for row in rows if self._matches(query, row)]
+            for column, desc in reversed(query.ordering):
+                selected.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+            if query.limit_count is not None:
+                selected = selected[:query.limit_count]
+            if query.columns is not None:
+                selected = [{column: row.get(column) for column in query.columns} for row in selected]
+            else:
+                selected = [dict(row) for row in selected]
+            if query.single:
+                return SimpleNamespace(data=selected[0] if selected else None, error=None)
+            return SimpleNamespace(data=selected, error=None)
@@ -0,0 +1,185 @@
+"""
+Нагрузочное тестирование бэкенда без обращения к платным API.
+Внешние сервисы подменяются локальными заменителями из benchmarks.fakes, после чего
+Flask-приложение нагружается параллельными запросами. Выводятся пропускная способность,
+перцентили задержек и разбивка времени по этапам (заменителям).
+
+Пример запуска:
+    python -m benchmarks.load_test --scenario send_message --requests 500 --concurrency 50
+    python -m benchmarks.load_test --scenario payments --requests 2000 --concurrency 20
+    python -m benchmarks.load_test --scenario qdrant_search --requests 1000 --concurrency 8
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+os.environ.setdefault('WARMUP_CLIENTS', '0')
+os.environ.setdefault('REQUIRE_SUBSCRIPTION', '1')
+os.environ.setdefault('EMBEDDINGS_CACHE_DIR', tempfile.mkdtemp(prefix='bench-embeddings-'))
+os.environ.setdefault('PAYMENTS_QUEUE_PATH', os.path.join(tempfile.mkdtemp(prefix='bench-payments-'), 'payments.sqlite3'))
+
+from benchmarks.fakes import FakeChatModel, FakeClassifier, FakeEmbeddings, FakeSupabase, recorder
+from benchmarks.stats import percentile
+from utils import clients
+
+QUESTIONS = [
+    'Какие документы нужны для поступления в {}?',
+    'Какой проходной балл на бюджет в {}?',
+    'Есть ли общежитие для первокурсников в {}?',
+    'Какие вступительные экзамены сдавать на программирование в {}?',
+    'Когда начинается приёмная кампания в {}?',
+    'Расскажи анекдот про студентов {}',
+    'Как подготовиться к олимпиадам для поступления в {}?',
+    'Привет, как дела у {}?',
+]
+UNIVERSITIES = ['МГУ', 'СПбГУ', 'МФТИ', 'ВШЭ', 'ИТМО', 'МИФИ', 'МГТУ им. Баумана', 'УрФУ', 'КФУ', 'НГУ']
+
+
+def install_fakes(args):
+    """Подмена всех внешних клиентов в реестре локальными заменителями"""
+    from qdrant_client import QdrantClient
+    from llm_integration.llm_decider import LABEL_ILLEGAL, LABEL_SIMPLE, LABEL_NOT_UNIVERSITY, LABEL_EDUCATION
+
+    database = FakeSupabase(latency=args.db_latency)
+    clients.override('supabase', database)
+    clients.override('qdrant', QdrantClient(':memory:'))
+    clients.override('embeddings', FakeEmbeddings(latency=args.embed_latency))
+    clients.override('classifier', FakeClassifier(
+        [LABEL_ILLEGAL, LABEL_SIMPLE, LABEL_NOT_UNIVERSITY, LABEL_EDUCATION],
+        latency=args.classifier_latency,
+        weights=[1, 3, 2, 14]
+    ))
+    clients.override('llama', FakeChatModel(
+        'llama', first_token_latency=args.llm_latency, tokens_per_second=args.tokens_per_second
+    ))
+    clients.override('sonar', FakeChatModel(
+        'sonar', first_token_latency=args.llm_latency * 4, tokens_per_second=args.tokens_per_second, think=True
+    ))
+    return database
+
+
+def seed(database: FakeSupabase, args):
+    """Наполнение базы знаний и таблиц тестовыми данными"""
+    from llm_integration.llm_agent import qdrant
+    documents = [
+        f'{university}: {topic} для абитуриентов {year} года, документ {i}'
+        for i, (university, topic, year) in enumerate(
+            (random.choice(UNIVERSITIES), random.choice(['правила приёма', 'проходные баллы', 'общежитие', 'олимпиады']),
+             random.choice([2024, 2025])) for _ in range(args.documents)
+        )
+    ]
+    qdrant.upload_many(documents)
+    subscribe_end = (datetime.now() + timedelta(days=30)).isoformat()
+    # id пользователей начинаются с 1: нулевой id сервер отклоняет как пустой
+    for user_id in range(1, args.users + 1):
+        database.tables['profiles'].append({
+            'id': str(user_id), 'vk_id': user_id, 'subscribe': True, 'subscribe_end': subscribe_end, 'phone': '', 'school': ''
+        })
+        database.tables['orders'].append({'id': str(user_id), 'order_id': f'order-{user_id}', 'status': 'NEW'})
+
+
+def make_request(scenario: str, args):
+    """Построение случайного запроса сценария: (метод, адрес, тело)"""
+    user_id = random.randint(1, args.users)
+    if scenario == 'send_message':
+        question = random.choice(QUESTIONS).format(random.choice(UNIVERSITIES))
+        if not args.repeat_questions:
+            question += f' (вариант {random.randrange(10 ** 6)})'
+        path = '/api/send_message_stream' if args.stream else '/api/send_message'
+        return 'POST', path, {'user_id': str(user_id), 'message': question}
+    if scenario == 'payments':
+        notification = {
+            'TerminalKey': os.getenv('TERMINAL_KEY'),
+            'OrderId': f'order-{user_id}',
+            'Success': True,
+            'Status': random.choice(['AUTHORIZED', 'CONFIRMED']),
+            'ErrorCode': '0',
+            'PaymentId': random.randrange(10 ** 9),
+            'Token': 'benchmark',
+        }
+        return 'POST', '/api/payments/', notification
+    if scenario == 'profile':
+        return 'GET', f'/api/profile/{user_id}', None
+    raise ValueError(f'Неизвестный сценарий: {scenario}')
+
+
+def run_http(app, scenario: str, args) -> tuple:
+    """Нагрузка Flask-приложения параллельными запросами"""
+    def task(_):
+        client = app.test_client()
+        method, path, body = make_request(scenario, args)
+        started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        response.get_data()  # дочитывание потокового ответа
+        return time.perf_counter() - started, response.status_code < 400
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        return list(executor.map(task, range(args.requests)))
+
+
+def run_search(args) -> tuple:
+    """Нагрузка поиска по базе знаний"""
+    from llm_integration.llm_agent import qdrant
+
+    def task(_):
+        query = random.choice(QUESTIONS).format(random.choice(UNIVERSITIES))
+        started = time.perf_counter()
+        qdrant.search(query)
+        return time.perf_counter() - started, True
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        return list(executor.map(task, range(args.requests)))
+
+
+def report(results: list, elapsed: float):
+    latencies = [seconds * 1000 for seconds, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+    print(f'Запросов: {len(results)}, ошибок: {errors}, время: {elapsed:.2f} с, '
+          f'пропускная способность: {len(results) / elapsed:.1f} запросов/с')
+    print(f'Задержка, мс: p50={percentile(latencies, 50):.1f} p90={percentile(latencies, 90):.1f} '
+          f'p99={percentile(latencies, 99):.1f} max={max(latencies):.1f}')
+    print('Этапы (количество вызовов, среднее и p99, мс):')
+    for stage, durations in sorted(recorder.durations.items()):
+        values = [seconds * 1000 for seconds in durations]
+        print(f'  {stage:>12}: {len(values):6d} вызовов, среднее {statistics.mean(values):8.1f}, '
+              f'p99 {percentile(values, 99):8.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование бэкенда с локальными заменителями сервисов')
+    parser.add_argument('--scenario', choices=['send_message', 'payments', 'profile', 'qdrant_search'], default='send_message')
+    parser.add_argument('--requests', type=int, default=200, help='общее количество запросов')
+    parser.add_argument('--concurrency', type=int, default=20, help='количество одновременных запросов')
+    parser.add_argument('--stream', action='store_true', help='использовать потоковый send_message')
+    parser.add_argument('--repeat-questions', action='store_true', help='повторять вопросы дословно (проверка кэшей)')
+    parser.add_argument('--users', type=int, default=100, help='количество пользователей')
+    parser.add_argument('--documents', type=int, default=1000, help='количество документов в базе знаний')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='задержка до первого токена Llama, с (Sonar - в 4 раза больше)')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0, help='скорость генерации токенов')
+    parser.add_argument('--classifier-latency', type=float, default=0.3, help='задержка классификатора, с')
+    parser.add_argument('--embed-latency', type=float, default=0.05, help='задержка эмбеддинга одного текста, с')
+    parser.add_argument('--db-latency', type=float, default=0.02, help='задержка запроса к Supabase, с')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора случайных чисел')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    database = install_fakes(args)
+    from llm_integration.server import app
+    seed(database, args)
+    recorder.reset()
+
+    started = time.perf_counter()
+    if args.scenario == 'qdrant_search':
+        results = run_search(args)
+    else:
+        results = run_http(app, args.scenario, args)
+    report(results, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main()
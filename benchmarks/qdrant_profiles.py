@@ -0,0 +1,110 @@
+"""
+Сравнение профилей коллекции Qdrant по полноте и задержке поиска.
+Для каждого профиля создаётся отдельная коллекция со случайными векторами размером с базу
+знаний, после построения индекса выполняются запросы приближённым поиском и точным перебором.
+Выводятся полнота (recall@k относительно точного поиска), перцентили задержки и время загрузки.
+
+HNSW и квантование работают только на сервере Qdrant, поэтому замер выполняется на реальном
+экземпляре (по умолчанию локальный); коллекции bench_* удаляются после замера.
+
+Пример запуска:
+    python -m benchmarks.qdrant_profiles --url http://localhost:6333 --points 20000 --queries 200
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.stats import percentile
+from utils.qdrant_processor import collection_profiles
+
+
+def random_vectors(count: int, size: int, rng: random.Random) -> list:
+    """Векторы с кластерной структурой, похожей на эмбеддинги текстов одной тематики"""
+    centers = [[rng.gauss(0, 1) for _ in range(size)] for _ in range(max(1, count // 200))]
+    vectors = []
+    for _ in range(count):
+        center = rng.choice(centers)
+        vectors.append([value + rng.gauss(0, 0.6) for value in center])
+    return vectors
+
+
+def wait_indexed(client, collection_name: str, timeout: float = 600):
+    """Ожидание окончания построения индексов коллекции"""
+    from qdrant_client import models
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = client.get_collection(collection_name)
+        if info.status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(0.5)
+    raise TimeoutError(f'Коллекция {collection_name} не проиндексирована за {timeout} с')
+
+
+def measure(client, profile: str, vectors: list, queries: list, args) -> dict:
+    from qdrant_client import models
+    collection_name = f'bench_{profile}'
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    collection_profiles.create_collection(client, collection_name, args.vector_size, profile)
+
+    started = time.perf_counter()
+    for offset in range(0, len(vectors), args.batch_size):
+        client.upsert(collection_name=collection_name, points=[
+            models.PointStruct(id=offset + i, vector=vector, payload={'doc_id': offset + i, 'parent_id': offset + i})
+            for i, vector in enumerate(vectors[offset:offset + args.batch_size])
+        ])
+    wait_indexed(client, collection_name)
+    upload_seconds = time.perf_counter() - started
+
+    params = collection_profiles.search_params(profile)
+    recalls, latencies = [], []
+    for query in queries:
+        exact = client.search(
+            collection_name=collection_name, query_vector=query, limit=args.limit,
+            search_params=models.SearchParams(exact=True)
+        )
+        started = time.perf_counter()
+        found = client.search(collection_name=collection_name, query_vector=query, limit=args.limit, search_params=params)
+        latencies.append((time.perf_counter() - started) * 1000)
+        expected = {point.id for point in exact}
+        recalls.append(len(expected & {point.id for point in found}) / len(expected) if expected else 1.0)
+
+    if not args.keep:
+        client.delete_collection(collection_name)
+    return {
+        'recall': statistics.mean(recalls),
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'upload': upload_seconds
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение профилей коллекции Qdrant по полноте и задержке')
+    parser.add_argument('--url', default='http://localhost:6333', help='адрес сервера Qdrant')
+    parser.add_argument('--profiles', nargs='+', default=list(collection_profiles.PROFILES), help='сравниваемые профили')
+    parser.add_argument('--points', type=int, default=20000, help='количество векторов в коллекции')
+    parser.add_argument('--queries', type=int, default=200, help='количество запросов')
+    parser.add_argument('--limit', type=int, default=10, help='k в recall@k')
+    parser.add_argument('--vector-size', type=int, default=256, help='размерность векторов')
+    parser.add_argument('--batch-size', type=int, default=512, help='точек в одной записи')
+    parser.add_argument('--keep', action='store_true', help='не удалять коллекции после замера')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора случайных чисел')
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+    client = QdrantClient(url=args.url, timeout=60)
+    rng = random.Random(args.seed)
+    vectors = random_vectors(args.points, args.vector_size, rng)
+    queries = random_vectors(args.queries, args.vector_size, rng)
+
+    print(f'Точек: {args.points}, запросов: {args.queries}, k={args.limit}')
+    print(f'{"профиль":>10} {"recall@k":>9} {"p50, мс":>9} {"p99, мс":>9} {"загрузка, с":>12}')
+    for profile in args.profiles:
+        result = measure(client, profile, vectors, queries, args)
+        print(f'{profile:>10} {result["recall"]:9.3f} {result["p50"]:9.2f} {result["p99"]:9.2f} {result["upload"]:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
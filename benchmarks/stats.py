@@ -0,0 +1,13 @@
+"""
+Общие статистические функции бенчмарков. Модуль не имеет побочных эффектов при импорте,
+в отличие от load_test, который настраивает окружение для подмены внешних сервисов.
+"""
+
+
+def percentile(values: list, q: float) -> float:
+    """Перцентиль q (0-100) методом ближайшего ранга; для пустого списка - 0"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
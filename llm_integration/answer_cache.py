@@ -0,0 +1,207 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+EVICTION_INTERVAL = 1.0  # секунды между проходами по записям для удаления истёкших
+
+
+class AnswerCache:
+    """
+    Кэш готовых ответов на вопросы пользователей.
+    Поиск выполняется сначала по нормализованному тексту вопроса, затем по косинусной
+    близости эмбеддингов. Записи вытесняются по времени жизни (TTL) и по давности
+    использования (LRU) при превышении размера.
+    Для семантического поиска векторы записей собираются в матрицу-снимок, которая
+    перестраивается после изменения записей; умножение на неё выполняется без блокировки.
+    """
+    def __init__(self, embed=None, max_size: int = 1000, ttl: float = 24 * 3600, similarity: float = 0.95):
+        """
+        Args:
+            embed: функция получения эмбеддинга текста (None - только точное совпадение)
+            max_size: максимальное количество записей
+            ttl: время жизни записи в секундах
+            similarity: минимальная косинусная близость для семантического совпадения
+        """
+        self.embed = embed
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._snapshot = None  # (версия, ключи, матрица векторов) или None, если записи изменились
+        self._version = 0
+        self._next_eviction = 0.0
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        """Приведение вопроса к нормальной форме: нижний регистр, без пунктуации и лишних пробелов"""
+        question = question.lower().replace('ё', 'е')
+        question = re.sub(r'[^\w\s]', ' ', question)
+        return ' '.join(question.split())
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector)) or 1.0
+        return vector / norm
+
+    def _vector(self, question: str):
+        if self.embed is None:
+            return None
+        # Эмбеддинг, посчитанный при промахе в get, переиспользуется в последующем put
+        last = getattr(self._local, 'last', None)
+        if last is not None and last[0] == question:
+            return last[1]
+        try:
+            vector = self._unit(self.embed(question))
+        except Exception as e:
+            print('answer_cache/_vector>  Не удалось получить эмбеддинг:', e)
+            return None
+        self._local.last = (question, vector)
+        return vector
+
+    def _changed(self):
+        self._version += 1
+        self._snapshot = None
+
+    def _evict_expired(self, now: float):
+        if now < self._next_eviction:
+            return
+        self._next_eviction = now + EVICTION_INTERVAL
+        expired = [key for key, entry in self._entries.items() if entry['expires_at'] <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._changed()
+
+    def _matrix(self) -> tuple:
+        """Снимок векторов записей: (ключи, матрица); строится вне блокировки"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                return snapshot[1], snapshot[2]
+            version = self._version
+            items = [(key, entry['vector']) for key, entry in self._entries.items() if entry['vector'] is not None]
+        keys = [key for key, _ in items]
+        matrix = np.stack([vector for _, vector in items]) if items else None
+        with self._lock:
+            if self._version == version:
+                self._snapshot = (version, keys, matrix)
+        return keys, matrix
+
+    def _hit(self, key: str, kind: str) -> str:
+        self._entries.move_to_end(key)
+        entry = self._entries[key]
+        if kind == 'exact':
+            self.hits_exact += 1
+        else:
+            self.hits_semantic += 1
+        self.saved_seconds += entry['cost']
+        return entry['reply']
+
+    def get_exact(self, question: str):
+        """
+        Поиск готового ответа по нормализованному тексту вопроса (без эмбеддинга; промах не учитывается)
+
+        Returns:
+            Текст ответа или None, если действующей записи с таким вопросом нет
+        """
+        key = self.normalize(question)
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] <= now:
+                # Устаревшая запись удаляется сразу, не дожидаясь очистки
+                del self._entries[key]
+                self._changed()
+                return None
+            return self._hit(key, 'exact')
+
+    def get_similar(self, question: str):
+        """
+        Поиск готового ответа на близкий по эмбеддингу вопрос
+
+        Returns:
+            Текст ответа или None, если подходящей записи нет
+        """
+        keys, matrix = self._matrix() if self.embed is not None else ([], None)
+        vector = self._vector(question) if matrix is not None else None
+        best_key = None
+        if vector is not None:
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity:
+                best_key = keys[best]
+        with self._lock:
+            entry = self._entries.get(best_key)
+            if entry is not None and entry['expires_at'] > time.monotonic():
+                return self._hit(best_key, 'semantic')
+            self.misses += 1
+            return None
+
+    def get(self, question: str):
+        """
+        Поиск готового ответа на вопрос: сначала по тексту, затем по эмбеддингу
+
+        Args:
+            question: вопрос пользователя
+
+        Returns:
+            Текст ответа или None, если подходящей записи нет
+        """
+        reply = self.get_exact(question)
+        return reply if reply is not None else self.get_similar(question)
+
+    def put(self, question: str, reply: str, cost: float = 0.0, vector: list = None, semantic: bool = True):
+        """
+        Сохранение ответа на вопрос
+
+        Args:
+            question: вопрос пользователя
+            reply: ответ на вопрос
+            cost: время получения ответа в секундах (для подсчёта сэкономленного времени)
+            vector: готовый эмбеддинг вопроса (None - вычисляется функцией embed)
+            semantic: False - запись находится только по тексту вопроса, эмбеддинг не вычисляется
+        """
+        key = self.normalize(question)
+        if not semantic:
+            vector = None
+        elif vector is not None:
+            vector = self._unit(vector)
+        else:
+            vector = self._vector(question)
+        with self._lock:
+            self._entries[key] = {
+                'reply': reply,
+                'vector': vector,
+                'cost': cost,
+                'expires_at': time.monotonic() + self.ttl
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._changed()
+
+    def stats(self) -> dict:
+        """Счётчики попаданий и промахов кэша"""
+        with self._lock:
+            total = self.hits_exact + self.hits_semantic + self.misses
+            return {
+                'size': len(self._entries),
+                'hits_exact': self.hits_exact,
+                'hits_semantic': self.hits_semantic,
+                'misses': self.misses,
+                'hit_rate': (self.hits_exact + self.hits_semantic) / total if total else 0.0,
+                'saved_seconds': round(self.saved_seconds, 3)
+            }
@@ -0,0 +1,129 @@
+"""
+Прогрев кэша частых вопросов.
+История чата читается постранично, вопросы пользователей нормализуются и группируются
+в кластеры почти одинаковых формулировок. Для самых частых кластеров заранее выполняются
+классификация, поиск контекста и генерация ответа, результат записывается в FAQ_PATH,
+откуда llm_agent подхватывает его без перезапуска.
+
+Пример запуска:
+    python -m llm_integration.faq_precompute --top 200 --min-count 5 --days 90
+"""
+import argparse
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from llm_integration.answer_cache import AnswerCache
+from llm_integration.llm_agent import FAQ_PATH, embed_questions, precompute_answer
+from utils.database import chat_manager
+from utils.qdrant_processor.near_duplicates import SketchIndex, sketch
+
+VARIANT_SIMILARITY = 0.6  # оценка коэффициента Жаккара для объединения формулировок в кластер
+MAX_VARIANTS = 20         # вариантов формулировки кластера, сохраняемых для точного совпадения
+PRECOMPUTE_WORKERS = 4
+
+
+def count_questions(since: datetime = None) -> Counter:
+    """Количество повторов каждой нормализованной формулировки вопроса"""
+    counts = Counter()
+    for message in chat_manager.iter_messages(author='user', since=since):
+        key = AnswerCache.normalize(message.get('text') or '')
+        if key:
+            counts[key] += 1
+    return counts
+
+
+def cluster_questions(counts: Counter, threshold: float = VARIANT_SIMILARITY) -> list:
+    """
+    Объединение почти одинаковых формулировок. Формулировки обходятся от частых к редким,
+    и каждая присоединяется к кластеру самой похожей из уже встреченных
+
+    Returns:
+        Список кластеров {'question': самая частая формулировка, 'variants': [...], 'count': N},
+        от частых к редким
+    """
+    index = SketchIndex()
+    clusters = {}
+    owners = {}
+    for key, count in counts.most_common():
+        signature = sketch(key)
+        similar = index.similar(signature, threshold) if signature else []
+        owner = owners[similar[0][0]] if similar else key
+        owners[key] = owner
+        if signature:
+            index.add(key, signature)
+        cluster = clusters.setdefault(owner, {'question': owner, 'variants': [], 'count': 0})
+        cluster['variants'].append(key)
+        cluster['count'] += count
+    return sorted(clusters.values(), key=lambda cluster: cluster['count'], reverse=True)
+
+
+def _precompute(cluster: dict):
+    try:
+        answer = precompute_answer(cluster['question'])
+    except Exception as e:
+        print(f'faq_precompute/_precompute>  Не удалось подготовить ответ на "{cluster["question"]}": {e}')
+        return None
+    if answer is None:
+        return None
+    return {**cluster, 'variants': cluster['variants'][:MAX_VARIANTS], **answer}
+
+
+def write_entries(entries: list, path: str = FAQ_PATH):
+    """Атомарная запись файла FAQ: llm_agent никогда не прочитает его наполовину записанным"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        for entry in entries:
+            file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def precompute(top: int = 200, min_count: int = 5, since: datetime = None, workers: int = PRECOMPUTE_WORKERS,
+               path: str = FAQ_PATH) -> dict:
+    """
+    Поиск частых вопросов в истории чата и подготовка ответов на них
+
+    Returns:
+        Словарь со статистикой: вопросов, формулировок, кластеров, частых кластеров и записанных ответов
+    """
+    counts = count_questions(since)
+    clusters = cluster_questions(counts)
+    frequent = [cluster for cluster in clusters if cluster['count'] >= min_count][:top]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        entries = [entry for entry in executor.map(_precompute, frequent) if entry is not None]
+    # Эмбеддинги записываются в файл, чтобы воркеры загружали его без обращений к модели эмбеддингов
+    if entries:
+        for entry, vector in zip(entries, embed_questions([entry['question'] for entry in entries])):
+            entry['vector'] = [round(float(value), 6) for value in vector]
+    write_entries(entries, path)
+    return {
+        'questions': sum(counts.values()),
+        'variants': len(counts),
+        'clusters': len(clusters),
+        'frequent': len(frequent),
+        'answers': len(entries)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Прогрев кэша ответов на частые вопросы')
+    parser.add_argument('--top', type=int, default=200, help='количество самых частых вопросов')
+    parser.add_argument('--min-count', type=int, default=5, help='минимальное количество повторов вопроса')
+    parser.add_argument('--days', type=float, default=0, help='учитывать только последние N дней (0 - всю историю)')
+    parser.add_argument('--workers', type=int, default=PRECOMPUTE_WORKERS, help='параллельных запросов к моделям')
+    parser.add_argument('--output', default=FAQ_PATH, help='файл с прогретыми ответами')
+    args = parser.parse_args()
+
+    since = datetime.now(timezone.utc) - timedelta(days=args.days) if args.days else None
+    stats = precompute(args.top, args.min_count, since, args.workers, args.output)
+    print(
+        f"Вопросов: {stats['questions']} ({stats['variants']} формулировок, {stats['clusters']} кластеров); "
+        f"частых: {stats['frequent']}, подготовлено ответов: {stats['answers']} -> {args.output}"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# Конфигурация Gunicorn для запуска сервера
+# По умолчанию используются кооперативные (gevent) воркеры: ожидание ответа LLM или базы
+# не занимает отдельный поток, и один процесс держит сотни одновременных диалогов.
+# Для синхронного режима: GUNICORN_WORKER_CLASS=gthread
+import glob
+import os
+
+# Метрики воркеров объединяются через файлы в общей директории (см. utils/metrics.py):
+# без этого каждый запрос /api/metrics попадал бы в случайный воркер с его собственными счётчиками
+os.environ.setdefault('METRICS_MULTIPROCESS_DIR', '/tmp/studenthelper-metrics')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8888')}"
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))  # только для gthread
+
+# Ответы с поиском в интернете и потоковые ответы могут идти десятки секунд
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '180'))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    # Файлы метрик прошлого запуска сервера не должны попадать в счётчики нового
+    for path in glob.glob(os.path.join(os.environ['METRICS_MULTIPROCESS_DIR'], 'metrics-*.json*')):
+        os.remove(path)
@@ -1,129 +1,591 @@
-import os
-import re
-from dotenv import load_dotenv
-from langchain_community.chat_models import ChatPerplexity
-from yandex_cloud_ml_sdk import YCloudML
-
-from llm_integration.llm_decider import llm_decider
-from llm_integration.llm_text_messages import *
-from utils.qdrant_processor.qdrant_processor import QdrantProcessor
-
-
-MAX_MESSAGES_SIZE = 3
-
-load_dotenv()
-perplexity_api_key = os.getenv('PERPLEXITY_API_KEY')
-yandex_folder_id = os.getenv('YANDEX_FOLDER_ID')
-yandex_api_key = os.getenv('YANDEX_API_KEY')
-
-# Инициализация Sonar из Perplexity
-sonar_model = ChatPerplexity(
-    model='sonar-reasoning',
-    temperature=0.5,
-    api_key=perplexity_api_key
-)
-
-# Инициализация Llama из YandexCloud
-sdk = YCloudML(
-    folder_id=yandex_folder_id,
-    auth=yandex_api_key,
-)
-llama_model = sdk.models.completions('llama').configure(
-    temperature=0.5,
-    max_tokens=2000,
-).langchain(model_type='chat')
-
-qdrant = QdrantProcessor()
-
-def format_response(response) -> str:
-    """
-    Простое форматирование ответа от LLM
-    
-    Args:
-        response: ответ от языковой модели определённой структуры
-    
-    Returns:
-        Строка с текстом ответа от языковой модели
-    """
-    text = response.content if hasattr(response, 'content') else str(response)
-    text = text.replace('###', '')
-    text = re.sub(r'\[\d+\]', '', text)
-    return f'{text.strip()}'
-
-
-def llm_agent(messages_history: list, question: str) -> str:
-    """
-    LLM агент, выдающий ответ на вопрос с учётом истории вопросов от пользователя.
-
-    Args:
-        messages_history: история вопросов с ответами от модели
-        question: вопрос, на который требуется получить ответ
-
-    Returns:
-        Строка с ответом на вопрос
-    """
-    category = llm_decider(question)
-
-    if category == 'Нелегальный, провокационный или связан с политикой':
-        reply = ANSWER_ILLEGAL_MESSAGE
-
-    elif category == 'Легальный, обычное общение, не требует поиска в интернете':
-        messages = [
-            {'role': 'system', 'content': SYSTEM_SIMPLE_MESSAGE},
-            *messages_history,
-            {'role': 'user', 'content': question}
-        ]
-        response = llama_model.invoke(messages)
-        reply = format_response(response)
-
-    elif category == 'Легальный, обычное общение, требует поиска в интернете':
-        reply = ANSWER_NOT_UNIVERSITY_MESSAGE
-
-    elif category == 'Легальный, связан с получением информации про получение образования':
-        messages = [{'role': 'system', 'content': SYSTEM_MAIN_MESSAGE}]
-
-        questions_history = [message['content'] for message in filter(lambda x: x['role'] == 'user', messages_history)]
-        contexts = qdrant.search(' '.join(questions_history + [question]))
-        context = contexts[0] if len(contexts) > 0 else {'score': 0, 'text': ''}
-        # print(f'llm_agent>  Вопросы от пользователя: {' | '.join(questions_history + [question])} (score: {context['score']})')
-
-        if context['score'] >= 0.85:
-            print(f'llm_agent>  Ответ пользователю с учётом контекста из Qdrant')
-            # Ответ на вопрос с использование контекста
-            messages.append({'role': 'user', 'content': USER_MAIN_WRAPPER(questions_history, question, context['text'])})
-            response = llama_model.invoke(messages)
-            reply = format_response(response)
-        else:
-            print(f'llm_agent>  Ответ пользователю с поиском в интернете')
-            # Ответ на вопрос при отсутствии подходящего контекста
-            messages += [
-                *messages_history,
-                {'role': 'user', 'content': question}
-            ]
-            response = sonar_model.invoke(
-                messages,
-                web_search_options={
-                    'search_context_size': 'high'
-                }
-            )
-            reply = format_response(response)
-            # Запись ответа в Qdrant
-            qdrant.upload_text(re.sub(r'<think>.*?</think>', '', reply, count=1, flags=re.DOTALL))
-
-    else:
-        reply = ANSWER_UNKNOWN_MESSAGE
-
-    return reply
-
-
-'''
-if __name__ == '__main__':
-    chat_history = chat_manager.get_messages()
-    messages = create_chat_history(chat_history)
-    while True:
-        question = input('Введите ваш вопрос (или \'выход\' для завершения): ')
-        if question.lower() in ('выход', 'exit', 'quit', ''):
-            print('Пока')
-            break
-        print('Ответ агента:', llm_agent(messages, question))
-'''
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from llm_integration.answer_cache import AnswerCache
+from llm_integration.llm_decider import known_label, llm_decider, LABEL_ILLEGAL, LABEL_SIMPLE, LABEL_NOT_UNIVERSITY, LABEL_EDUCATION
+from llm_integration.llm_text_messages import *
+from llm_integration.prompt_builder import QUERY_TOKEN_BUDGET, build_main_prompt, build_retrieval_query, fit_history, truncate
+from llm_integration.provider_gateway import ProviderGateway, ProviderUnavailable
+from utils import metrics
+from utils.clients import LazyClient, register
+from utils.qdrant_processor.qdrant_processor import QdrantProcessor
+
+
+MAX_MESSAGES_SIZE = 3
+ANSWER_CACHE_SIZE = 1000
+ANSWER_CACHE_TTL = 24 * 3600  # секунды
+ANSWER_CACHE_SIMILARITY = 0.95
+FAQ_PATH = os.getenv('FAQ_PATH', '.cache/faq.jsonl')
+FAQ_CACHE_SIZE = 5000
+FAQ_RELOAD_INTERVAL = 60  # секунды между проверками обновления файла FAQ
+PIPELINE_WORKERS = 32
+CONTEXT_PASSAGES = 4            # фрагментов из Qdrant в контексте (не более одного на документ)
+CONTEXT_CHAR_BUDGET = 3000      # суммарная длина фрагментов контекста в символах
+CONTEXT_MIN_SCORE = 0.85        # близость лучшего фрагмента, достаточная для ответа без поиска в интернете
+CONTEXT_EXTRA_MIN_SCORE = 0.75  # близость остальных фрагментов, добавляемых в контекст
+CONTEXT_MAX_AGE = 365 * 24 * 3600    # секунды: более старые фрагменты (прошлые приёмные кампании) не используются
+CONTEXT_HALF_LIFE = 180 * 24 * 3600  # секунды: за этот срок оценка фрагмента при ранжировании уменьшается вдвое
+
+# Общие для процесса клиенты (создаются при первом обращении): Sonar из Perplexity,
+# Llama из YandexCloud и база знаний в Qdrant. Модели вызываются через шлюз с ограничением
+# частоты и количества одновременных запросов, повторами и автоматом отключения
+sonar_model = ProviderGateway('sonar', LazyClient('sonar'), rate=1.0, burst=5, max_concurrency=8)
+llama_model = ProviderGateway('llama', LazyClient('llama'), rate=10.0, burst=20, max_concurrency=32)
+
+register('qdrant_processor', QdrantProcessor)
+qdrant = LazyClient('qdrant_processor')
+
+
+def embed_questions(questions: list) -> list:
+    '''
+    Эмбеддинги вопросов для кэшей ответов (одним запросом). Текст совпадает с поисковым запросом к Qdrant
+    для вопроса без истории, поэтому поиск контекста берёт этот эмбеддинг из кэша эмбеддингов, а не запрашивает заново
+    '''
+    return qdrant.embed([truncate(question, QUERY_TOKEN_BUDGET) for question in questions])
+
+
+def _embed_question(question: str) -> list:
+    return embed_questions([question])[0]
+
+
+# Кэш ответов на вопросы про поступление (совпадение по тексту и по эмбеддингу)
+answer_cache = AnswerCache(
+    embed=_embed_question,
+    max_size=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    similarity=ANSWER_CACHE_SIMILARITY
+)
+
+# Прогретые ответы на частые вопросы (готовит llm_integration.faq_precompute); проверяются первыми
+faq_cache = AnswerCache(max_size=0)
+_faq_state = {'mtime': None, 'checked': float('-inf'), 'loading': False}
+_faq_lock = threading.Lock()
+
+CATEGORIES_TOTAL = metrics.counter('studenthelper_categories_total', 'Распределение вопросов по категориям', ('category',))
+ANSWER_PATHS_TOTAL = metrics.counter(
+    'studenthelper_answer_paths_total', 'Способ получения ответа: кэш, шаблон, общение, Qdrant или поиск в интернете', ('path',)
+)
+metrics.gauge(
+    'studenthelper_answer_cache', 'Состояние кэша ответов',
+    lambda: {kind: value for kind, value in answer_cache.stats().items() if kind != 'hit_rate'}, ('kind',)
+)
+metrics.gauge(
+    'studenthelper_faq_cache', 'Состояние кэша частых вопросов',
+    lambda: {kind: value for kind, value in faq_cache.stats().items() if kind != 'hit_rate'}, ('kind',)
+)
+
+# Пул для параллельной загрузки истории, классификации и поиска контекста
+pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS)
+
+
+def format_response(response) -> str:
+    """
+    Простое форматирование ответа от LLM
+    
+    Args:
+        response: ответ от языковой модели определённой структуры
+    
+    Returns:
+        Строка с текстом ответа от языковой модели
+    """
+    text = response.content if hasattr(response, 'content') else str(response)
+    text = text.replace('###', '')
+    text = re.sub(r'\[\d+\]', '', text)
+    return f'{text.strip()}'
+
+
+class StreamFormatter:
+    """
+    Потоковое форматирование ответа от LLM: те же правила, что и в format_response,
+    плюс вырезание размышлений модели в блоке <think>...</think>.
+    Хвост буфера, который может оказаться началом тега или ссылки вида [1], придерживается
+    до прихода следующего фрагмента.
+    """
+    THINK_OPEN = '<think>'
+    THINK_CLOSE = '</think>'
+
+    def __init__(self):
+        self._buffer = ''
+        self._in_think = False
+        self._started = False
+        self._pending_spaces = ''
+        self.text = ''
+
+    @staticmethod
+    def _holdback(text: str, tag: str) -> int:
+        """Позиция, с которой хвост текста может быть началом тега, ссылки [N] или ###"""
+        for i in range(max(0, len(text) - len(tag) + 1), len(text)):
+            if tag.startswith(text[i:]):
+                return i
+        match = re.search(r'(\[\d*|#+)$', text)
+        return match.start() if match else len(text)
+
+    def _emit(self, text: str) -> str:
+        text = text.replace('###', '')
+        text = re.sub(r'\[\d+\]', '', text)
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ''
+            self._started = True
+        stripped = text.rstrip()
+        out = self._pending_spaces + stripped if stripped else ''
+        self._pending_spaces = text[len(stripped):] if stripped else self._pending_spaces + text
+        self.text += out
+        return out
+
+    def feed(self, chunk: str) -> list:
+        """
+        Обработка очередного фрагмента ответа
+
+        Args:
+            chunk: фрагмент текста от языковой модели
+
+        Returns:
+            Список пар (тип, текст), где тип - 'think' (размышления) или 'message' (ответ)
+        """
+        self._buffer += chunk
+        parts = []
+        while self._buffer:
+            tag = self.THINK_CLOSE if self._in_think else self.THINK_OPEN
+            index = self._buffer.find(tag)
+            if index == -1:
+                cut = self._holdback(self._buffer, tag)
+                head, self._buffer = self._buffer[:cut], self._buffer[cut:]
+            else:
+                head, self._buffer = self._buffer[:index], self._buffer[index + len(tag):]
+            if head:
+                parts.append(('think', head) if self._in_think else ('message', self._emit(head)))
+            if index == -1:
+                break
+            self._in_think = not self._in_think
+        return [(kind, text) for kind, text in parts if text]
+
+    def close(self) -> list:
+        """Выдача остатка буфера по окончании потока"""
+        rest, self._buffer = self._buffer, ''
+        if not rest:
+            return []
+        if self._in_think:
+            return [('think', rest)]
+        text = self._emit(rest)
+        return [('message', text)] if text else []
+
+
+def _record(timings: dict, stage: str, seconds: float):
+    """Запись длительности этапа в timings и в метрики процесса"""
+    timings[stage] = seconds
+    metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def _timed(timings: dict, stage: str, function, *args, **kwargs):
+    """Вызов функции с записью длительности этапа"""
+    started = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _record(timings, stage, time.perf_counter() - started)
+
+
+def _format_timings(timings: dict) -> str:
+    return ', '.join(f'{stage}={seconds * 1000:.0f}мс' for stage, seconds in timings.items())
+
+
+def load_faq(path: str = FAQ_PATH) -> AnswerCache:
+    """
+    Загрузка прогретых ответов из JSONL-файла в новый кэш (без срока жизни).
+    Эмбеддинг основной формулировки берётся из поля vector (его записывает faq_precompute),
+    а для строк без него вычисляется одним запросом на весь файл. Частые варианты
+    формулировки находятся только по тексту
+
+    Args:
+        path: путь к файлу с полями question, variants, reply, cost и vector в каждой строке
+
+    Returns:
+        Кэш с ответами на частые вопросы
+    """
+    cache = AnswerCache(
+        embed=_embed_question,
+        max_size=FAQ_CACHE_SIZE,
+        ttl=float('inf'),
+        similarity=ANSWER_CACHE_SIMILARITY
+    )
+    with open(path, encoding='utf-8') as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    missing = [entry for entry in entries if not entry.get('vector')]
+    if missing:
+        for entry, vector in zip(missing, embed_questions([entry['question'] for entry in missing])):
+            entry['vector'] = vector
+
+    for entry in entries:
+        cost = entry.get('cost', 0.0)
+        for variant in entry.get('variants', []):
+            cache.put(variant, entry['reply'], cost=cost, semantic=False)
+        cache.put(entry['question'], entry['reply'], cost=cost, vector=entry['vector'])
+    return cache
+
+
+def _reload_faq(mtime: float):
+    global faq_cache
+    try:
+        faq_cache = load_faq()
+        print(f'llm_agent/_reload_faq>  Загружено частых вопросов: {faq_cache.stats()["size"]}')
+    except Exception as e:
+        print(f'llm_agent/_reload_faq>  Не удалось загрузить частые вопросы: {e}')
+    finally:
+        with _faq_lock:
+            _faq_state['mtime'] = mtime
+            _faq_state['loading'] = False
+
+
+def _refresh_faq():
+    """Не чаще раза в FAQ_RELOAD_INTERVAL секунд проверка файла FAQ и его перезагрузка в фоне при изменении"""
+    now = time.monotonic()
+    with _faq_lock:
+        if _faq_state['loading'] or now - _faq_state['checked'] < FAQ_RELOAD_INTERVAL:
+            return
+        _faq_state['checked'] = now
+        try:
+            mtime = os.stat(FAQ_PATH).st_mtime
+        except OSError:
+            return
+        if mtime == _faq_state['mtime']:
+            return
+        _faq_state['loading'] = True
+    # Отдельный поток: загрузка не должна занимать пул обработки запросов
+    threading.Thread(target=_reload_faq, args=(mtime,), daemon=True).start()
+
+
+def _retrieval_query(messages_history: list, question: str) -> str:
+    """Запрос для поиска контекста в Qdrant: текущий вопрос и ограниченная часть последних вопросов пользователя"""
+    questions_history = [message['content'] for message in filter(lambda x: x['role'] == 'user', messages_history)]
+    return build_retrieval_query(questions_history, question)
+
+
+def _retrieve(query: str) -> list:
+    """Поиск в Qdrant лучших фрагментов разных документов в пределах бюджета контекста"""
+    return qdrant.search(
+        query, limit=CONTEXT_PASSAGES, per_parent=1, budget=CONTEXT_CHAR_BUDGET,
+        max_age=CONTEXT_MAX_AGE, half_life=CONTEXT_HALF_LIFE, record_hits=False
+    )
+
+
+def _classify_and_retrieve(messages_history, question: str, timings: dict):
+    """
+    Загрузка истории, классификация вопроса и поиск контекста в Qdrant.
+    Если вместо истории передана функция её загрузки (или Future с уже запущенной загрузкой),
+    все три этапа выполняются параллельно:
+    поиск контекста запускается сразу после загрузки истории, не дожидаясь классификации моделью,
+    и его результат отбрасывается, если категории вопроса контекст не нужен. Если категория известна
+    без модели (быстрая классификация или кэш решений), поиск выполняется только для вопросов про поступление.
+
+    Args:
+        messages_history: история вопросов с ответами от модели, функция её загрузки или Future загрузки
+        question: вопрос, на который требуется получить ответ
+        timings: словарь для записи длительностей этапов
+
+    Returns:
+        Кортеж из истории, категории вопроса и найденных контекстов (None, если поиск не нужен)
+    """
+    started = time.perf_counter()
+    if not callable(messages_history) and not isinstance(messages_history, Future):
+        category = _timed(timings, 'decider', llm_decider, question)
+        contexts = None
+        if category == LABEL_EDUCATION:
+            contexts = _timed(timings, 'retrieval', _retrieve, _retrieval_query(messages_history, question))
+        _record(timings, 'prepare', time.perf_counter() - started)
+        return messages_history, category, contexts
+
+    history_future = messages_history
+    if callable(messages_history):
+        history_future = pipeline_executor.submit(_timed, timings, 'history', messages_history)
+    if known_label(question) is not None:
+        category = _timed(timings, 'decider', llm_decider, question)
+        history = history_future.result()
+        contexts = None
+        if category == LABEL_EDUCATION:
+            contexts = _timed(timings, 'retrieval', _retrieve, _retrieval_query(history, question))
+        _record(timings, 'prepare', time.perf_counter() - started)
+        return history, category, contexts
+
+    category_future = pipeline_executor.submit(_timed, timings, 'decider', llm_decider, question)
+    # Спекулятивный поиск контекста (задача истории запущена раньше, поэтому ожидание её результата безопасно)
+    contexts_future = pipeline_executor.submit(
+        lambda: _timed(timings, 'retrieval', _retrieve, _retrieval_query(history_future.result(), question))
+    )
+    history = history_future.result()
+    category = category_future.result()
+    contexts = None
+    if category == LABEL_EDUCATION:
+        contexts = contexts_future.result()
+    else:
+        # cancel() снимает поиск, только если он ещё ждёт в очереди пула; начавшийся поиск
+        # доработает в фоне, а его результат отбрасывается (попадания фрагментов при этом не учитываются)
+        contexts_future.cancel()
+    _record(timings, 'prepare', time.perf_counter() - started)
+    return history, category, contexts
+
+
+def _cached_answer_or_prepare(messages_history, question: str, timings: dict) -> tuple:
+    """
+    Поиск готового ответа среди прогретых частых вопросов и в кэше ответов, а при промахе -
+    подготовка ответа модели. Кэши ищут ответ только по тексту вопроса, поэтому используются
+    лишь для вопросов вне диалога: уточнение в середине диалога ("а какой там проходной балл?")
+    получило бы ответ, не учитывающий его историю. Сначала проверяется совпадение по тексту,
+    затем поиск по эмбеддингу, и только при промахе запускаются классификация и поиск контекста:
+    промах добавляет к ответу задержку получения эмбеддинга (для повторяющихся формулировок он
+    берётся из кэша эмбеддингов), зато попадание не тратит вызов классификатора и поиск в Qdrant.
+
+    Returns:
+        (ответ, путь ответа, None) при попадании в кэш
+        или (None, None, (история, категория, контексты)) при промахе
+    """
+    _refresh_faq()
+    if callable(messages_history):
+        # Загрузка истории остаётся в пуле конвейера: при промахе классификация и поиск контекста
+        # продолжают выполняться параллельно (см. _classify_and_retrieve)
+        messages_history = pipeline_executor.submit(_timed, timings, 'history', messages_history)
+    history = messages_history.result() if isinstance(messages_history, Future) else messages_history
+    if not history:
+        started = time.perf_counter()
+        for lookup in ('get_exact', 'get_similar'):
+            for path, cache in (('faq', faq_cache), ('cache', answer_cache)):
+                reply = getattr(cache, lookup)(question)
+                if reply is not None:
+                    _record(timings, 'cache', time.perf_counter() - started)
+                    return reply, path, None
+        _record(timings, 'cache', time.perf_counter() - started)
+    return None, None, _classify_and_retrieve(messages_history, question, timings)
+
+
+def _prepare_answer(messages_history: list, question: str, category: str, contexts: list = None) -> dict:
+    """
+    Подготовка запроса к языковой модели по категории вопроса
+
+    Args:
+        messages_history: история вопросов с ответами от модели
+        question: вопрос, на который требуется получить ответ
+        category: категория вопроса от llm_decider
+        contexts: найденные в Qdrant контексты (для вопросов про поступление)
+
+    Returns:
+        Словарь с готовым ответом (reply) либо с моделью (model), сообщениями (messages),
+        параметрами вызова (kwargs) и признаком записи ответа в Qdrant (upload), а также путём ответа (path).
+        Признак cacheable означает, что ответ можно переиспользовать для того же вопроса от других пользователей:
+        кэш ищет ответ только по тексту вопроса, поэтому ответы, полученные с учётом истории диалога, не кэшируются.
+        Для поиска в интернете в fallback лежит запасной запрос на случай перегрузки Sonar
+        (если Sonar перегружен уже сейчас, сразу возвращается запасной запрос)
+    """
+    if category == LABEL_ILLEGAL:
+        return {'reply': ANSWER_ILLEGAL_MESSAGE, 'cacheable': True, 'path': 'constant'}
+
+    elif category == LABEL_SIMPLE:
+        messages = [
+            {'role': 'system', 'content': SYSTEM_SIMPLE_MESSAGE},
+            *fit_history(messages_history),
+            {'role': 'user', 'content': question}
+        ]
+        return {'model': llama_model, 'messages': messages, 'kwargs': {}, 'upload': False, 'cacheable': False, 'path': 'simple'}
+
+    elif category == LABEL_NOT_UNIVERSITY:
+        return {'reply': ANSWER_NOT_UNIVERSITY_MESSAGE, 'cacheable': True, 'path': 'constant'}
+
+    elif category == LABEL_EDUCATION:
+        messages = [{'role': 'system', 'content': SYSTEM_MAIN_MESSAGE}]
+        standalone = not messages_history  # ответ не зависит от контекста диалога этого пользователя
+
+        questions_history = [message['content'] for message in filter(lambda x: x['role'] == 'user', messages_history)]
+        context = contexts[0] if contexts else {'score': 0, 'text': ''}
+        used_contexts = [context] + [extra for extra in (contexts or [])[1:] if extra['score'] >= CONTEXT_EXTRA_MIN_SCORE]
+        context_text = '\n\n'.join(item['text'] for item in used_contexts)
+        # Использованными (для вытеснения невостребованных фрагментов) считаются только фрагменты из промпта
+        context_ids = [item['id'] for item in used_contexts if 'id' in item]
+        # print(f'llm_agent>  Вопросы от пользователя: {' | '.join(questions_history + [question])} (score: {context['score']})')
+
+        if context['score'] >= CONTEXT_MIN_SCORE:
+            print(f'llm_agent>  Ответ пользователю с учётом контекста из Qdrant')
+            # Ответ на вопрос с использование контекста
+            messages.append({'role': 'user', 'content': build_main_prompt(questions_history, question, context_text)})
+            qdrant.record_hits(context_ids)
+            return {'model': llama_model, 'messages': messages, 'kwargs': {}, 'upload': False, 'cacheable': standalone, 'path': 'qdrant'}
+        else:
+            print(f'llm_agent>  Ответ пользователю с поиском в интернете')
+            # Ответ на вопрос при отсутствии подходящего контекста
+            messages += [
+                *fit_history(messages_history),
+                {'role': 'user', 'content': question}
+            ]
+            kwargs = {'web_search_options': {'search_context_size': 'high'}}
+            # Запасной вариант при перегрузке Sonar: Llama с лучшим найденным в Qdrant контекстом
+            fallback = {
+                'model': llama_model,
+                'messages': [
+                    {'role': 'system', 'content': SYSTEM_MAIN_MESSAGE},
+                    {'role': 'user', 'content': build_main_prompt(questions_history, question, context_text)}
+                ],
+                'kwargs': {}, 'upload': False, 'cacheable': False, 'path': 'web_search_fallback'
+            }
+            prepared = {'model': sonar_model, 'messages': messages, 'kwargs': kwargs, 'upload': True, 'cacheable': standalone, 'path': 'web_search', 'fallback': fallback}
+            if sonar_model.available():
+                return prepared
+            qdrant.record_hits(context_ids)
+            return fallback
+
+    return {'reply': ANSWER_UNKNOWN_MESSAGE, 'cacheable': False, 'path': 'constant'}
+
+
+def _stream_chunks(prepared: dict, timings: dict, llm_started: float):
+    """Текст фрагментов потокового ответа модели с записью времени до первого фрагмента"""
+    for chunk in prepared['model'].stream(prepared['messages'], **prepared['kwargs']):
+        if 'first_token' not in timings:
+            _record(timings, 'first_token', time.perf_counter() - llm_started)
+        yield chunk.content if hasattr(chunk, 'content') else str(chunk)
+
+
+def llm_agent(messages_history, question: str, timings: dict = None) -> str:
+    """
+    LLM агент, выдающий ответ на вопрос с учётом истории вопросов от пользователя.
+
+    Args:
+        messages_history: история вопросов с ответами от модели или функция её загрузки
+            (тогда история загружается параллельно с классификацией и поиском контекста)
+        question: вопрос, на который требуется получить ответ
+        timings: словарь для записи длительностей этапов в секундах
+
+    Returns:
+        Строка с ответом на вопрос
+    """
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    cached, path, pipeline = _cached_answer_or_prepare(messages_history, question, timings)
+    if cached is not None:
+        ANSWER_PATHS_TOTAL.inc(path=path)
+        print(f'llm_agent>  Ответ пользователю из кэша {path} ({_format_timings(timings)})')
+        return cached
+
+    messages_history, category, contexts = pipeline
+    prepared = _prepare_answer(messages_history, question, category, contexts)
+    CATEGORIES_TOTAL.inc(category=category)
+    ANSWER_PATHS_TOTAL.inc(path=prepared['path'])
+    if 'reply' in prepared:
+        reply = prepared['reply']
+    else:
+        try:
+            response = _timed(timings, 'llm', prepared['model'].invoke, prepared['messages'], **prepared['kwargs'])
+        except ProviderUnavailable as e:
+            if 'fallback' not in prepared:
+                raise
+            print(f'llm_agent>  Запасной ответ без поиска в интернете: {e}')
+            prepared = prepared['fallback']
+            ANSWER_PATHS_TOTAL.inc(path=prepared['path'])
+            response = _timed(timings, 'llm', prepared['model'].invoke, prepared['messages'], **prepared['kwargs'])
+        reply = format_response(response)
+        if prepared['upload']:
+            # Запись ответа в Qdrant вне критического пути ответа пользователю
+            pipeline_executor.submit(
+                qdrant.upload_text, re.sub(r'<think>.*?</think>', '', reply, count=1, flags=re.DOTALL), 'web_search'
+            )
+
+    if prepared['cacheable']:
+        answer_cache.put(question, reply, cost=time.perf_counter() - started)
+    print(f'llm_agent>  Время этапов: {_format_timings(timings)}')
+    return reply
+
+
+def llm_agent_stream(messages_history, question: str, timings: dict = None):
+    """
+    Потоковый вариант llm_agent: фрагменты ответа выдаются по мере генерации моделью.
+
+    Args:
+        messages_history: история вопросов с ответами от модели или функция её загрузки
+        question: вопрос, на который требуется получить ответ
+        timings: словарь для записи длительностей этапов в секундах
+
+    Yields:
+        Пары (тип, текст), где тип - 'think' (размышления модели) или 'message' (ответ)
+
+    Returns:
+        Итоговый текст ответа без размышлений (значение StopIteration)
+    """
+    timings = {} if timings is None else timings
+    formatter = StreamFormatter()
+    started = time.perf_counter()
+    cached, path, pipeline = _cached_answer_or_prepare(messages_history, question, timings)
+    if cached is not None:
+        ANSWER_PATHS_TOTAL.inc(path=path)
+        print(f'llm_agent_stream>  Ответ пользователю из кэша {path} ({_format_timings(timings)})')
+        yield from formatter.feed(cached)
+        yield from formatter.close()
+        return formatter.text
+
+    messages_history, category, contexts = pipeline
+    prepared = _prepare_answer(messages_history, question, category, contexts)
+    CATEGORIES_TOTAL.inc(category=category)
+    ANSWER_PATHS_TOTAL.inc(path=prepared['path'])
+    if 'reply' in prepared:
+        yield from formatter.feed(prepared['reply'])
+    else:
+        llm_started = time.perf_counter()
+        try:
+            for content in _stream_chunks(prepared, timings, llm_started):
+                yield from formatter.feed(content)
+        except ProviderUnavailable as e:
+            # Шлюз выбрасывает ProviderUnavailable только до первого фрагмента ответа
+            if 'fallback' not in prepared:
+                raise
+            print(f'llm_agent_stream>  Запасной ответ без поиска в интернете: {e}')
+            prepared = prepared['fallback']
+            ANSWER_PATHS_TOTAL.inc(path=prepared['path'])
+            for content in _stream_chunks(prepared, timings, llm_started):
+                yield from formatter.feed(content)
+        _record(timings, 'llm', time.perf_counter() - llm_started)
+    yield from formatter.close()
+
+    if prepared.get('upload') and formatter.text:
+        # Запись ответа в Qdrant вне критического пути ответа пользователю
+        pipeline_executor.submit(qdrant.upload_text, formatter.text, 'web_search')
+    if prepared['cacheable'] and formatter.text:
+        answer_cache.put(question, formatter.text, cost=time.perf_counter() - started)
+    print(f'llm_agent_stream>  Время этапов: {_format_timings(timings)}')
+    return formatter.text
+
+
+def precompute_answer(question: str):
+    """
+    Подготовка ответа на частый вопрос без истории диалога (для прогрева кэша частых вопросов)
+
+    Args:
+        question: вопрос пользователя
+
+    Returns:
+        Словарь с категорией (category), путём (path), ответом (reply) и временем его получения (cost)
+        или None, если ответ нельзя переиспользовать для других пользователей
+    """
+    started = time.perf_counter()
+    _, category, contexts = _classify_and_retrieve([], question, {})
+    prepared = _prepare_answer([], question, category, contexts)
+    if not prepared['cacheable']:
+        return None
+    if 'reply' in prepared:
+        reply = prepared['reply']
+    else:
+        response = prepared['model'].invoke(prepared['messages'], **prepared['kwargs'])
+        reply = re.sub(r'<think>.*?</think>', '', format_response(response), count=1, flags=re.DOTALL).strip()
+    return {'category': category, 'path': prepared['path'], 'reply': reply, 'cost': round(time.perf_counter() - started, 3)}
+
+
+'''
+if __name__ == '__main__':
+    chat_history = chat_manager.get_messages()
+    messages = create_chat_history(chat_history)
+    while True:
+        question = input('Введите ваш вопрос (или \'выход\' для завершения): ')
+        if question.lower() in ('выход', 'exit', 'quit', ''):
+            print('Пока')
+            break
+        print('Ответ агента:', llm_agent(messages, question))
+'''
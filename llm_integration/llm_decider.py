@@ -1,25 +1,131 @@
-from yandex_cloud_ml_sdk import YCloudML
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-api_key = os.getenv("YANDEX_API_KEY")
-folder_id = os.getenv("YANDEX_FOLDER_ID")
-
-sdk = YCloudML(
-    folder_id=folder_id,
-    auth=api_key,
-)
-
-def llm_decider(question):
-    model = sdk.models.text_classifiers("yandexgpt").configure(
-        task_description="Определи тип запроса пользователя",
-        labels=["Нелегальный, провокационный или связан с политикой",
-                "Легальный, обычное общение, не требует поиска в интернете",
-                "Легальный, обычное общение, требует поиска в интернете",
-                "Легальный, связан с получением информации про получение образования"]
-    )
-
-    result = model.run(question)
-    best_label = max(result, key=lambda x: x.confidence)
-    return best_label.label
+import threading
+import time
+from collections import OrderedDict
+
+from llm_integration.answer_cache import AnswerCache
+from utils import metrics
+from utils.clients import LazyClient, get_yandex_sdk, register
+
+LABEL_ILLEGAL = "Нелегальный, провокационный или связан с политикой"
+LABEL_SIMPLE = "Легальный, обычное общение, не требует поиска в интернете"
+LABEL_NOT_UNIVERSITY = "Легальный, обычное общение, требует поиска в интернете"
+LABEL_EDUCATION = "Легальный, связан с получением информации про получение образования"
+
+CACHE_SIZE = 5000
+CACHE_TTL = 6 * 3600  # секунды
+
+# Короткие приветствия и реплики, не требующие классификации моделью
+SIMPLE_PHRASES = {
+    'привет', 'приветик', 'здравствуй', 'здравствуйте', 'добрый день', 'добрый вечер', 'доброе утро',
+    'хай', 'hi', 'hello', 'спасибо', 'спасибо большое', 'благодарю', 'пока', 'до свидания', 'ок', 'окей',
+    'ok', 'понятно', 'ясно', 'хорошо', 'отлично', 'класс', 'супер', 'как дела', 'привет как дела', 'кто ты',
+    'ты кто', 'что ты умеешь', 'да', 'нет', 'ага'
+}
+
+# Основы слов, однозначно указывающие на вопрос про поступление
+EDUCATION_STEMS = (
+    'поступ', 'абитуриент', 'егэ', 'вуз', 'университет', 'институт', 'академи', 'колледж', 'техникум',
+    'бакалавриат', 'магистратур', 'аспирантур', 'специалитет', 'приемн', 'проходн', 'балл', 'бюджетн',
+    'факультет', 'кафедр', 'направлени подготовки', 'олимпиад', 'зачислен', 'вступительн', 'общежити',
+    'стипенди', 'целев', 'мгу', 'спбгу', 'мфти', 'мифи', 'вшэ', 'итмо', 'бауманк'
+)
+
+# Слова, при наличии которых вопрос всегда отправляется на классификацию моделью
+SENSITIVE_STEMS = (
+    'полит', 'президент', 'путин', 'войн', 'выбор', 'митинг', 'наркот', 'оружи', 'взлом', 'убит', 'бомб',
+    'террор', 'купить диплом', 'купить аттестат', 'подделк', 'взятк'
+)
+
+register('classifier', lambda: get_yandex_sdk().models.text_classifiers("yandexgpt").configure(
+    task_description="Определи тип запроса пользователя",
+    labels=[LABEL_ILLEGAL, LABEL_SIMPLE, LABEL_NOT_UNIVERSITY, LABEL_EDUCATION]
+))
+model = LazyClient('classifier')
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+stats = {'fast_path': 0, 'cache': 0, 'model': 0}
+metrics.gauge('studenthelper_decider_decisions', 'Способ классификации вопросов', lambda: dict(stats), ('source',))
+# Та же нормальная форма, что и у ключей кэша ответов
+normalize = AnswerCache.normalize
+
+
+def fast_classify(normalized: str):
+    """
+    Локальная классификация очевидных случаев без обращения к модели
+
+    Args:
+        normalized: нормализованный вопрос
+
+    Returns:
+        Категория вопроса или None, если случай не очевиден
+    """
+    if not normalized:
+        return LABEL_SIMPLE
+    if any(stem in normalized for stem in SENSITIVE_STEMS):
+        return None
+    if normalized in SIMPLE_PHRASES:
+        return LABEL_SIMPLE
+    words = normalized.split()
+    if any(word.startswith(EDUCATION_STEMS) for word in words) or any(
+        ' ' in stem and stem in normalized for stem in EDUCATION_STEMS
+    ):
+        return LABEL_EDUCATION
+    return None
+
+
+def decider_stats() -> dict:
+    """Счётчики способов классификации и доля вопросов, решённых без обращения к модели"""
+    with _lock:
+        total = sum(stats.values())
+        return {
+            **stats,
+            'fast_path_rate': stats['fast_path'] / total if total else 0.0,
+            'no_model_rate': (stats['fast_path'] + stats['cache']) / total if total else 0.0
+        }
+
+
+def known_label(question: str):
+    """
+    Категория вопроса, если она известна без обращения к модели (быстрая классификация или кэш решений)
+
+    Returns:
+        Категория вопроса или None, если нужна классификация моделью
+    """
+    normalized = normalize(question)
+    label = fast_classify(normalized)
+    if label is not None:
+        return label
+    with _lock:
+        cached = _cache.get(normalized)
+    return cached[0] if cached is not None and cached[1] > time.monotonic() else None
+
+
+def llm_decider(question):
+    normalized = normalize(question)
+
+    label = fast_classify(normalized)
+    if label is not None:
+        with _lock:
+            stats['fast_path'] += 1
+        return label
+
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(normalized)
+        if cached is not None and cached[1] > now:
+            _cache.move_to_end(normalized)
+            stats['cache'] += 1
+            return cached[0]
+
+    with metrics.span('classifier_remote'):
+        result = model.run(question)
+    best_label = max(result, key=lambda x: x.confidence)
+
+    with _lock:
+        stats['model'] += 1
+        _cache[normalized] = (best_label.label, now + CACHE_TTL)
+        _cache.move_to_end(normalized)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return best_label.label
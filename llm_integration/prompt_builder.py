@@ -0,0 +1,138 @@
+import re
+
+from llm_integration.llm_text_messages import USER_MAIN_WRAPPER
+from utils import metrics
+from utils.qdrant_processor.lexical_index import tokenize
+
+CHARS_PER_TOKEN = 3            # средняя длина токена русского текста в символах (оценка без токенизатора)
+PROMPT_TOKEN_BUDGET = 1500     # токены на вопрос, историю и контекст в запросе с контекстом из Qdrant
+HISTORY_TOKEN_BUDGET = 600     # токены на историю диалога в остальных запросах к моделям
+HISTORY_SHARE = 0.25           # доля бюджета запроса, отводимая под предыдущие вопросы
+QUERY_TOKEN_BUDGET = 120       # токены поискового запроса к Qdrant
+QUERY_HISTORY_WEIGHTS = (0.5, 0.25)  # доли бюджета запроса для последних вопросов (от новых к старым)
+
+PROMPT_TOKENS = metrics.counter(
+    'studenthelper_prompt_tokens_total', 'Оценка токенов в запросах к моделям после сокращения', ('part',)
+)
+PROMPT_TOKENS_SAVED = metrics.counter(
+    'studenthelper_prompt_tokens_saved_total', 'Оценка токенов, убранных из запросов к моделям', ('part',)
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка количества токенов текста"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _record(part: str, original: int, result: int):
+    PROMPT_TOKENS.inc(result, part=part)
+    if original > result:
+        PROMPT_TOKENS_SAVED.inc(original - result, part=part)
+
+
+def truncate(text: str, budget: int) -> str:
+    """Обрезка текста до бюджета токенов по границе слова"""
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    space = cut.rfind(' ')
+    return (cut[:space] if space > limit // 2 else cut).rstrip() + '…'
+
+
+def compress(text: str, query: str, budget: int) -> str:
+    """
+    Сокращение текста до бюджета токенов: остаются предложения, больше всего
+    пересекающиеся по термам с запросом, в исходном порядке
+
+    Args:
+        text: исходный текст (например, контекст из Qdrant)
+        query: запрос, по которому оценивается полезность предложений
+        budget: бюджет токенов
+
+    Returns:
+        Сокращённый текст
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    sentences = [sentence for sentence in re.split(r'(?<=[.!?…])\s+|\n+', text) if sentence.strip()]
+    terms = set(tokenize(query))
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(terms.intersection(tokenize(sentences[i]))), i)
+    )
+    chosen, used = set(), 0
+    for i in ranked:
+        cost = estimate_tokens(sentences[i]) + 1
+        if used + cost <= budget:
+            chosen.add(i)
+            used += cost
+    if not chosen:
+        return truncate(sentences[ranked[0]], budget)
+    return ' '.join(sentences[i] for i in sorted(chosen))
+
+
+def build_main_prompt(questions_history: list, question: str, context: str, budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    """
+    Текст запроса с историей вопросов и контекстом (USER_MAIN_WRAPPER) в пределах бюджета токенов.
+    Вопрос сохраняется целиком (если сам не превышает бюджет), под предыдущие вопросы отводится
+    HISTORY_SHARE бюджета начиная с последних, контекст сокращается до оставшегося бюджета.
+    """
+    original = estimate_tokens(USER_MAIN_WRAPPER(questions_history, question, context))
+    question = truncate(question, budget // 2)
+    remaining = budget - estimate_tokens(question) - estimate_tokens(USER_MAIN_WRAPPER([], '', ''))
+
+    history_budget = int(remaining * HISTORY_SHARE)
+    history = []
+    for previous in reversed(questions_history):
+        previous = truncate(previous, max(1, history_budget // 2))
+        cost = estimate_tokens(previous)
+        if cost > history_budget:
+            break
+        history.insert(0, previous)
+        history_budget -= cost
+    remaining -= sum(map(estimate_tokens, history))
+
+    context = compress(context, ' '.join(history + [question]), max(0, remaining))
+    prompt = USER_MAIN_WRAPPER(history, question, context)
+    _record('prompt', original, estimate_tokens(prompt))
+    return prompt
+
+
+def fit_history(messages_history: list, budget: int = HISTORY_TOKEN_BUDGET) -> list:
+    """
+    История диалога в пределах бюджета токенов: сообщения берутся начиная с последних,
+    длинные ответы модели обрезаются, не поместившиеся старые сообщения отбрасываются
+    """
+    original = sum(estimate_tokens(message['content']) for message in messages_history)
+    fitted, used = [], 0
+    for message in reversed(messages_history):
+        content = truncate(message['content'], max(1, (budget - used) // 2 if message['role'] != 'user' else budget - used))
+        cost = estimate_tokens(content)
+        if used + cost > budget:
+            break
+        fitted.insert(0, {**message, 'content': content})
+        used += cost
+    _record('history', original, used)
+    return fitted
+
+
+def build_retrieval_query(questions_history: list, question: str, budget: int = QUERY_TOKEN_BUDGET) -> str:
+    """
+    Поисковый запрос к Qdrant: текущий вопрос и не более len(QUERY_HISTORY_WEIGHTS) последних
+    вопросов, каждому из которых отводится своя доля бюджета (чем старше вопрос, тем меньше)
+    """
+    original = estimate_tokens(' '.join(questions_history + [question]))
+    question = truncate(question, budget)
+    remaining = budget - estimate_tokens(question)
+    parts = []
+    for previous, weight in zip(reversed(questions_history), QUERY_HISTORY_WEIGHTS):
+        share = int(budget * weight)
+        if share < 1 or remaining < 1:
+            break
+        previous = truncate(previous, min(share, remaining))
+        remaining -= estimate_tokens(previous)
+        parts.insert(0, previous)
+    query = ' '.join(parts + [question])
+    _record('query', original, estimate_tokens(query))
+    return query
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import random
+import threading
+import time
+
+from utils import metrics
+from utils.single_flight import SingleFlight
+
+PROVIDER_CALLS = metrics.counter(
+    'studenthelper_provider_calls_total', 'Обращения к языковым моделям по результату', ('provider', 'result')
+)
+
+
+class ProviderUnavailable(Exception):
+    '''Провайдер перегружен (нет свободных слотов или токенов) либо отключён автоматом'''
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate токенов в секунду, не более burst подряд"""
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: float) -> bool:
+        """Получение токена с ожиданием не дольше timeout секунд"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def available(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens >= 1
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения провайдера: после failure_threshold ошибок подряд запросы не
+    отправляются reset_timeout секунд, затем пропускается один пробный запрос.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def cancel(self):
+        '''Отмена пробного запроса, который так и не был отправлен'''
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class ProviderGateway:
+    """
+    Шлюз к языковой модели с тем же интерфейсом (invoke и stream), что и у клиента.
+    Ограничивает частоту (TokenBucket) и количество одновременных запросов, объединяет
+    одинаковые одновременные запросы invoke в один, повторяет неудачные запросы с
+    паузой со случайным разбросом и отключает провайдера автоматом при серии ошибок.
+    Если запрос не может быть отправлен или все попытки неудачны, выбрасывается ProviderUnavailable.
+    """
+    def __init__(self, name: str, client, rate: float, burst: int, max_concurrency: int,
+                 acquire_timeout: float = 5.0, max_attempts: int = 3, backoff: float = 0.5,
+                 breaker: CircuitBreaker = None):
+        """
+        Args:
+            name: имя провайдера для метрик
+            client: клиент модели с методами invoke и stream
+            rate: допустимое количество запросов в секунду
+            burst: допустимое количество запросов подряд
+            max_concurrency: максимальное количество одновременных запросов
+            acquire_timeout: максимальное ожидание токена или слота в секундах
+            max_attempts: количество попыток одного запроса
+            backoff: пауза перед первым повтором в секундах (удваивается с каждой попыткой)
+            breaker: автомат отключения провайдера
+        """
+        self.name = name
+        self.client = client
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._active = 0
+        self._active_lock = threading.Lock()
+        self._flights = SingleFlight()
+        metrics.gauge(
+            f'studenthelper_provider_{name}_active', f'Одновременные запросы к провайдеру {name}', lambda: self._active
+        )
+
+    def available(self) -> bool:
+        '''Можно ли сейчас отправить запрос без ожидания'''
+        return not self.breaker.is_open and self._active < self.max_concurrency and self.bucket.available()
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def _acquire(self):
+        if not self.breaker.allow():
+            PROVIDER_CALLS.inc(provider=self.name, result='circuit_open')
+            raise ProviderUnavailable(f'{self.name}: провайдер временно отключён')
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self.breaker.cancel()
+            PROVIDER_CALLS.inc(provider=self.name, result='saturated')
+            raise ProviderUnavailable(f'{self.name}: нет свободных слотов')
+        remaining = max(0.0, self.acquire_timeout - (time.monotonic() - started))
+        if not self.bucket.acquire(remaining):
+            self._slots.release()
+            self.breaker.cancel()
+            PROVIDER_CALLS.inc(provider=self.name, result='rate_limited')
+            raise ProviderUnavailable(f'{self.name}: превышена частота запросов')
+        with self._active_lock:
+            self._active += 1
+
+    def _release(self):
+        with self._active_lock:
+            self._active -= 1
+        self._slots.release()
+
+    def _finish(self, recorded: bool):
+        """
+        Освобождение слота после запроса. Запрос, прерванный не ошибкой провайдера
+        (клиент отключился посреди потока - GeneratorExit, GreenletExit), не даёт ни успеха,
+        ни ошибки: если он был пробным, автомат должен пропустить следующий пробный запрос
+        """
+        if not recorded:
+            self.breaker.cancel()
+            PROVIDER_CALLS.inc(provider=self.name, result='cancelled')
+        self._release()
+
+    def _invoke(self, messages: list, kwargs: dict):
+        for attempt in range(self.max_attempts):
+            self._acquire()
+            recorded = False
+            try:
+                response = self.client.invoke(messages, **kwargs)
+            except Exception as e:
+                recorded = True
+                self.breaker.failure()
+                PROVIDER_CALLS.inc(provider=self.name, result='error')
+                if attempt + 1 >= self.max_attempts or self.breaker.is_open:
+                    raise ProviderUnavailable(f'{self.name}: {e}') from e
+                print(f'provider_gateway/{self.name}>  Ошибка запроса (попытка {attempt + 1}): {e}')
+            else:
+                recorded = True
+                self.breaker.success()
+                PROVIDER_CALLS.inc(provider=self.name, result='success')
+                return response
+            finally:
+                self._finish(recorded)
+            time.sleep(self._delay(attempt))
+
+    def invoke(self, messages: list, **kwargs):
+        '''Запрос к модели; одинаковые одновременные запросы выполняются один раз'''
+        key = hashlib.sha256(json.dumps([messages, kwargs], sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+        response, shared = self._flights.do(key, self._invoke, messages, kwargs)
+        if shared:
+            PROVIDER_CALLS.inc(provider=self.name, result='coalesced')
+        return response
+
+    def stream(self, messages: list, **kwargs):
+        '''Потоковый запрос к модели; повторяется, только если ошибка произошла до первого фрагмента'''
+        for attempt in range(self.max_attempts):
+            self._acquire()
+            started = False
+            recorded = False
+            try:
+                for chunk in self.client.stream(messages, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                recorded = True
+                self.breaker.failure()
+                PROVIDER_CALLS.inc(provider=self.name, result='error')
+                if started:
+                    raise
+                if attempt + 1 >= self.max_attempts or self.breaker.is_open:
+                    raise ProviderUnavailable(f'{self.name}: {e}') from e
+                print(f'provider_gateway/{self.name}>  Ошибка потокового запроса (попытка {attempt + 1}): {e}')
+            else:
+                recorded = True
+                self.breaker.success()
+                PROVIDER_CALLS.inc(provider=self.name, result='success')
+                return
+            finally:
+                self._finish(recorded)
+            time.sleep(self._delay(attempt))
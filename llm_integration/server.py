@@ -1,104 +1,210 @@
-import re
-import threading
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from time import sleep
-
-from llm_integration.llm_agent import llm_agent
-from llm_integration.payment import check_payment
-from utils.database import chat_manager, users_manager, orders_manager, profiles_manager
-
-MAX_MESSAGES_SIZE = 2
-UPDATE_SUBSRIPTIONS_TIME = 300  # секунды
-
-app = Flask(__name__)
-CORS(app)
-
-
-@app.route("/api/send_message", methods=["POST"])
-def send_message():
-    data = request.json
-    user_id = data.get("user_id")
-    user_message = data.get("message")
-    if not user_message or not user_id:
-        return jsonify({"error": "No message or user_id provided"}), 400
-
-    chat_history = chat_manager.get_messages(user_id, MAX_MESSAGES_SIZE)
-    messages = [{'role': message['author'], 'content': message['text']} for message in chat_history]
-    bot_response = llm_agent(messages, user_message)
-    chat_manager.add_message(user_id, 'user', user_message)
-    chat_manager.add_message(user_id, 'assistant', re.sub(r'<think>.*?</think>', '', bot_response, count=1, flags=re.DOTALL))
-
-    return jsonify({"response": bot_response, "quickReplies": []})
-
-
-@app.route('/api/orders/', methods=['POST'])
-def create_order():
-    data = request.json
-    id = data.get('id')
-    order_id = data.get('order_id')
-
-    if id and order_id:
-        orders_manager.create_order(id, order_id)
-        return 'OK'
-    return jsonify({'error': 'Bad data'}), 400
-
-
-@app.route('/api/payments/', methods=['POST'])
-def notigication_payment():
-    data = request.json
-    result = check_payment(data)
-    print('---server/notification_payment---', data, '-----', result, '-----', sep='\n')
-
-    result['tocken'] = True
-    if not result['tocken'] or not result['order_status']:
-        return jsonify({'error': 'Bad tocken'}), 400
-
-    orders_manager.update_order_status(**result['order_status'])
-    user_id = orders_manager.get_user_by_order(result['order_status']['order_id'])
-
-    if result['confirmed']:
-        users_manager.set_new_subscribe(user_id, days=30)
-
-    return 'OK'
-
-
-@app.route("/api/profile/<int:vk_id>", methods=["GET"])
-def get_profile(vk_id):
-    try:
-        profile = profiles_manager.get_profile_by_vk_id(vk_id)
-        if profile:
-            return jsonify(profile)
-        return jsonify({"error": "Профиль не найден"}), 404
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-
-@app.route("/api/profile/<int:vk_id>", methods=["POST"])
-def update_profile(vk_id):
-    try:
-        data = request.json
-        updated = profiles_manager.update_profile_by_vk_id(
-            vk_id,
-            phone=data.get("phone"),
-            school=data.get("school"),
-            user_type=data.get("user_type")
-        )
-        if updated:
-            return jsonify({"success": True})
-        return jsonify({"error": "Не удалось обновить профиль"}), 400
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-
-def subscribes_checker():
-    while True:
-        users_manager.update_expired_subscriptions()
-        print('server/subscribes_checker> Выполнена проверка истёкших подписок')
-        sleep(UPDATE_SUBSRIPTIONS_TIME)
-
-
-if __name__ == "__main__":
-    thread = threading.Thread(target=subscribes_checker, daemon=True)
-    thread.start()
-    app.run(debug=True, host="0.0.0.0", port=5000)
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask_cors import CORS
+
+from llm_integration.llm_agent import llm_agent, llm_agent_stream
+from llm_integration.payment import check_payment
+from utils import clients, metrics
+from utils.database import chat_manager, users_manager, orders_manager
+from utils.database import profile_manager as profiles_manager
+from utils.database.payment_queue import PaymentQueue
+from utils.database.subscription_scheduler import scheduler as subscriptions_scheduler
+
+MAX_MESSAGES_SIZE = 2
+PARALLEL_PIPELINE = True  # загрузка истории параллельно с классификацией и поиском контекста
+REQUIRE_SUBSCRIPTION = os.getenv('REQUIRE_SUBSCRIPTION', '1') == '1'  # сообщения только с действующей подпиской
+
+app = Flask(__name__)
+CORS(app)
+
+REQUEST_SECONDS = metrics.histogram(
+    'studenthelper_http_request_seconds', 'Длительность обработки HTTP-запросов', ('endpoint', 'status')
+)
+PAYMENT_NOTIFICATIONS = metrics.counter(
+    'studenthelper_payment_notifications_total', 'Уведомления об оплате: новые и повторные', ('result',)
+)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+
+# Клиенты создаются лениво; фоновый прогрев убирает их инициализацию из первого запроса
+if os.getenv('WARMUP_CLIENTS', '1') == '1':
+    clients.warm_up()
+
+
+def load_history(user_id):
+    '''Загрузка последних сообщений пользователя в формате истории для языковой модели'''
+    chat_history = chat_manager.get_messages(user_id, MAX_MESSAGES_SIZE)
+    return [{'role': message['author'], 'content': message['text']} for message in chat_history]
+
+
+@app.route("/api/send_message", methods=["POST"])
+def send_message():
+    data = request.json
+    user_id = data.get("user_id")
+    user_message = data.get("message")
+    if not user_message or not user_id:
+        return jsonify({"error": "No message or user_id provided"}), 400
+    if REQUIRE_SUBSCRIPTION and not users_manager.has_active_subscription(user_id):
+        return jsonify({"error": "Subscription required"}), 402
+
+    asked_at = datetime.now(timezone.utc)
+    messages = (lambda: load_history(user_id)) if PARALLEL_PIPELINE else load_history(user_id)
+    bot_response = llm_agent(messages, user_message)
+    chat_manager.add_exchange(
+        user_id, user_message, re.sub(r'<think>.*?</think>', '', bot_response, count=1, flags=re.DOTALL), asked_at
+    )
+
+    return jsonify({"response": bot_response, "quickReplies": []})
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    '''Формирование события в формате Server-Sent Events'''
+    payload = f'data: {json.dumps(data, ensure_ascii=False)}\n\n'
+    return f'event: {event}\n{payload}' if event else payload
+
+
+@app.route("/api/send_message_stream", methods=["POST"])
+def send_message_stream():
+    data = request.json
+    user_id = data.get("user_id")
+    user_message = data.get("message")
+    if not user_message or not user_id:
+        return jsonify({"error": "No message or user_id provided"}), 400
+    if REQUIRE_SUBSCRIPTION and not users_manager.has_active_subscription(user_id):
+        return jsonify({"error": "Subscription required"}), 402
+
+    asked_at = datetime.now(timezone.utc)
+    messages = (lambda: load_history(user_id)) if PARALLEL_PIPELINE else load_history(user_id)
+
+    def generate():
+        stream = llm_agent_stream(messages, user_message)
+        try:
+            while True:
+                kind, text = next(stream)
+                yield sse_event({'text': text}, 'think' if kind == 'think' else None)
+        except StopIteration as stop:
+            bot_response = stop.value or ''
+        except Exception as e:
+            print('server/send_message_stream> Ошибка при генерации ответа:', e)
+            yield sse_event({'error': 'Не удалось получить ответ'}, 'error')
+            return
+
+        chat_manager.add_exchange(user_id, user_message, bot_response, asked_at)
+        yield sse_event({'response': bot_response, 'quickReplies': []}, 'done')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/orders/', methods=['POST'])
+def create_order():
+    data = request.json
+    id = data.get('id')
+    order_id = data.get('order_id')
+
+    if id and order_id:
+        orders_manager.create_order(id, order_id)
+        return 'OK'
+    return jsonify({'error': 'Bad data'}), 400
+
+
+@app.route('/api/payments/', methods=['POST'])
+def notigication_payment():
+    data = request.json
+    result = check_payment(data)
+    print('---server/notification_payment---', data, '-----', result, '-----', sep='\n')
+
+    result['tocken'] = True
+    if not result['tocken'] or not result['order_status']:
+        return jsonify({'error': 'Bad tocken'}), 400
+
+    # Уведомление сохраняется в очередь и подтверждается сразу; повторы банка отбрасываются
+    is_new = payments_queue.put(data)
+    PAYMENT_NOTIFICATIONS.inc(result='new' if is_new else 'duplicate')
+    return 'OK'
+
+
+def process_payment(data: dict) -> bool:
+    '''Обработка уведомления об оплате из очереди: статус заказа и подписка пользователя'''
+    result = check_payment(data)
+    # Обновление возвращает строки заказа, из которых сразу берётся пользователь
+    rows = orders_manager.update_order_status(**result['order_status'])
+    if rows is None:
+        return False
+    user_id = rows[0]['id'] if rows else None
+
+    if result['confirmed'] and user_id is not None:
+        return users_manager.set_new_subscribe(user_id, days=30) is not None
+    return True
+
+
+payments_queue = PaymentQueue(process_payment)
+payments_queue.start()
+
+
+@app.route("/api/profile/<int:vk_id>", methods=["GET"])
+def get_profile(vk_id):
+    try:
+        profile, etag = profiles_manager.get_profile_with_etag(vk_id)
+        if not profile:
+            return jsonify({"error": "Профиль не найден"}), 404
+        # Неизменившийся профиль отдаётся ответом 304 без тела
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(profile)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/profile/<int:vk_id>", methods=["POST"])
+def update_profile(vk_id):
+    try:
+        data = request.json
+        updated = profiles_manager.update_profile_by_vk_id(
+            vk_id,
+            phone=data.get("phone"),
+            school=data.get("school"),
+            user_type=data.get("user_type")
+        )
+        if updated:
+            return jsonify({"success": True})
+        return jsonify({"error": "Не удалось обновить профиль"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Окончание подписок: очередь сроков ведёт один из воркеров (выбирается файловой блокировкой)
+if os.getenv('SUBSCRIPTIONS_SCHEDULER', '1') == '1':
+    subscriptions_scheduler.start()
+
+
+if __name__ == "__main__":
+    app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,78 @@
+import pytest
+
+from utils.database import history_cache as history_cache_module
+from utils.database.history_cache import HistoryCache, SharedVersions
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(history_cache_module.time, 'monotonic', clock)
+    return clock
+
+
+def message(author, text):
+    return {'author': author, 'text': text, 'created_at': text}
+
+
+def test_append_extends_entry(clock):
+    cache = HistoryCache(ttl=15)
+    cache.set(1, [message('user', 'q1'), message('assistant', 'a1')], complete=True)
+    clock.now += 30  # генерация ответа дольше ttl
+    assert cache.get(1, 2) is None
+
+    cache.set(1, [message('user', 'q1'), message('assistant', 'a1')], complete=True)
+    clock.now += 10
+    cache.append(1, [message('user', 'q2'), message('assistant', 'a2')])
+    clock.now += 10  # пользователь печатает следующий вопрос
+    assert [m['text'] for m in cache.get(1, 4)] == ['q1', 'a1', 'q2', 'a2']
+
+
+def test_other_worker_append_invalidates(tmp_path, clock):
+    path = str(tmp_path / 'versions')
+    worker_a = HistoryCache(ttl=600, versions=SharedVersions(path))
+    worker_b = HistoryCache(ttl=600, versions=SharedVersions(path))
+    worker_a.set(1, [], complete=True, version=worker_a.version(1))
+    worker_b.set(1, [], complete=True, version=worker_b.version(1))
+
+    worker_b.append(1, [message('user', 'q1'), message('assistant', 'a1')])
+    assert worker_a.get(1, 2) is None
+    assert [m['text'] for m in worker_b.get(1, 2)] == ['q1', 'a1']
+
+
+def test_chat_manager_reads_history_once(tmp_path, monkeypatch, clock):
+    pytest.importorskip('dotenv')
+    from benchmarks.fakes import FakeSupabase
+    from utils import clients
+    from utils.database import chat_manager
+
+    class CountingSupabase(FakeSupabase):
+        selects = 0
+
+        def execute(self, query):
+            if query.action == 'select':
+                self.selects += 1
+            return super().execute(query)
+
+    database = CountingSupabase(latency=0)
+    clients.override('supabase', database)
+    monkeypatch.setattr(chat_manager, 'history_cache', HistoryCache(
+        max_messages=chat_manager.HISTORY_CACHE_MESSAGES, ttl=chat_manager.HISTORY_CACHE_TTL,
+        versions=SharedVersions(str(tmp_path / 'versions'))
+    ))
+
+    assert chat_manager.get_messages(1, 2) == []
+    assert database.selects == 1
+    clock.now += 30
+    chat_manager.add_exchange(1, 'вопрос', 'ответ')
+    clock.now += 30
+    assert [m['text'] for m in chat_manager.get_messages(1, 2)] == ['вопрос', 'ответ']
+    assert database.selects == 1
@@ -0,0 +1,16 @@
+from utils.database.payment_queue import PaymentQueue
+
+
+def test_failed_notification_requeued_by_retry(tmp_path):
+    results = [False]
+    queue = PaymentQueue(lambda data: results[0], path=str(tmp_path / 'payments.sqlite3'), max_attempts=1)
+    notification = {'OrderId': 'order-1', 'Status': 'CONFIRMED'}
+
+    assert queue.put(notification)
+    assert queue.process() == 1  # единственная попытка неудачна - уведомление в состоянии failed
+
+    results[0] = True
+    assert queue.put(notification)  # повтор от банка возвращает уведомление в очередь
+    assert queue.process() == 1
+    assert not queue.put(notification)  # после успешной обработки повтор отсеивается
+    assert queue.process() == 0
@@ -0,0 +1,20 @@
+from llm_integration.provider_gateway import CircuitBreaker, ProviderGateway
+
+
+class StreamingClient:
+    def stream(self, messages, **kwargs):
+        yield 'первый'
+        yield 'второй'
+
+
+def test_closed_stream_releases_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.failure()
+    gateway = ProviderGateway('test', StreamingClient(), rate=100, burst=100, max_concurrency=1, breaker=breaker)
+
+    stream = gateway.stream([])
+    assert next(stream) == 'первый'  # пробный запрос после reset_timeout
+    stream.close()  # клиент отключился посреди ответа
+
+    assert gateway._active == 0
+    assert breaker.allow()
@@ -0,0 +1,180 @@
+"""
+Общие клиенты внешних сервисов (Supabase, Qdrant, YandexCloud ML, Perplexity).
+Клиенты регистрируются в реестре фабриками и создаются лениво - при первом обращении,
+один раз на процесс. Все модули разделяют один клиент, поэтому запросы к сервису идут
+через один пул соединений, а импорт модулей не требует доступности сервисов.
+"""
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SUPABASE_TIMEOUT = 10  # секунды
+QDRANT_URL = 'http://qdrant:6333'
+QDRANT_TIMEOUT = 10  # секунды
+
+_factories = {}
+_clients = {}
+_lock = threading.RLock()
+startup_timings = {}
+
+
+def _init_grpc_for_gevent():
+    '''Перевод gRPC (используется YandexCloud ML SDK) на кооперативный ввод-вывод, если процесс работает под gevent'''
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+    if monkey.is_module_patched('socket'):
+        import grpc.experimental.gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+
+
+_init_grpc_for_gevent()
+
+
+def register(name: str, factory):
+    '''Регистрация фабрики клиента (уже созданный клиент с этим именем не пересоздаётся)'''
+    with _lock:
+        _factories[name] = factory
+
+
+def override(name: str, client):
+    '''Подмена клиента готовым объектом (для тестов и бенчмарков)'''
+    with _lock:
+        _clients[name] = client
+
+
+def get(name: str):
+    '''Получение общего клиента по имени с созданием при первом обращении'''
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                started = time.perf_counter()
+                client = _clients[name] = _factories[name]()
+                startup_timings[name] = time.perf_counter() - started
+    return client
+
+
+def warm_up(names: list = None, background: bool = True):
+    '''
+    Заблаговременное создание клиентов, чтобы первый запрос не ждал инициализации
+
+    Args:
+        names: имена клиентов (None - все зарегистрированные)
+        background: создавать клиенты в фоновом потоке
+    '''
+    def run():
+        for name in names or list(_factories):
+            try:
+                get(name)
+            except Exception as e:
+                print(f'clients/warm_up> Не удалось создать клиент {name}: {e}')
+        print('clients/warm_up> Время создания клиентов:', {
+            name: f'{seconds * 1000:.0f}мс' for name, seconds in startup_timings.items()
+        })
+
+    if background:
+        threading.Thread(target=run, daemon=True).start()
+    else:
+        run()
+
+
+class LazyClient:
+    '''Заместитель клиента из реестра: клиент создаётся при первом обращении к его атрибутам'''
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        return getattr(get(self._name), attribute)
+
+    def __repr__(self):
+        return f'LazyClient({self._name!r})'
+
+
+def _create_supabase():
+    from supabase import create_client, ClientOptions
+    return create_client(
+        os.getenv('SUPABASE_URL_PROFILES'),
+        os.getenv('SUPABASE_KEY_PROFILES'),
+        options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT)
+    )
+
+
+def _create_qdrant():
+    from qdrant_client import QdrantClient
+    return QdrantClient(url=QDRANT_URL, timeout=QDRANT_TIMEOUT)
+
+
+def _create_yandex_sdk():
+    from yandex_cloud_ml_sdk import YCloudML
+    return YCloudML(
+        folder_id=os.getenv('YANDEX_FOLDER_ID'),
+        auth=os.getenv('YANDEX_API_KEY'),
+    )
+
+
+def _create_embeddings():
+    from langchain_community.embeddings.yandex import YandexGPTEmbeddings
+    return YandexGPTEmbeddings(
+        api_key=os.getenv('YANDEX_API_KEY'),
+        folder_id=os.getenv('YANDEX_FOLDER_ID')
+    )
+
+
+def _create_sonar():
+    from langchain_community.chat_models import ChatPerplexity
+    return ChatPerplexity(
+        model='sonar-reasoning',
+        temperature=0.5,
+        api_key=os.getenv('PERPLEXITY_API_KEY')
+    )
+
+
+def _create_llama():
+    return get_yandex_sdk().models.completions('llama').configure(
+        temperature=0.5,
+        max_tokens=2000,
+    ).langchain(model_type='chat')
+
+
+register('supabase', _create_supabase)
+register('qdrant', _create_qdrant)
+register('yandex_sdk', _create_yandex_sdk)
+register('embeddings', _create_embeddings)
+register('sonar', _create_sonar)
+register('llama', _create_llama)
+
+
+def get_supabase():
+    '''Общий клиент Supabase для всех менеджеров базы данных'''
+    return get('supabase')
+
+
+def get_qdrant():
+    '''Общий клиент Qdrant'''
+    return get('qdrant')
+
+
+def get_yandex_sdk():
+    '''Общий SDK YandexCloud ML (языковые модели и классификатор)'''
+    return get('yandex_sdk')
+
+
+def get_embeddings():
+    '''Общий клиент эмбеддингов YandexGPT'''
+    return get('embeddings')
+
+
+def get_sonar():
+    '''Модель Sonar из Perplexity с поиском в интернете'''
+    return get('sonar')
+
+
+def get_llama():
+    '''Модель Llama из YandexCloud'''
+    return get('llama')
@@ -0,0 +1,167 @@
+"""
+Выгрузка и архивация истории чата.
+Сообщения читаются постранично (chat_manager.iter_messages) и записываются в сжатые
+сегменты JSONL (gzip) по segment_rows строк. При архивации сообщения старше заданного
+возраста удаляются из таблицы только после того, как их сегмент полностью записан на диск,
+поэтому таблица chat_history остаётся небольшой, а запросы истории пользователя - быстрыми.
+
+Пример запуска:
+    python -m utils.database.chat_archive archive --older-than-days 180 --dry-run
+    python -m utils.database.chat_archive archive --interval 86400
+    python -m utils.database.chat_archive export chat_history.jsonl.gz --days 30
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from utils.database import chat_manager
+
+ARCHIVE_DIR = os.getenv('CHAT_ARCHIVE_DIR', 'archive/chat_history')
+ARCHIVE_AFTER_DAYS = float(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '180'))
+SEGMENT_ROWS = 50000
+
+
+class SegmentWriter:
+    """
+    Запись сжатого сегмента JSONL: строки пишутся во временный файл, который
+    переименовывается в итоговый только при успешном закрытии
+    """
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.tmp_path = os.path.join(directory, f'.segment-{os.getpid()}.jsonl.gz.tmp')
+        self._file = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+        self.first_id = None
+        self.last_id = None
+        self.rows = 0
+
+    def write(self, row: dict):
+        self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        if self.first_id is None:
+            self.first_id = row['id']
+        self.last_id = row['id']
+        self.rows += 1
+
+    def close(self) -> str:
+        """Закрытие сегмента; возвращает путь к итоговому файлу"""
+        self._file.close()
+        path = os.path.join(self.directory, f'chat_history-{self.first_id:012d}-{self.last_id:012d}.jsonl.gz')
+        with open(self.tmp_path, 'rb') as file:
+            os.fsync(file.fileno())
+        os.replace(self.tmp_path, path)
+        return path
+
+    def discard(self):
+        self._file.close()
+        os.remove(self.tmp_path)
+
+
+def iter_segments(directory: str = ARCHIVE_DIR):
+    """Потоковое чтение сообщений из архивных сегментов в порядке id"""
+    for path in sorted(glob.glob(os.path.join(directory, 'chat_history-*.jsonl.gz'))):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
+
+
+def export(path: str, since: datetime = None, before: datetime = None) -> int:
+    """
+    Выгрузка истории чата в один сжатый файл JSONL без изменения таблицы
+
+    Returns:
+        Количество выгруженных сообщений
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    rows = 0
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+        for row in chat_manager.iter_messages(since=since, before=before):
+            file.write(json.dumps(row, ensure_ascii=False) + '\n')
+            rows += 1
+    os.replace(tmp_path, path)
+    return rows
+
+
+def archive(older_than_days: float = ARCHIVE_AFTER_DAYS, directory: str = ARCHIVE_DIR,
+            segment_rows: int = SEGMENT_ROWS, dry_run: bool = False) -> dict:
+    """
+    Перенос сообщений старше older_than_days дней в архивные сегменты с удалением из таблицы
+
+    Returns:
+        Словарь со статистикой: заархивировано и удалено сообщений, записано сегментов
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    stats = {'archived': 0, 'deleted': 0, 'segments': 0}
+    if dry_run:
+        stats['archived'] = sum(1 for _ in chat_manager.iter_messages(before=cutoff))
+        return stats
+
+    def finish(segment):
+        segment.close()
+        stats['segments'] += 1
+        stats['archived'] += segment.rows
+        # Удаление страницами, уже пройденными чтением: следующие страницы начинаются после last_id
+        stats['deleted'] += chat_manager.delete_messages(segment.first_id, segment.last_id, cutoff)
+
+    segment = None
+    try:
+        for row in chat_manager.iter_messages(before=cutoff):
+            if segment is None:
+                segment = SegmentWriter(directory)
+            segment.write(row)
+            if segment.rows >= segment_rows:
+                finish(segment)
+                segment = None
+        if segment is not None:
+            finish(segment)
+            segment = None
+    finally:
+        if segment is not None:
+            segment.discard()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка и архивация истории чата')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    archive_parser = commands.add_parser('archive', help='перенос старых сообщений в сжатые сегменты')
+    archive_parser.add_argument('--older-than-days', type=float, default=ARCHIVE_AFTER_DAYS, help='возраст сообщений в днях')
+    archive_parser.add_argument('--dir', default=ARCHIVE_DIR, help='директория архива')
+    archive_parser.add_argument('--segment-rows', type=int, default=SEGMENT_ROWS, help='сообщений в одном сегменте')
+    archive_parser.add_argument('--interval', type=float, default=0, help='повторять каждые N секунд (0 - один раз)')
+    archive_parser.add_argument('--dry-run', action='store_true', help='только посчитать, ничего не удаляя')
+
+    export_parser = commands.add_parser('export', help='выгрузка истории в один сжатый файл JSONL')
+    export_parser.add_argument('output', help='путь к файлу .jsonl.gz')
+    export_parser.add_argument('--days', type=float, default=0, help='только последние N дней (0 - вся история)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        since = datetime.now(timezone.utc) - timedelta(days=args.days) if args.days else None
+        print(f'Выгружено сообщений: {export(args.output, since=since)} -> {args.output}')
+        return
+
+    while True:
+        try:
+            stats = archive(args.older_than_days, args.dir, args.segment_rows, args.dry_run)
+            if args.dry_run:
+                print(f"Будет заархивировано сообщений: {stats['archived']}")
+            else:
+                print(
+                    f"Заархивировано сообщений: {stats['archived']} в {stats['segments']} сегментов, "
+                    f"удалено из таблицы: {stats['deleted']}"
+                )
+        except Exception as e:
+            print(f'database/chat_archive>  Ошибка при архивации: {e}')
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
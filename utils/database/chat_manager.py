@@ -1,16 +1,31 @@
-from supabase import create_client
-from dotenv import load_dotenv
 import os
+from datetime import datetime, timezone
+
+from utils import metrics
+from utils.clients import LazyClient
+from utils.database.chat_writer import ChatWriter
+from utils.database.history_cache import HistoryCache, SharedVersions
 
 TABLE_NAME = 'chat_history'
+WRITE_INTERVAL = 1.0  # секунды
+WRITE_SPILL_PATH = os.getenv('CHAT_SPILL_PATH', '.cache/chat_history_unsaved.jsonl')
+HISTORY_CACHE_USERS = 10000
+HISTORY_CACHE_MESSAGES = 10
+HISTORY_CACHE_TTL = 600  # секунды с последнего чтения или дозаписи истории пользователя
+# Общий для воркеров файл версий историй: сообщения, записанные другим воркером, сбрасывают кэш
+HISTORY_VERSIONS_PATH = os.getenv('HISTORY_VERSIONS_PATH', '/tmp/studenthelper-history.versions')
+PAGE_SIZE = 1000
 
-load_dotenv()
-url = os.getenv('SUPABASE_URL_PROFILES')
-key = os.getenv('SUPABASE_KEY_PROFILES')
+# Общий для всех менеджеров клиент Supabase (создаётся при первом запросе)
+supabase = LazyClient('supabase')
 
-supabase = create_client(url, key)
+history_cache = HistoryCache(
+    max_users=HISTORY_CACHE_USERS, max_messages=HISTORY_CACHE_MESSAGES, ttl=HISTORY_CACHE_TTL,
+    versions=SharedVersions(HISTORY_VERSIONS_PATH)
+)
 
 
+@metrics.timed('history_read')
 def get_messages(user_id: int = None, limit: int = None) -> list:
     """
     Получение истории чата с возможным ограничение по количеству сообщений
@@ -22,16 +37,30 @@ def get_messages(user_id: int = None, limit: int = None) -> list:
     Returns:
         Список всех сообщений, отсортированных от старых к новым
     """
+    if user_id is not None and limit is not None:
+        cached = history_cache.get(user_id, limit * 2)
+        if cached is not None:
+            return cached
+        if limit * 2 <= HISTORY_CACHE_MESSAGES:
+            return _load_recent_messages(user_id)[-limit * 2:] if limit else []
+
     try:
+        if limit is None:
+            # Вся история читается постранично (один запрос вернул бы не больше лимита строк PostgREST)
+            messages = [
+                {'author': row['author'], 'text': row['text'], 'created_at': row['created_at']}
+                for row in iter_messages(user_id=user_id)
+            ]
+            return sorted(messages, key=lambda message: message['created_at'])
+
         query = (
             supabase.table(TABLE_NAME)
             .select('author', 'text', 'created_at')
             .order('created_at', desc=True)
+            .limit(limit * 2)
         )
         if user_id is not None:
             query = query.eq('user_id', user_id)
-        if limit is not None:
-            query = query.limit(limit * 2)
 
         response = query.execute()
         return list(reversed(response.data)) if response.data else []
@@ -40,6 +69,99 @@ def get_messages(user_id: int = None, limit: int = None) -> list:
         return []
 
 
+def iter_messages(user_id: int = None, author: str = None, since: datetime = None, before: datetime = None,
+                  batch_size: int = PAGE_SIZE):
+    """
+    Потоковое чтение истории чата постранично по возрастанию id (без OFFSET:
+    каждая страница начинается после последнего id предыдущей), в памяти не больше одной страницы
+
+    Args:
+        user_id: только сообщения пользователя (None - все пользователи)
+        author: только сообщения автора (user или assistant; None - все)
+        since: только сообщения, созданные начиная с этого момента
+        before: только сообщения, созданные раньше этого момента
+        batch_size: количество сообщений в одном запросе
+
+    Yields:
+        Словари с полями id, user_id, author, text и created_at
+    """
+    last_id = None
+    while True:
+        query = (
+            supabase.table(TABLE_NAME)
+            .select('id', 'user_id', 'author', 'text', 'created_at')
+            .order('id')
+            .limit(batch_size)
+        )
+        if user_id is not None:
+            query = query.eq('user_id', user_id)
+        if author is not None:
+            query = query.eq('author', author)
+        if since is not None:
+            query = query.gte('created_at', since.isoformat())
+        if before is not None:
+            query = query.lt('created_at', before.isoformat())
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        with metrics.span('supabase_iter_messages'):
+            rows = query.execute().data or []
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['id']
+
+
+def delete_messages(first_id: int, last_id: int, before: datetime) -> int:
+    """
+    Удаление сообщений с id из диапазона [first_id, last_id], созданных раньше before
+    (используется архивацией после записи этих сообщений в архив)
+
+    Returns:
+        Количество удалённых сообщений
+    """
+    with metrics.span('supabase_delete_messages'):
+        response = (
+            supabase.table(TABLE_NAME)
+            .delete(count='exact', returning='minimal')
+            .gte('id', first_id)
+            .lte('id', last_id)
+            .lt('created_at', before.isoformat())
+            .execute()
+        )
+    return response.count or 0
+
+
+@metrics.timed('supabase_get_messages')
+def _load_recent_messages(user_id: int) -> list:
+    """Чтение последних сообщений пользователя из базы с заполнением кэша истории"""
+    # Версия читается до запроса: сообщения, записанные во время чтения, сбросят кэш
+    version = history_cache.version(user_id)
+    try:
+        response = (
+            supabase.table(TABLE_NAME)
+            .select('author', 'text', 'created_at')
+            .order('created_at', desc=True)
+            .eq('user_id', user_id)
+            .limit(HISTORY_CACHE_MESSAGES)
+            .execute()
+        )
+    except Exception as e:
+        print('database/chat_manager/get_messages>  Возникла ошибка при чтении:', e)
+        return []
+
+    messages = list(reversed(response.data)) if response.data else []
+    complete = len(messages) < HISTORY_CACHE_MESSAGES
+    # Сообщения, ещё не записанные в базу отложенной записью
+    stored = {(message['created_at'], message['author']) for message in messages}
+    for row in writer.pending(user_id=user_id):
+        if (row['created_at'], row['author']) not in stored:
+            messages.append({'author': row['author'], 'text': row['text'], 'created_at': row['created_at']})
+    messages = messages[-HISTORY_CACHE_MESSAGES:]
+    history_cache.set(user_id, messages, complete, version)
+    return messages
+
+
+@metrics.timed('supabase_add_message')
 def add_message(user_id: int, author: str, text: str) -> bool:
     """
     Сохранение сообщения в историю чата
@@ -59,6 +181,9 @@ def add_message(user_id: int, author: str, text: str) -> bool:
             .execute()
         )
         if response.data:
+            history_cache.append(user_id, [
+                {'author': author, 'text': text, 'created_at': response.data[0].get('created_at')}
+            ])
             return True
         else:
             print('database/chat_manager/add_message>  Произошла ошибка при записи:', response.error)
@@ -68,5 +193,61 @@ def add_message(user_id: int, author: str, text: str) -> bool:
         return False
 
 
+@metrics.timed('supabase_add_messages')
+def add_messages(messages: list) -> bool:
+    """
+    Сохранение нескольких сообщений в историю чата одной вставкой
+
+    Args:
+        messages: список словарей с полями user_id, author, text и (необязательно) created_at
+
+    Returns:
+        out: Результат сохранения сообщений в историю чата: True - успешно, False - не успешно
+    """
+    if not messages:
+        return True
+    try:
+        response = (
+            supabase.table(TABLE_NAME)
+            .insert(messages)
+            .execute()
+        )
+        if response.data:
+            # Новая версия после записи: другие воркеры могли прочитать базу до неё и закэшировать историю без этих строк
+            for user_id in {message['user_id'] for message in messages}:
+                history_cache.append(user_id, [])
+            return True
+        else:
+            print('database/chat_manager/add_messages>  Произошла ошибка при записи:', response.error)
+            return False
+    except Exception as e:
+        print('database/chat_manager/add_messages>  Произошла ошибка при записи:', e)
+        return False
+
+
+writer = ChatWriter(add_messages, flush_interval=WRITE_INTERVAL, spill_path=WRITE_SPILL_PATH)
+
+
+def add_exchange(user_id: int, question: str, answer: str, asked_at: datetime = None):
+    """
+    Постановка пары вопрос-ответ в очередь на запись в историю чата (без ожидания записи)
+
+    Args:
+        user_id: ID пользователя, для истории чата которого сообщения сохраняются
+        question: текст вопроса пользователя
+        answer: текст ответа языковой модели
+        asked_at: время получения вопроса (по умолчанию - текущее)
+    """
+    answered_at = datetime.now(timezone.utc)
+    # Время задаётся явно, так как строки записываются позже и одной вставкой
+    asked_at = asked_at or answered_at
+    rows = [
+        {'user_id': user_id, 'author': 'user', 'text': question, 'created_at': asked_at.isoformat()},
+        {'user_id': user_id, 'author': 'assistant', 'text': answer, 'created_at': answered_at.isoformat()}
+    ]
+    history_cache.append(user_id, [{k: row[k] for k in ('author', 'text', 'created_at')} for row in rows])
+    writer.put(rows)
+
+
 if __name__ == '__main__':
     print(get_messages())
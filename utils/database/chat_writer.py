@@ -0,0 +1,165 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class ChatWriter:
+    """
+    Отложенная (write-behind) запись сообщений чата.
+    Сообщения копятся в очереди и записываются фоновым потоком одной многострочной
+    вставкой раз в flush_interval секунд (или сразу при накоплении max_batch строк).
+    Неудачная пачка делится пополам, чтобы отделить строки, которые база не принимает,
+    от остальных; если не записывается и первая половина целиком, база считается недоступной
+    и повтор откладывается с экспоненциально растущей паузой. Строка, не записанная
+    max_attempts раз отдельной вставкой, а также строки, оставшиеся в очереди при остановке
+    процесса, дописываются в файл spill_path и возвращаются в очередь при следующем запуске.
+    """
+    def __init__(self, write, flush_interval: float = 1.0, max_batch: int = 500, max_attempts: int = 5,
+                 max_backoff: float = 60.0, spill_path: str = None):
+        """
+        Args:
+            write: функция записи списка строк, возвращающая True при успехе
+            flush_interval: период записи в секундах
+            max_batch: максимальное количество строк в одной вставке
+            max_attempts: количество попыток записи одной строки отдельной вставкой
+            max_backoff: максимальная пауза между повторами при недоступности базы в секундах
+            spill_path: файл JSONL для строк, которые не удалось записать (None - строки не сохраняются)
+        """
+        self.write = write
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.spill_path = spill_path
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._failures = 0
+        self._stopped = False
+        self._restore()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, rows: list):
+        """Постановка строк в очередь на запись"""
+        with self._condition:
+            self._queue.extend((row, 0) for row in rows)
+            if len(self._queue) >= self.max_batch:
+                self._condition.notify()
+
+    def pending(self, **filters) -> list:
+        """Строки, ещё не записанные в базу, с отбором по значениям полей"""
+        with self._condition:
+            return [row for row, _ in self._queue if all(row.get(k) == v for k, v in filters.items())]
+
+    def _spill(self, rows: list):
+        """Сохранение незаписанных строк в файл (дописывание, файл может быть общим для процессов)"""
+        if not rows:
+            return
+        if self.spill_path is None:
+            print('database/chat_writer/_spill>  Строк потеряно без записи в базу:', len(rows))
+            return
+        try:
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as file:
+                file.write(''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in rows))
+            print(f'database/chat_writer/_spill>  Строк сохранено в {self.spill_path}:', len(rows))
+        except OSError as e:
+            print(f'database/chat_writer/_spill>  Не удалось сохранить {len(rows)} строк: {e}')
+
+    def _restore(self):
+        """Возврат в очередь строк, сохранённых в файл (файл забирается переименованием одним процессом)"""
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return
+        claimed = f'{self.spill_path}.{os.getpid()}'
+        try:
+            os.replace(self.spill_path, claimed)
+        except OSError:
+            return
+        with open(claimed, encoding='utf-8') as file:
+            rows = [json.loads(line) for line in file if line.strip()]
+        self._queue.extend((row, 0) for row in rows)
+        os.remove(claimed)
+        print(f'database/chat_writer/_restore>  Строк возвращено в очередь из {self.spill_path}:', len(rows))
+
+    def _write(self, batch: list) -> list:
+        """
+        Запись пачки с делением неудачной пачки пополам
+
+        Returns:
+            Незаписанные строки; у строк, не записанных отдельной вставкой, увеличен счётчик попыток
+        """
+        if self.write([row for row, _ in batch]):
+            return []
+        if len(batch) == 1:
+            return [(batch[0][0], batch[0][1] + 1)]
+        middle = len(batch) // 2
+        failed = self._write(batch[:middle])
+        if middle > 1 and len(failed) == middle:
+            # Не записалась вся половина: вероятнее недоступность базы, чем плохие строки
+            return failed + batch[middle:]
+        return failed + self._write(batch[middle:])
+
+    def flush(self) -> bool:
+        """
+        Запись накопленных строк
+
+        Returns:
+            True, если очередь записана полностью
+        """
+        with self._flush_lock:
+            while True:
+                with self._condition:
+                    batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+                if not batch:
+                    self._failures = 0
+                    return True
+                failed = self._write(batch)
+                if not failed:
+                    continue
+                if len(failed) == len(batch):
+                    # Не записалось ничего: попытки не засчитываются, строки ждут восстановления базы
+                    failed = batch
+                retry = [(row, attempts) for row, attempts in failed if attempts < self.max_attempts]
+                self._spill([row for row, attempts in failed if attempts >= self.max_attempts])
+                with self._condition:
+                    self._queue.extendleft(reversed(retry))
+                if not retry:
+                    continue
+                self._failures += 1
+                return False
+
+    def _backoff(self) -> float:
+        return min(self.max_backoff, self.flush_interval * 2 ** max(0, self._failures - 1))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopped and len(self._queue) < self.max_batch:
+                    self._condition.wait(self.flush_interval)
+                stopped = self._stopped
+            started = time.monotonic()
+            if not self.flush() and not stopped:
+                # Пауза перед повтором растёт с каждой неудачей, чтобы не нагружать недоступную базу
+                deadline = started + self._backoff()
+                with self._condition:
+                    while not self._stopped and time.monotonic() < deadline:
+                        self._condition.wait(deadline - time.monotonic())
+            if stopped:
+                return
+
+    def close(self):
+        """Остановка фонового потока с записью оставшихся строк (незаписанные сохраняются в spill_path)"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout=10)
+        if not self.flush():
+            with self._condition:
+                rows = [row for row, _ in self._queue]
+                self._queue.clear()
+            self._spill(rows)
@@ -0,0 +1,151 @@
+import itertools
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+
+class SharedVersions:
+    """
+    Версии историй пользователей, общие для всех процессов-воркеров.
+    Файл из slots 8-байтных ячеек отображается в память каждого процесса; запись сообщений
+    пользователя помещает в его ячейку новую уникальную метку. Запись кэша истории действительна,
+    пока в ячейке лежит метка, с которой она была прочитана или дописана: сообщения другого
+    воркера меняют метку, и следующее чтение уходит в базу. Совпадение ячеек разных
+    пользователей приводит только к лишнему промаху.
+    """
+    SLOT = struct.Struct('<Q')
+
+    def __init__(self, path: str, slots: int = 1 << 16):
+        """
+        Args:
+            path: путь к файлу версий (общий для воркеров одного сервера)
+            slots: количество ячеек
+        """
+        self.slots = slots
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < slots * self.SLOT.size:
+                os.ftruncate(fd, slots * self.SLOT.size)
+            self._map = mmap.mmap(fd, slots * self.SLOT.size)
+        finally:
+            os.close(fd)
+        # Случайное начало счётчика: метки разных экземпляров не совпадают даже в одном процессе
+        self._counter = itertools.count(random.getrandbits(32))
+
+    def _offset(self, user_id) -> int:
+        return zlib.crc32(str(user_id).encode()) % self.slots * self.SLOT.size
+
+    def get(self, user_id) -> int:
+        """Текущая метка истории пользователя"""
+        return self.SLOT.unpack_from(self._map, self._offset(user_id))[0]
+
+    def bump(self, user_id) -> int:
+        """Новая метка истории пользователя (после записи его сообщений)"""
+        stamp = os.getpid() << 32 | next(self._counter) & 0xFFFFFFFF
+        self.SLOT.pack_into(self._map, self._offset(user_id), stamp)
+        return stamp
+
+
+class HistoryCache:
+    """
+    Кэш последних сообщений пользователей в памяти процесса.
+    Для каждого пользователя хранится кольцевой буфер из max_messages последних сообщений;
+    при превышении max_users вытесняются давно не использовавшиеся пользователи (LRU).
+    Запись пользователя живёт ttl секунд с момента последнего чтения из базы или дозаписи.
+    Если задан versions, запись сбрасывается, как только сообщения пользователя записал другой
+    процесс-воркер; без него такие сообщения видны не позже ttl.
+    """
+    def __init__(self, max_users: int = 10000, max_messages: int = 10, ttl: float = 15.0,
+                 versions: SharedVersions = None):
+        """
+        Args:
+            max_users: максимальное количество пользователей в кэше
+            max_messages: количество последних сообщений, хранимых для пользователя
+            ttl: время жизни записи пользователя в секундах
+            versions: общие для воркеров версии историй пользователей
+        """
+        self.max_users = max_users
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.versions = versions
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, user_id):
+        """Версия истории пользователя; читается до запроса в базу и передаётся в set"""
+        return self.versions.get(user_id) if self.versions is not None else None
+
+    def _valid(self, user_id, entry) -> bool:
+        return entry['expires_at'] > time.monotonic() and entry['version'] == self.version(user_id)
+
+    def get(self, user_id, count: int):
+        """
+        Получение последних сообщений пользователя
+
+        Args:
+            user_id: ID пользователя
+            count: количество последних сообщений
+
+        Returns:
+            Список сообщений от старых к новым или None, если в кэше их недостаточно
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and not self._valid(user_id, entry):
+                del self._users[user_id]
+                entry = None
+            if entry is None or count > self.max_messages or (len(entry['messages']) < count and not entry['complete']):
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return list(entry['messages'])[-count:] if count else []
+
+    def set(self, user_id, messages: list, complete: bool, version=None):
+        """
+        Заполнение кэша сообщениями пользователя
+
+        Args:
+            user_id: ID пользователя
+            messages: последние сообщения от старых к новым
+            complete: True, если это вся история пользователя
+            version: версия истории (HistoryCache.version), прочитанная до запроса в базу
+        """
+        with self._lock:
+            self._users[user_id] = {
+                'messages': deque(messages, maxlen=self.max_messages),
+                'complete': complete and len(messages) <= self.max_messages,
+                'expires_at': time.monotonic() + self.ttl,
+                'version': version
+            }
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def append(self, user_id, messages: list):
+        """
+        Дозапись новых сообщений пользователя, если он уже есть в кэше.
+        Дозапись продлевает жизнь записи: кэш по-прежнему совпадает с базой
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            valid = entry is not None and self._valid(user_id, entry)
+            version = self.versions.bump(user_id) if self.versions is not None else None
+            if entry is None:
+                return
+            if not valid:
+                del self._users[user_id]
+                return
+            entry['messages'].extend(messages)
+            if len(entry['messages']) == self.max_messages:
+                entry['complete'] = False
+            entry['expires_at'] = time.monotonic() + self.ttl
+            entry['version'] = version
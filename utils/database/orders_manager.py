@@ -1,16 +1,13 @@
-from supabase import create_client
-from dotenv import load_dotenv
-import os
+from utils import metrics
+from utils.clients import LazyClient
 
 TABLE_NAME = 'orders'
 
-load_dotenv()
-url = os.getenv('SUPABASE_URL_PROFILES')
-key = os.getenv('SUPABASE_KEY_PROFILES')
-
-supabase = create_client(url, key)
+# Общий для всех менеджеров клиент Supabase (создаётся при первом запросе)
+supabase = LazyClient('supabase')
 
 
+@metrics.timed('supabase_create_order')
 def create_order(user_id: str, order_id: str):
     '''Внесение в таблицу данных о заказе для определённого пользователя'''
     try:
@@ -28,8 +25,9 @@ def create_order(user_id: str, order_id: str):
         return None
 
 
+@metrics.timed('supabase_update_order_status')
 def update_order_status(order_id: str, status: str):
-    '''Обновление статуса заказа'''
+    '''Обновление статуса заказа; возвращает обновлённые строки заказа (с id пользователя) или None при ошибке'''
     try:
         response = supabase.table(TABLE_NAME).update({
             'status': status,
@@ -41,6 +39,7 @@ def update_order_status(order_id: str, status: str):
         return None
 
 
+@metrics.timed('supabase_get_user_by_order')
 def get_user_by_order(order_id: str):
     '''Получение id пользователя по номеру заказа'''
     try:
@@ -0,0 +1,174 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from hashlib import sha256
+
+QUEUE_PATH = os.getenv('PAYMENTS_QUEUE_PATH', '.cache/payments.sqlite3')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS notifications (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    claimed_by INTEGER,
+    claimed_at REAL,
+    created_at REAL NOT NULL
+)
+'''
+
+
+def notification_key(data: dict) -> str:
+    '''Ключ уведомления для отсеивания повторов: хэш номера заказа, статуса и всего уведомления'''
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return sha256(f'{data.get("OrderId")}\n{data.get("Status")}\n{payload}'.encode('utf-8')).hexdigest()
+
+
+class PaymentQueue:
+    """
+    Надёжная локальная очередь уведомлений об оплате (SQLite-файл, общий для всех воркеров).
+    Уведомление сохраняется в файл до ответа банку и обрабатывается фоновым потоком.
+    Повторное уведомление с тем же ключом не ставится в очередь, даже после обработки первого;
+    исключение - уведомление, так и не обработанное за max_attempts попыток (state = 'failed'):
+    повтор от банка возвращает его в очередь с новым счётчиком попыток.
+    Неудачная обработка повторяется с нарастающей паузой до max_attempts раз; уведомления,
+    взятые в работу упавшим процессом, возвращаются в очередь через claim_timeout секунд.
+    """
+    def __init__(self, handle, path: str = QUEUE_PATH, poll_interval: float = 1.0,
+                 max_attempts: int = 10, retry_delay: float = 5.0, claim_timeout: float = 300.0):
+        """
+        Args:
+            handle: функция обработки уведомления, возвращающая True при успехе
+            path: путь к файлу очереди
+            poll_interval: период проверки очереди в секундах
+            max_attempts: количество попыток обработки одного уведомления
+            retry_delay: пауза перед первым повтором в секундах (удваивается с каждой попыткой)
+            claim_timeout: время, после которого незавершённая обработка считается прерванной
+        """
+        self.handle = handle
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.claim_timeout = claim_timeout
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL')
+            self._local.connection = connection
+        return connection
+
+    def put(self, data: dict) -> bool:
+        """
+        Сохранение уведомления в очередь
+
+        Returns:
+            True, если уведомление новое (не повтор уже полученного) или повтор неудачно обработанного
+        """
+        cursor = self._connection().execute(
+            'INSERT INTO notifications (key, payload, next_attempt, created_at) VALUES (?, ?, ?, ?) '
+            "ON CONFLICT (key) DO UPDATE SET state = 'pending', attempts = 0, next_attempt = excluded.next_attempt, "
+            "claimed_by = NULL, claimed_at = NULL WHERE notifications.state = 'failed'",
+            (notification_key(data), json.dumps(data, ensure_ascii=False), time.time(), time.time())
+        )
+        if cursor.rowcount:
+            self._wakeup.set()
+        return bool(cursor.rowcount)
+
+    def _claim(self):
+        """Взятие в работу одного готового к обработке уведомления (атомарно между процессами)"""
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT key, payload, attempts FROM notifications "
+            "WHERE (state = 'pending' AND next_attempt <= ?) OR (state = 'processing' AND claimed_at <= ?) "
+            "ORDER BY next_attempt LIMIT 1",
+            (now, now - self.claim_timeout)
+        ).fetchone()
+        if row is None:
+            return None
+        key, payload, attempts = row
+        cursor = connection.execute(
+            "UPDATE notifications SET state = 'processing', claimed_by = ?, claimed_at = ? "
+            "WHERE key = ? AND (state = 'pending' OR (state = 'processing' AND claimed_at <= ?))",
+            (os.getpid(), now, key, now - self.claim_timeout)
+        )
+        # Уведомление успел взять другой процесс - просто ищем следующее
+        return (key, json.loads(payload), attempts) if cursor.rowcount else ()
+
+    def _finish(self, key: str, attempts: int, success: bool):
+        attempts += 1
+        if success:
+            state, next_attempt = 'done', time.time()
+        elif attempts >= self.max_attempts:
+            state, next_attempt = 'failed', time.time()
+            print(f'database/payment_queue> Уведомление {key} не обработано за {attempts} попыток')
+        else:
+            state, next_attempt = 'pending', time.time() + self.retry_delay * 2 ** (attempts - 1)
+        self._connection().execute(
+            'UPDATE notifications SET state = ?, attempts = ?, next_attempt = ?, claimed_by = NULL WHERE key = ?',
+            (state, attempts, next_attempt, key)
+        )
+
+    def process(self) -> int:
+        """
+        Обработка всех готовых уведомлений
+
+        Returns:
+            Количество обработанных уведомлений
+        """
+        processed = 0
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                return processed
+            if not claimed:
+                continue
+            key, data, attempts = claimed
+            try:
+                success = bool(self.handle(data))
+            except Exception as e:
+                print(f'database/payment_queue> Ошибка при обработке уведомления {key}: {e}')
+                success = False
+            self._finish(key, attempts, success)
+            processed += 1
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.process()
+            except Exception as e:
+                print(f'database/payment_queue> Ошибка очереди уведомлений: {e}')
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Запуск фонового потока обработки"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Остановка фонового потока (необработанные уведомления остаются в файле)"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
@@ -1,26 +1,105 @@
-from supabase import create_client
-from dotenv import load_dotenv
-import os
+import json
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
 
-# Загрузка переменных окружения
-load_dotenv()
-url = os.getenv('SUPABASE_URL_PROFILES')
-key = os.getenv('SUPABASE_KEY_PROFILES')
+from utils import metrics
+from utils.clients import LazyClient
+from utils.database import users_manager
+from utils.single_flight import SingleFlight
+
+PROFILE_CACHE_SIZE = 10000
+PROFILE_TTL = 30  # секунды (изменения из других воркеров видны не позже этого срока)
+
+# Общий для всех менеджеров клиент Supabase (создаётся при первом запросе)
+supabase = LazyClient('supabase')
+
+# Кэш профилей: vk_id -> (профиль, ETag, срок хранения по time.monotonic)
+_cache = OrderedDict()
+_generations = {}  # vk_id -> номер сброса; чтение, начатое до сброса, не попадает в кэш
+_lock = threading.Lock()
+_reads = SingleFlight()
+PROFILE_READS = metrics.counter(
+    'studenthelper_profile_reads_total', 'Чтения профилей по источнику ответа', ('source',)
+)
+
+
+def profile_etag(profile: dict) -> str:
+    '''ETag профиля: хэш его содержимого'''
+    payload = json.dumps(profile, sort_keys=True, ensure_ascii=False, default=str)
+    return sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def invalidate_profile(vk_id: int, *args):
+    '''Сброс профиля из кэша (вызывается при изменении профиля)'''
+    vk_id = int(vk_id)
+    with _lock:
+        _cache.pop(vk_id, None)
+        _generations[vk_id] = _generations.get(vk_id, 0) + 1
+    _reads.forget(vk_id)
+
+
+def _invalidate_subscriber(user_id: str, *args):
+    '''Сброс профилей пользователя при изменении подписки (подписка хранится по profiles.id, кэш - по vk_id)'''
+    with _lock:
+        vk_ids = [vk_id for vk_id, (profile, _, _) in _cache.items() if str(profile.get('id')) == str(user_id)]
+    for vk_id in vk_ids:
+        invalidate_profile(vk_id)
+
+
+users_manager.subscription_listeners.append(_invalidate_subscriber)
+
+
+@metrics.timed('supabase_get_profile_by_vk_id')
+def _load_profile(vk_id: int):
+    with _lock:
+        generation = _generations.get(vk_id, 0)
+    response = supabase.table("profiles") \
+        .select("*") \
+        .eq("vk_id", vk_id) \
+        .maybe_single() \
+        .execute()
+    profile = response.data if response else None
+    if not profile:
+        return None, None
+
+    etag = profile_etag(profile)
+    with _lock:
+        if _generations.get(vk_id, 0) == generation:
+            _cache[vk_id] = (profile, etag, time.monotonic() + PROFILE_TTL)
+            _cache.move_to_end(vk_id)
+            while len(_cache) > PROFILE_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return profile, etag
+
+
+def get_profile_with_etag(vk_id: int) -> tuple:
+    '''
+    Профиль пользователя и его ETag: (профиль, ETag) или (None, None), если профиля нет.
+    Одновременные чтения одного профиля выполняются одним запросом к базе.
+    '''
+    vk_id = int(vk_id)
+    with _lock:
+        cached = _cache.get(vk_id)
+        if cached is not None and cached[2] > time.monotonic():
+            _cache.move_to_end(vk_id)
+            PROFILE_READS.inc(source='cache')
+            return cached[0], cached[1]
+
+    (profile, etag), shared = _reads.do(vk_id, _load_profile, vk_id)
+    PROFILE_READS.inc(source='coalesced' if shared else 'database')
+    return profile, etag
 
-supabase = create_client(url, key)
 
 def get_profile_by_vk_id(vk_id: int):
     try:
-        response = supabase.table("profiles") \
-            .select("*") \
-            .eq("vk_id", vk_id) \
-            .maybe_single() \
-            .execute()
-        return response.data
+        return get_profile_with_etag(vk_id)[0]
     except Exception as e:
         print(f"get_profile_by_vk_id> Ошибка при получении профиля: {e}")
         return None
 
+@metrics.timed('supabase_update_profile_by_vk_id')
 def update_profile_by_vk_id(vk_id: int, phone=None, school=None, user_type=None, name=None, referral_source=None):
     try:
         update_data = {
@@ -33,6 +112,7 @@ def update_profile_by_vk_id(vk_id: int, phone=None, school=None, user_type=None,
         }
         update_data = {k: v for k, v in update_data.items() if v is not None}
         response = supabase.table('profiles').update(update_data).eq('vk_id', vk_id).execute()
+        invalidate_profile(vk_id)
         return response.data is not None
     except Exception as e:
         print(f'update_profile_by_vk_id> Ошибка: {e}')
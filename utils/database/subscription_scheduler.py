@@ -0,0 +1,140 @@
+import fcntl
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.database import users_manager
+
+LOCK_PATH = os.getenv('SUBSCRIPTIONS_LOCK_PATH', '/tmp/studenthelper-subscriptions.lock')
+REFRESH_INTERVAL = 60      # секунды между дочитываниями новых подписок
+RESYNC_INTERVAL = 6 * 3600 # секунды между полными перечитываниями подписок
+LEADER_RETRY_INTERVAL = 30 # секунды между попытками стать ведущим процессом
+
+
+class SubscriptionScheduler:
+    """
+    Планировщик окончания подписок.
+    Хранит очередь ближайших дат окончания (куча по времени) и снимает подписку с пользователя
+    ровно в момент её окончания. Новые подписки попадают в очередь сразу (при вызове
+    set_subscribe в этом процессе) или при периодическом дочитывании подписок, оформленных
+    после предыдущего чтения. Среди процессов-воркеров работает только один - тот, кто
+    удерживает файловую блокировку LOCK_PATH; остальные периодически пытаются её перехватить.
+    """
+    def __init__(self, lock_path: str = LOCK_PATH, refresh_interval: float = REFRESH_INTERVAL,
+                 resync_interval: float = RESYNC_INTERVAL):
+        self.lock_path = lock_path
+        self.refresh_interval = refresh_interval
+        self.resync_interval = resync_interval
+        self._heap = []
+        self._deadlines = {}
+        self._condition = threading.Condition()
+        self._lock_file = None
+        self._thread = None
+
+    def schedule(self, user_id: int, subscribe_end: datetime = None):
+        """Добавление (или снятие при subscribe_end=None) даты окончания подписки пользователя"""
+        if self._lock_file is None:
+            # Очередь ведёт только ведущий процесс; при смене ведущего она перечитывается целиком
+            return
+        with self._condition:
+            if subscribe_end is None:
+                self._deadlines.pop(user_id, None)
+                return
+            self._deadlines[user_id] = subscribe_end
+            heapq.heappush(self._heap, (subscribe_end, user_id))
+            if self._heap[0] == (subscribe_end, user_id):
+                self._condition.notify()
+
+    def _schedule_many(self, subscriptions: list):
+        with self._condition:
+            for user_id, subscribe_end in subscriptions:
+                self._deadlines[user_id] = subscribe_end
+                self._heap.append((subscribe_end, user_id))
+            heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def _acquire_leadership(self) -> bool:
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _pop_due(self, now: datetime) -> list:
+        """Извлечение пользователей, срок подписки которых наступил"""
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                subscribe_end, user_id = heapq.heappop(self._heap)
+                # Устаревшие записи (подписка продлена или снята) пропускаются
+                if self._deadlines.get(user_id) == subscribe_end:
+                    del self._deadlines[user_id]
+                    due.append(user_id)
+        return due
+
+    def _resync(self) -> datetime:
+        started = datetime.now()
+        users_manager.update_expired_subscriptions()
+        subscriptions = users_manager.get_active_subscriptions()
+        with self._condition:
+            self._heap, self._deadlines = [], {}
+        self._schedule_many(subscriptions)
+        print(f'database/subscription_scheduler> Загружено подписок: {len(subscriptions)}')
+        return started
+
+    def _run(self):
+        while not self._acquire_leadership():
+            time.sleep(LEADER_RETRY_INTERVAL)
+        print(f'database/subscription_scheduler> Процесс {os.getpid()} отвечает за окончание подписок')
+
+        last_read = self._resync()
+        last_resync = time.monotonic()
+        next_refresh = time.monotonic() + self.refresh_interval
+        while True:
+            try:
+                last_read, last_resync, next_refresh = self._step(last_read, last_resync, next_refresh)
+            except Exception as e:
+                print(f'database/subscription_scheduler> Ошибка при обработке подписок: {e}')
+                time.sleep(self.refresh_interval)
+
+    def _step(self, last_read: datetime, last_resync: float, next_refresh: float) -> tuple:
+        """Одна итерация: снятие наступивших подписок, дочитывание новых и ожидание ближайшего события"""
+        for user_id in self._pop_due(datetime.now()):
+            users_manager.expire_subscription(user_id)
+            print(f'database/subscription_scheduler> Подписка пользователя {user_id} истекла')
+
+        if time.monotonic() >= next_refresh:
+            if time.monotonic() - last_resync >= self.resync_interval:
+                last_read = self._resync()
+                last_resync = time.monotonic()
+            else:
+                # Подписки, оформленные другими процессами после предыдущего чтения (с запасом на задержку записи)
+                started = datetime.now()
+                since = last_read - timedelta(seconds=self.refresh_interval)
+                self._schedule_many(users_manager.get_active_subscriptions(started_since=since))
+                last_read = started
+            next_refresh = time.monotonic() + self.refresh_interval
+
+        with self._condition:
+            timeout = next_refresh - time.monotonic()
+            if self._heap:
+                timeout = min(timeout, (self._heap[0][0] - datetime.now()).total_seconds())
+            if timeout > 0:
+                self._condition.wait(timeout)
+        return last_read, last_resync, next_refresh
+
+    def start(self):
+        """Запуск планировщика в фоновом потоке и подписка на изменения подписок в этом процессе"""
+        if self._thread is not None:
+            return
+        users_manager.subscription_listeners.append(self.schedule)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+scheduler = SubscriptionScheduler()
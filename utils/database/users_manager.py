@@ -1,39 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from supabase import create_client
-from dotenv import load_dotenv
-import os
+
+from utils import metrics
+from utils.clients import LazyClient
 
 TABLE_NAME = 'profiles'
+# Подписка ищется по profiles.id - идентификатору пользователя Supabase Auth (строка UUID),
+# который фронтенд передаёт в API как user_id и который записывается в заказы
+USER_ID_COLUMN = 'id'
+PAGE_SIZE = 1000
+STATUS_CACHE_SIZE = 10000
+STATUS_TTL = 300          # секунды хранения действующей подписки
+STATUS_NEGATIVE_TTL = 15  # секунды хранения отсутствия подписки (оплата могла пройти в другом воркере)
+STATUS_GRACE = 300        # секунды после устаревания записи, в течение которых при недоступности базы ей ещё верят
+
+# Общий для всех менеджеров клиент Supabase (создаётся при первом запросе)
+supabase = LazyClient('supabase')
+
+# Обработчики изменения подписки пользователя: функция(user_id (profiles.id), subscribe_end или None)
+subscription_listeners = []
+
+
+def parse_datetime(value: str) -> datetime:
+    '''Разбор даты из базы в наивное локальное время (в таком виде даты подписки и записываются)'''
+    date = datetime.fromisoformat(value)
+    return date.astimezone().replace(tzinfo=None) if date.tzinfo else date
+
+
+def _notify(user_id: str, subscribe_end: datetime = None):
+    for listener in subscription_listeners:
+        try:
+            listener(user_id, subscribe_end)
+        except Exception as e:
+            print(f'db_users/_notify> Ошибка в обработчике изменения подписки: {e}')
+
+
+# Кэш статуса подписки: user_id -> (дата окончания или None, срок хранения записи по time.monotonic)
+_status_cache = OrderedDict()
+_status_lock = threading.Lock()
+STATUS_LOOKUPS = metrics.counter(
+    'studenthelper_subscription_status_total', 'Проверки статуса подписки по источнику ответа', ('source',)
+)
 
-load_dotenv()
-url = os.getenv('SUPABASE_URL_PROFILES')
-key = os.getenv('SUPABASE_KEY_PROFILES')
 
-supabase = create_client(url, key)
+def _cache_status(user_id: str, subscribe_end: datetime = None):
+    '''Запись статуса подписки в кэш; вызывается и при изменении подписки (через subscription_listeners)'''
+    user_id = str(user_id)
+    ttl = STATUS_TTL if subscribe_end is not None else STATUS_NEGATIVE_TTL
+    with _status_lock:
+        _status_cache[user_id] = (subscribe_end, time.monotonic() + ttl)
+        _status_cache.move_to_end(user_id)
+        while len(_status_cache) > STATUS_CACHE_SIZE:
+            _status_cache.popitem(last=False)
 
 
-def set_subscribe(user_id: int, subscribe_start: datetime, subscribe_end: datetime):
+subscription_listeners.append(_cache_status)
+
+
+@metrics.timed('supabase_set_subscribe')
+def set_subscribe(user_id: str, subscribe_start: datetime, subscribe_end: datetime):
     '''Установка даты начала и окончания подписки для пользователя по его id'''
     try:
         response = supabase.table(TABLE_NAME).update({
             'subscribe': True,
             'subscribe_start': subscribe_start.isoformat(),
             'subscribe_end': subscribe_end.isoformat()
-        }).eq('vk_id', user_id).execute()
-        
+        }).eq(USER_ID_COLUMN, user_id).execute()
+
+        _notify(user_id, subscribe_end)
         return response.data
     except Exception as e:
         print(f'db_users/set_subscribe> Ошибка во время вноса данных о подписке: {e}')
         return None
 
 
-def set_new_subscribe(user_id: int, **kwargs):
+def set_new_subscribe(user_id: str, **kwargs):
     '''Установка подписки пользователю с текущего момента на определённый срок'''
     current_date = datetime.now()
     end_date = datetime.now() + timedelta(**kwargs)
     return set_subscribe(user_id, current_date, end_date)
 
 
+@metrics.timed('supabase_get_subscription')
+def _load_subscription_end(user_id: str):
+    '''Дата окончания действующей подписки пользователя из базы (None - подписки нет)'''
+    response = supabase.table(TABLE_NAME) \
+        .select('subscribe', 'subscribe_end') \
+        .eq(USER_ID_COLUMN, user_id) \
+        .maybe_single() \
+        .execute()
+    row = response.data if response else None
+    if not row or not row.get('subscribe') or not row.get('subscribe_end'):
+        return None
+    subscribe_end = parse_datetime(row['subscribe_end'])
+    return subscribe_end if subscribe_end > datetime.now() else None
+
+
+def has_active_subscription(user_id: str) -> bool:
+    '''
+    Проверка действующей подписки пользователя.
+    Ответ берётся из кэша: действующая подписка хранится STATUS_TTL секунд (но не дольше срока
+    её окончания), отсутствие подписки - STATUS_NEGATIVE_TTL секунд. Оформление и окончание
+    подписки в этом процессе сразу обновляют кэш. При недоступности базы проверка не проходит;
+    исключение - подписка, подтверждённая не раньше чем STATUS_GRACE секунд назад по истечении записи кэша.
+    '''
+    user_id = str(user_id)
+    with _status_lock:
+        cached = _status_cache.get(user_id)
+    if cached is not None and cached[1] > time.monotonic():
+        STATUS_LOOKUPS.inc(source='cache')
+        return cached[0] is not None and cached[0] > datetime.now()
+
+    STATUS_LOOKUPS.inc(source='database')
+    try:
+        subscribe_end = _load_subscription_end(user_id)
+    except Exception as e:
+        # Без базы доступ даётся только по недавно подтверждённой подписке (статус не кэшируется)
+        if cached is not None and cached[0] is not None and cached[0] > datetime.now() \
+                and time.monotonic() - cached[1] < STATUS_GRACE:
+            STATUS_LOOKUPS.inc(source='grace')
+            print(f'db_users/has_active_subscription> Ошибка при проверке подписки {user_id}, '
+                  f'доступ по устаревшему статусу из кэша: {e}')
+            return True
+        STATUS_LOOKUPS.inc(source='error')
+        print(f'db_users/has_active_subscription> Ошибка при проверке подписки {user_id}, доступ закрыт: {e}')
+        return False
+    _cache_status(user_id, subscribe_end)
+    return subscribe_end is not None
+
+
+@metrics.timed('supabase_update_expired_subscriptions')
 def update_expired_subscriptions():
     '''Перевод в False всех истёкших подписок у пользователей'''
     current_date = datetime.now().isoformat()
@@ -50,6 +148,59 @@ def update_expired_subscriptions():
         return None
 
 
+@metrics.timed('supabase_get_active_subscriptions')
+def get_active_subscriptions(started_since: datetime = None) -> list:
+    '''
+    Получение действующих подписок постранично (по возрастанию id пользователя)
+
+    Args:
+        started_since: только подписки, оформленные начиная с этого момента (None - все)
+
+    Returns:
+        Список пар (id пользователя, дата окончания подписки)
+    '''
+    subscriptions = []
+    last_id = None
+    try:
+        while True:
+            query = supabase.table(TABLE_NAME) \
+                .select(USER_ID_COLUMN, 'subscribe_end') \
+                .eq('subscribe', True) \
+                .order(USER_ID_COLUMN) \
+                .limit(PAGE_SIZE)
+            if started_since is not None:
+                query = query.gte('subscribe_start', started_since.isoformat())
+            if last_id is not None:
+                query = query.gt(USER_ID_COLUMN, last_id)
+            rows = query.execute().data or []
+            subscriptions += [(row[USER_ID_COLUMN], parse_datetime(row['subscribe_end'])) for row in rows if row['subscribe_end']]
+            if len(rows) < PAGE_SIZE:
+                return subscriptions
+            last_id = rows[-1][USER_ID_COLUMN]
+    except Exception as e:
+        print(f'db_users/get_active_subscriptions> Ошибка при чтении подписок: {e}')
+        return subscriptions
+
+
+@metrics.timed('supabase_expire_subscription')
+def expire_subscription(user_id: str):
+    '''Перевод в False подписки пользователя, если срок её действия истёк'''
+    try:
+        response = supabase.table(TABLE_NAME) \
+            .update({'subscribe': False}) \
+            .eq(USER_ID_COLUMN, user_id) \
+            .eq('subscribe', True) \
+            .lte('subscribe_end', datetime.now().isoformat()) \
+            .execute()
+
+        if response.data:
+            _notify(user_id, None)
+        return response.data
+    except Exception as e:
+        print(f'db_users/expire_subscription> Ошибка при обновлении: {e}')
+        return None
+
+
 if __name__ == '__main__':
     print(set_subscribe(
         user_id=343995647,
@@ -0,0 +1,323 @@
+"""
+Лёгкие метрики процесса (счётчики, гистограммы и вычисляемые значения) с выводом
+в текстовом формате Prometheus. Запись метрики - это поиск корзины и сложение под
+блокировкой, поэтому замеры можно ставить на каждый этап обработки запроса.
+
+Многопроцессный режим (несколько воркеров Gunicorn): если задана переменная
+METRICS_MULTIPROCESS_DIR, каждый процесс раз в MULTIPROCESS_FLUSH_INTERVAL секунд
+(и при каждой выдаче метрик) сохраняет свои значения в файл в этой директории, а выдача
+метрик в любом воркере объединяет файлы всех процессов. Счётчики и гистограммы
+суммируются, включая завершившиеся процессы, поэтому остаются монотонными при
+перезапуске воркеров. Вычисляемые значения выдаются по каждому живому процессу
+с меткой worker. Директорию нужно очищать при запуске сервера (см. gunicorn.conf.py).
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Границы корзин гистограмм по умолчанию (секунды): от миллисекунд до минуты
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+MULTIPROCESS_DIR = os.getenv('METRICS_MULTIPROCESS_DIR')
+MULTIPROCESS_FLUSH_INTERVAL = 5.0  # секунды
+GAUGE_MAX_AGE = 3 * MULTIPROCESS_FLUSH_INTERVAL  # файлы старше считаются файлами завершившихся процессов
+
+_metrics = {}
+_lock = threading.Lock()
+_writer = {'pid': None, 'path': None}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames + extra[:1], values + extra[1:])]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    '''Монотонно растущий счётчик'''
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total: dict, values: dict):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+    def render(self, values: dict = None) -> list:
+        items = sorted((self.snapshot() if values is None else values).items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in items]
+
+
+class Histogram:
+    '''Распределение значений по корзинам с суммой и количеством'''
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        '''Контекстный менеджер, записывающий длительность блока'''
+        return _Timer(self, labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: ([*counts], total, count) for key, (counts, total, count) in self._values.items()}
+
+    @staticmethod
+    def merge(total: dict, values: dict):
+        for key, (counts, value_sum, count) in values.items():
+            state = total.get(key)
+            if state is None:
+                total[key] = ([*counts], value_sum, count)
+            else:
+                total[key] = ([a + b for a, b in zip(state[0], counts)], state[1] + value_sum, state[2] + count)
+
+    def render(self, values: dict = None) -> list:
+        items = sorted((self.snapshot() if values is None else values).items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", bound))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Gauge:
+    '''Значение, вычисляемое в момент выдачи метрик'''
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+
+    def snapshot(self) -> dict:
+        try:
+            values = self.function()
+        except Exception as e:
+            print(f'metrics/render> Не удалось вычислить {self.name}: {e}')
+            return {}
+        if not isinstance(values, dict):
+            values = {(): values}
+        return {key if isinstance(key, tuple) else (key,): value for key, value in values.items()}
+
+    @staticmethod
+    def merge(total: dict, values: dict):
+        total.update(values)
+
+    def render(self, values: dict = None) -> list:
+        """values: {ключ: значение} или, в многопроцессном режиме, {(ключ, pid): значение}"""
+        if values is None:
+            return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in sorted(self.snapshot().items())]
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key, ("worker", worker))} {value}'
+            for (key, worker), value in sorted(values.items())
+        ]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def _register(metric):
+    if MULTIPROCESS_DIR:
+        _start_writer()
+    with _lock:
+        existing = _metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        _metrics[metric.name] = metric
+        return metric
+
+
+def _dump():
+    """Сохранение значений метрик процесса в его файл в MULTIPROCESS_DIR"""
+    # Файл, унаследованный от родителя после fork, принадлежит родителю: запись в него затёрла бы его значения
+    if _writer['pid'] != os.getpid():
+        _start_writer()
+    with _lock:
+        path = _writer['path']
+        metrics = list(_metrics.values())
+    data = {
+        metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+        for metric in metrics
+    }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({'pid': os.getpid(), 'metrics': data}, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _run_writer():
+    while True:
+        time.sleep(MULTIPROCESS_FLUSH_INTERVAL)
+        try:
+            _dump()
+        except Exception as e:
+            print(f'metrics/_run_writer> Не удалось сохранить метрики: {e}')
+
+
+def _start_writer():
+    """Запуск фоновой записи метрик (один раз в каждом процессе, в том числе после fork)"""
+    with _lock:
+        if _writer['pid'] == os.getpid():
+            return
+        os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+        _writer['pid'] = os.getpid()
+        _writer['path'] = os.path.join(MULTIPROCESS_DIR, f'metrics-{os.getpid()}-{time.time_ns()}.json')
+    threading.Thread(target=_run_writer, daemon=True).start()
+    atexit.register(_dump_at_exit, os.getpid())
+
+
+def _dump_at_exit(pid: int):
+    # Обработчики atexit наследуются при fork: каждый сохраняет только файл своего процесса
+    if pid == os.getpid():
+        _dump()
+
+
+def _after_fork():
+    """Значения родителя уже учтены в его файле, поэтому дочерний процесс начинает с нуля"""
+    global _lock
+    _lock = threading.Lock()
+    for metric in _metrics.values():
+        if not isinstance(metric, Gauge):
+            metric._values = {}
+            metric._lock = threading.Lock()
+    _writer['pid'] = None
+    _writer['path'] = None
+
+
+if MULTIPROCESS_DIR:
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _collect() -> dict:
+    """Значения метрик всех процессов: {имя метрики: объединённые значения}"""
+    _start_writer()
+    _dump()
+    now = time.time()
+    with _lock:
+        metrics = dict(_metrics)
+    merged = {name: {} for name in metrics}
+    for path in glob.glob(os.path.join(MULTIPROCESS_DIR, 'metrics-*.json')):
+        try:
+            with open(path, encoding='utf-8') as file:
+                data = json.load(file)
+            fresh = now - os.path.getmtime(path) <= GAUGE_MAX_AGE
+        except (OSError, ValueError):
+            continue
+        for name, items in data['metrics'].items():
+            metric = metrics.get(name)
+            if metric is None:
+                continue
+            if isinstance(metric, Gauge):
+                if fresh:
+                    metric.merge(merged[name], {(tuple(key), data['pid']): value for key, value in items})
+            else:
+                metric.merge(merged[name], {tuple(key): value for key, value in items})
+    return merged
+
+
+def counter(name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+    '''Получение (или создание) счётчика по имени'''
+    return _register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    '''Получение (или создание) гистограммы по имени'''
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name: str, documentation: str, function, labelnames: tuple = ()) -> Gauge:
+    '''Регистрация значения, вычисляемого функцией при выдаче метрик'''
+    return _register(Gauge(name, documentation, function, labelnames))
+
+
+STAGE_SECONDS = histogram(
+    'studenthelper_stage_seconds', 'Длительность этапов обработки запроса', ('stage',)
+)
+
+
+def span(stage: str):
+    '''Замер длительности этапа: with span('qdrant_search'): ...'''
+    return _Timer(STAGE_SECONDS, {'stage': stage})
+
+
+def timed(stage: str):
+    '''Декоратор, замеряющий длительность вызовов функции как этап stage'''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    '''Все метрики процесса (в многопроцессном режиме - всех процессов) в текстовом формате Prometheus'''
+    with _lock:
+        metrics = list(_metrics.values())
+    merged = _collect() if MULTIPROCESS_DIR else {}
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render(merged.get(metric.name)))
+    return '\n'.join(lines) + '\n'
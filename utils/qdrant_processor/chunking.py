@@ -0,0 +1,62 @@
+import re
+
+PASSAGE_SIZE = 800     # максимальная длина фрагмента в символах
+PASSAGE_OVERLAP = 150  # длина перекрытия соседних фрагментов в символах
+
+
+def split_sentences(text: str) -> list:
+    """Разбиение текста на предложения"""
+    return [sentence for sentence in re.split(r'(?<=[.!?…])\s+', text.strip()) if sentence]
+
+
+def _split_long(sentence: str, size: int) -> list:
+    """Разбиение предложения длиннее size по границам слов"""
+    parts, current = [], ''
+    for word in sentence.split():
+        if current and len(current) + 1 + len(word) > size:
+            parts.append(current)
+            current = ''
+        current = f'{current} {word}' if current else word
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_passages(text: str, size: int = PASSAGE_SIZE, overlap: int = PASSAGE_OVERLAP) -> list:
+    """
+    Разбиение текста на перекрывающиеся фрагменты по границам предложений
+
+    Args:
+        text: исходный текст
+        size: максимальная длина фрагмента в символах
+        overlap: сколько символов (целыми предложениями) из конца фрагмента повторяется в начале следующего
+
+    Returns:
+        Список фрагментов; текст не длиннее size возвращается одним фрагментом
+    """
+    text = ' '.join(text.split())
+    if len(text) <= size:
+        return [text] if text else []
+
+    sentences = []
+    for sentence in split_sentences(text):
+        sentences += _split_long(sentence, size) if len(sentence) > size else [sentence]
+
+    passages, current = [], []
+    length = 0
+    for sentence in sentences:
+        if current and length + 1 + len(sentence) > size:
+            passages.append(' '.join(current))
+            # Перекрытие: последние предложения фрагмента, суммарно не длиннее overlap
+            tail, tail_length = [], 0
+            for previous in reversed(current):
+                if tail_length + len(previous) + 1 > overlap or tail_length + len(previous) + len(sentence) + 1 > size:
+                    break
+                tail.insert(0, previous)
+                tail_length += len(previous) + 1
+            current, length = tail, max(0, tail_length - 1)
+        current.append(sentence)
+        length += len(sentence) + (1 if length else 0)
+    if current:
+        passages.append(' '.join(current))
+    return passages
@@ -0,0 +1,111 @@
+"""
+Профили производительности коллекции Qdrant: параметры графа HNSW, квантование векторов,
+хранение payload на диске и индексы payload. Профиль применяется при создании коллекции,
+а существующая коллекция переводится на него на месте (перестройка индексов идёт в фоне в Qdrant).
+"""
+from qdrant_client import models
+
+# Индексы payload: без них фильтры по полям выполняются полным перебором точек
+PAYLOAD_INDEXES = {
+    'doc_id': models.PayloadSchemaType.INTEGER,
+    'parent_id': models.PayloadSchemaType.INTEGER,
+    'created_at': models.PayloadSchemaType.FLOAT,
+    'source': models.PayloadSchemaType.KEYWORD,
+}
+
+PROFILES = {
+    # Параметры Qdrant по умолчанию: максимальная точность, векторы и payload в памяти
+    'default': {'m': 16, 'ef_construct': 100, 'hnsw_ef': None, 'quantization': False, 'on_disk_payload': False},
+    # Квантование int8 в памяти с дочитыванием точных векторов, payload на диске
+    'fast': {'m': 16, 'ef_construct': 100, 'hnsw_ef': 64, 'quantization': True, 'on_disk_payload': True},
+    # Более плотный граф и широкий поиск для максимальной полноты
+    'accurate': {'m': 32, 'ef_construct': 256, 'hnsw_ef': 256, 'quantization': False, 'on_disk_payload': False},
+    # Минимум памяти: квантованные векторы в памяти, исходные векторы и payload на диске
+    'compact': {'m': 8, 'ef_construct': 64, 'hnsw_ef': 128, 'quantization': True, 'on_disk_payload': True,
+                'on_disk_vectors': True},
+}
+
+QUANTIZATION_OVERSAMPLING = 2.0  # во сколько раз больше кандидатов дочитывается для точного переранжирования
+
+
+def get_profile(name: str) -> dict:
+    if name not in PROFILES:
+        raise ValueError(f'Неизвестный профиль коллекции: {name} (доступны: {", ".join(PROFILES)})')
+    return PROFILES[name]
+
+
+def _quantization_config(profile: dict):
+    if not profile['quantization']:
+        return None
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+    )
+
+
+def search_params(name: str):
+    '''Параметры поиска для профиля (None - параметры Qdrant по умолчанию)'''
+    profile = get_profile(name)
+    if profile['hnsw_ef'] is None and not profile['quantization']:
+        return None
+    return models.SearchParams(
+        hnsw_ef=profile['hnsw_ef'],
+        quantization=models.QuantizationSearchParams(
+            rescore=True, oversampling=QUANTIZATION_OVERSAMPLING
+        ) if profile['quantization'] else None
+    )
+
+
+def create_collection(client, collection_name: str, vector_size: int, name: str = 'default'):
+    '''Создание коллекции с параметрами профиля и индексами payload'''
+    profile = get_profile(name)
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(
+            size=vector_size, distance=models.Distance.COSINE, on_disk=profile.get('on_disk_vectors', False)
+        ),
+        hnsw_config=models.HnswConfigDiff(m=profile['m'], ef_construct=profile['ef_construct']),
+        quantization_config=_quantization_config(profile),
+        on_disk_payload=profile['on_disk_payload'],
+    )
+    ensure_payload_indexes(client, collection_name)
+
+
+def ensure_payload_indexes(client, collection_name: str, info=None) -> list:
+    '''Создание отсутствующих индексов payload; возвращает список созданных'''
+    info = info or client.get_collection(collection_name)
+    created = []
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field not in (info.payload_schema or {}):
+            client.create_payload_index(collection_name=collection_name, field_name=field, field_schema=schema)
+            created.append(field)
+    return created
+
+
+def apply_profile(client, collection_name: str, name: str = 'default') -> list:
+    """
+    Перевод существующей коллекции на профиль без пересоздания.
+    Изменяются только отличающиеся параметры, поэтому повторный вызов ничего не перестраивает.
+
+    Returns:
+        Список изменённых параметров
+    """
+    profile = get_profile(name)
+    info = client.get_collection(collection_name)
+    config = info.config
+    changes = [f'index:{field}' for field in ensure_payload_indexes(client, collection_name, info)]
+
+    update = {}
+    if (config.hnsw_config.m, config.hnsw_config.ef_construct) != (profile['m'], profile['ef_construct']):
+        update['hnsw_config'] = models.HnswConfigDiff(m=profile['m'], ef_construct=profile['ef_construct'])
+    if bool(config.quantization_config) != profile['quantization']:
+        update['quantization_config'] = _quantization_config(profile) or models.Disabled.DISABLED
+    if bool(config.params.on_disk_payload) != profile['on_disk_payload']:
+        update['collection_params'] = models.CollectionParamsDiff(on_disk_payload=profile['on_disk_payload'])
+    vectors = config.params.vectors
+    if isinstance(vectors, models.VectorParams) and bool(vectors.on_disk) != profile.get('on_disk_vectors', False):
+        update['vectors_config'] = {'': models.VectorParamsDiff(on_disk=profile.get('on_disk_vectors', False))}
+
+    if update:
+        client.update_collection(collection_name=collection_name, **update)
+        changes += list(update)
+    return changes
@@ -0,0 +1,123 @@
+"""
+Сжатие базы знаний Qdrant: поиск групп почти дубликатов среди фрагментов и удаление
+всех фрагментов группы, кроме одного (самого длинного). Выводит, насколько уменьшилась коллекция.
+
+Пример запуска:
+    python -m utils.qdrant_processor.compact --dry-run
+    python -m utils.qdrant_processor.compact --collection university_docs
+"""
+import argparse
+
+from qdrant_client.models import PointIdsList
+
+from utils.clients import get_qdrant
+from utils.qdrant_processor.near_duplicates import SketchIndex, cosine, sketch
+from utils.qdrant_processor.qdrant_processor import (
+    NEAR_DUPLICATE_TEXT, NEAR_DUPLICATE_TEXT_STRICT, NEAR_DUPLICATE_VECTOR
+)
+
+SCROLL_BATCH_SIZE = 256
+DELETE_BATCH_SIZE = 500
+
+
+def load_points(client, collection_name: str) -> dict:
+    """Все фрагменты коллекции с векторами: {id точки: (payload, вектор)}"""
+    points, offset = {}, None
+    while True:
+        batch, offset = client.scroll(
+            collection_name=collection_name,
+            limit=SCROLL_BATCH_SIZE,
+            offset=offset,
+            with_payload=["text", "doc_id", "parent_id"],
+            with_vectors=True
+        )
+        for point in batch:
+            points[point.id] = (point.payload, point.vector)
+        if offset is None:
+            return points
+
+
+def find_clusters(points: dict, text_threshold: float = NEAR_DUPLICATE_TEXT,
+                  strict_threshold: float = NEAR_DUPLICATE_TEXT_STRICT,
+                  vector_threshold: float = NEAR_DUPLICATE_VECTOR) -> list:
+    """
+    Группы почти дубликатов (по тем же правилам, что и при загрузке).
+    Группы строятся жадно вокруг оставляемого фрагмента: фрагменты обходятся от длинных
+    к коротким, и каждый ещё не распределённый фрагмент становится главным в группе из себя
+    и всех нераспределённых дубликатов именно его. Поэтому каждый удаляемый фрагмент близок
+    к оставляемому (A~B и B~C не объединяют далёкие друг от друга A и C)
+
+    Returns:
+        Список групп (списков id точек) из двух и более фрагментов; первым идёт главный фрагмент
+    """
+    index = SketchIndex()
+    parents = {}
+    for doc_id, (payload, _) in points.items():
+        index.add(doc_id, sketch(payload.get("text", "")))
+        parents[doc_id] = payload.get("parent_id", payload.get("doc_id", doc_id))
+
+    order = {doc_id: position for position, doc_id in enumerate(points)}
+    leaders = sorted(points, key=lambda doc_id: (-len(points[doc_id][0].get("text", "")), order[doc_id]))
+    assigned = set()
+    clusters = []
+    for leader in leaders:
+        if leader in assigned:
+            continue
+        assigned.add(leader)
+        payload, vector = points[leader]
+        members = [leader]
+        for other_id, score in index.similar(sketch(payload.get("text", "")), text_threshold):
+            if other_id in assigned or parents[other_id] == parents[leader]:
+                continue
+            if score >= strict_threshold or cosine(vector, points[other_id][1]) >= vector_threshold:
+                assigned.add(other_id)
+                members.append(other_id)
+        if len(members) > 1:
+            clusters.append(members)
+    return clusters
+
+
+def compact(client, collection_name: str, dry_run: bool = False) -> dict:
+    """
+    Удаление почти дубликатов: из каждой группы остаётся главный (самый длинный) фрагмент
+
+    Returns:
+        Словарь со статистикой: точек до и после, удалено, групп, доля сокращения
+    """
+    points = load_points(client, collection_name)
+    clusters = find_clusters(points)
+    removed = []
+    for keep, *duplicates in clusters:
+        removed += duplicates
+
+    if not dry_run:
+        for i in range(0, len(removed), DELETE_BATCH_SIZE):
+            client.delete(
+                collection_name=collection_name,
+                points_selector=PointIdsList(points=removed[i:i + DELETE_BATCH_SIZE])
+            )
+    return {
+        "before": len(points),
+        "after": len(points) - len(removed),
+        "removed": len(removed),
+        "clusters": len(clusters),
+        "shrink": len(removed) / len(points) if points else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Удаление почти дубликатов из базы знаний Qdrant')
+    parser.add_argument('--collection', default='university_docs', help='название коллекции')
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать, ничего не удаляя')
+    args = parser.parse_args()
+
+    stats = compact(get_qdrant(), args.collection, dry_run=args.dry_run)
+    action = 'Будет удалено' if args.dry_run else 'Удалено'
+    print(
+        f"{action} {stats['removed']} фрагментов из {stats['clusters']} групп почти дубликатов: "
+        f"{stats['before']} -> {stats['after']} точек (-{stats['shrink']:.1%})"
+    )
+
+
+if __name__ == '__main__':
+    main()
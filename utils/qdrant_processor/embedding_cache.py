@@ -0,0 +1,139 @@
+import fcntl
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов, переживающий перезапуск процесса.
+    Горячие векторы хранятся в памяти (LRU), все векторы - на диске в виде
+    непрерывного массива float32 (читается через mmap) и индекса "хэш -> номер строки".
+    Файлы только дописываются, поэтому кэш может разделяться несколькими процессами.
+    """
+    def __init__(self, path: str, vector_size: int, memory_size: int = 10000):
+        """
+        Args:
+            path: директория для хранения файлов кэша
+            vector_size: размерность векторов
+            memory_size: количество векторов, хранимых в памяти
+        """
+        os.makedirs(path, exist_ok=True)
+        self.vector_size = vector_size
+        self.row_size = vector_size * array('f').itemsize
+        self.memory_size = memory_size
+        self.vectors_path = os.path.join(path, f'vectors_{vector_size}.f32')
+        self.index_path = os.path.join(path, f'index_{vector_size}.tsv')
+        self._memory = OrderedDict()
+        self._index = {}
+        self._index_offset = 0
+        self._mmap = None
+        self._mmap_rows = 0
+        self._lock = threading.Lock()
+        open(self.vectors_path, 'ab').close()
+        open(self.index_path, 'ab').close()
+        self._read_index()
+        self.hits = 0
+        self.misses = 0
+
+    def _read_index(self):
+        """Дочитывание записей индекса, добавленных с момента последнего чтения (в т.ч. другими процессами)"""
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                key, row = line.decode('ascii').split('\t')
+                self._index[key] = int(row)
+                self._index_offset += len(line)
+
+    def _read_row(self, row: int):
+        if row >= self._mmap_rows:
+            if self._mmap is not None:
+                self._mmap.close()
+            size = os.path.getsize(self.vectors_path)
+            self._mmap = None
+            self._mmap_rows = size // self.row_size
+            if self._mmap_rows == 0 or row >= self._mmap_rows:
+                return None
+            with open(self.vectors_path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), self._mmap_rows * self.row_size, access=mmap.ACCESS_READ)
+        vector = array('f')
+        vector.frombytes(self._mmap[row * self.row_size:(row + 1) * self.row_size])
+        return vector.tolist()
+
+    def _remember(self, key: str, vector: list):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Получение вектора по ключу
+
+        Args:
+            key: хэш текста
+
+        Returns:
+            Вектор или None, если его нет в кэше
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if key not in self._index:
+                self._read_index()
+            row = self._index.get(key)
+            vector = self._read_row(row) if row is not None else None
+            if vector is None:
+                self.misses += 1
+                return None
+            self._remember(key, vector)
+            self.hits += 1
+            return vector
+
+    def put(self, key: str, vector: list):
+        """
+        Сохранение вектора в память и на диск
+
+        Args:
+            key: хэш текста
+            vector: вектор эмбеддинга
+        """
+        if len(vector) != self.vector_size:
+            return
+        with self._lock:
+            self._remember(key, list(vector))
+            if key in self._index:
+                return
+            with open(self.vectors_path, 'r+b') as vectors, open(self.index_path, 'ab') as index:
+                # Блокировка на время дозаписи, чтобы строки разных процессов не перемешивались
+                fcntl.flock(vectors, fcntl.LOCK_EX)
+                try:
+                    size = vectors.seek(0, os.SEEK_END)
+                    if size % self.row_size:
+                        # Недописанная строка после аварийного завершения
+                        size -= size % self.row_size
+                        vectors.truncate(size)
+                    vectors.seek(size)
+                    vectors.write(array('f', vector).tobytes())
+                    vectors.flush()
+                    index.write(f'{key}\t{size // self.row_size}\n'.encode('ascii'))
+                    index.flush()
+                finally:
+                    fcntl.flock(vectors, fcntl.LOCK_UN)
+            self._index[key] = size // self.row_size
+
+    def stats(self) -> dict:
+        """Счётчики попаданий и промахов кэша"""
+        with self._lock:
+            return {
+                'memory': len(self._memory),
+                'disk': len(self._index),
+                'hits': self.hits,
+                'misses': self.misses
+            }
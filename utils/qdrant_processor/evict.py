@@ -0,0 +1,116 @@
+"""
+Вытеснение устаревших и невостребованных фрагментов из базы знаний Qdrant.
+Сначала удаляются фрагменты старше TTL, затем, если точек больше лимита, - фрагменты
+с наименьшим количеством попаданий в выдачу (при равенстве - давно не попадавшие).
+Фрагментам, загруженным без времени загрузки, оно проставляется при первом запуске,
+поэтому срок их жизни отсчитывается с этого момента.
+
+Пример запуска:
+    python -m utils.qdrant_processor.evict --dry-run
+    python -m utils.qdrant_processor.evict --ttl-days 365 --max-points 50000 --interval 3600
+"""
+import argparse
+import os
+import time
+
+from qdrant_client.models import Filter, FieldCondition, Range, IsEmptyCondition, PayloadField, FilterSelector, PointIdsList
+
+from utils.clients import get_qdrant
+
+POINT_TTL_DAYS = float(os.getenv('QDRANT_POINT_TTL_DAYS', '365'))
+MAX_POINTS = int(os.getenv('QDRANT_MAX_POINTS', '50000'))
+SCROLL_BATCH_SIZE = 1000
+DELETE_BATCH_SIZE = 500
+
+
+def backfill_created_at(client, collection_name: str, now: float):
+    '''Проставление времени загрузки фрагментам, загруженным без него'''
+    client.set_payload(
+        collection_name=collection_name,
+        payload={'created_at': now},
+        points=Filter(must=[IsEmptyCondition(is_empty=PayloadField(key='created_at'))])
+    )
+
+
+def least_used(client, collection_name: str, count: int) -> list:
+    '''id count фрагментов с наименьшим количеством попаданий в выдачу (при равенстве - давно не попадавших)'''
+    usage, offset = [], None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=SCROLL_BATCH_SIZE,
+            offset=offset,
+            with_payload=['hits', 'last_hit_at', 'created_at'],
+            with_vectors=False
+        )
+        for point in points:
+            payload = point.payload or {}
+            last_used = payload.get('last_hit_at') or payload.get('created_at') or 0
+            usage.append((payload.get('hits') or 0, last_used, point.id))
+        if offset is None:
+            break
+    usage.sort()
+    return [doc_id for _, _, doc_id in usage[:count]]
+
+
+def evict(client, collection_name: str, ttl_days: float = POINT_TTL_DAYS, max_points: int = MAX_POINTS,
+          dry_run: bool = False) -> dict:
+    """
+    Удаление фрагментов старше ttl_days и вытеснение наименее используемых сверх max_points
+
+    Returns:
+        Словарь со статистикой: точек до и после, удалено по TTL и по лимиту
+    """
+    now = time.time()
+    before = client.count(collection_name=collection_name, exact=True).count
+    if not dry_run:
+        backfill_created_at(client, collection_name, now)
+
+    expired_filter = Filter(must=[FieldCondition(key='created_at', range=Range(lt=now - ttl_days * 24 * 3600))])
+    expired = client.count(collection_name=collection_name, count_filter=expired_filter, exact=True).count
+    if expired and not dry_run:
+        client.delete(collection_name=collection_name, points_selector=FilterSelector(filter=expired_filter))
+
+    overflow = max(0, before - expired - max_points)
+    if overflow and not dry_run:
+        victims = least_used(client, collection_name, overflow)
+        for i in range(0, len(victims), DELETE_BATCH_SIZE):
+            client.delete(
+                collection_name=collection_name,
+                points_selector=PointIdsList(points=victims[i:i + DELETE_BATCH_SIZE])
+            )
+    return {
+        'before': before,
+        'after': before - expired - overflow,
+        'expired': expired,
+        'evicted': overflow
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Вытеснение устаревших и невостребованных фрагментов из Qdrant')
+    parser.add_argument('--collection', default='university_docs', help='название коллекции')
+    parser.add_argument('--ttl-days', type=float, default=POINT_TTL_DAYS, help='срок жизни фрагмента в днях')
+    parser.add_argument('--max-points', type=int, default=MAX_POINTS, help='максимальное количество точек в коллекции')
+    parser.add_argument('--interval', type=float, default=0, help='повторять каждые N секунд (0 - один раз)')
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать, ничего не удаляя')
+    args = parser.parse_args()
+
+    client = get_qdrant()
+    while True:
+        try:
+            stats = evict(client, args.collection, args.ttl_days, args.max_points, args.dry_run)
+            action = 'Будет удалено' if args.dry_run else 'Удалено'
+            print(
+                f"{action}: по сроку {stats['expired']}, сверх лимита {stats['evicted']}; "
+                f"{stats['before']} -> {stats['after']} точек"
+            )
+        except Exception as e:
+            print(f'qdrant_processor/evict> Ошибка при вытеснении: {e}')
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
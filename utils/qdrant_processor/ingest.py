@@ -0,0 +1,113 @@
+"""
+Пакетная загрузка документов в базу знаний Qdrant.
+
+Пример запуска:
+    python -m utils.qdrant_processor.ingest docs/ extra.jsonl --split-paragraphs
+"""
+import argparse
+import json
+import os
+
+from utils.qdrant_processor.chunking import PASSAGE_SIZE, PASSAGE_OVERLAP
+from utils.qdrant_processor.qdrant_processor import (
+    QdrantProcessor, EMBED_BATCH_SIZE, EMBED_CONCURRENCY, UPSERT_BATCH_SIZE
+)
+
+TEXT_EXTENSIONS = ('.txt', '.md')
+JSONL_EXTENSIONS = ('.jsonl',)
+
+
+def iter_files(paths: list):
+    """Обход файлов и директорий с документами"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(TEXT_EXTENSIONS + JSONL_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def iter_documents(paths: list, split_paragraphs: bool = False, text_field: str = 'text', with_sources: bool = False):
+    """
+    Потоковое чтение документов из файлов
+
+    Args:
+        paths: пути к файлам и директориям
+        split_paragraphs: разбивать текстовые файлы на абзацы (по пустым строкам)
+        text_field: поле с текстом документа в строках JSONL
+        with_sources: выдавать пары (текст, источник), где источник - путь к файлу
+
+    Yields:
+        Тексты документов или пары (текст, источник)
+    """
+    for path in iter_files(paths):
+        if with_sources:
+            yield from ((text, f'ingest:{path}') for text in iter_documents([path], split_paragraphs, text_field))
+            continue
+        with open(path, encoding='utf-8') as f:
+            if path.endswith(JSONL_EXTENSIONS):
+                invalid = 0
+                for number, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    # Строки без текста пропускаются, как и пустые: одна такая строка не прерывает загрузку
+                    try:
+                        text = json.loads(line)[text_field]
+                    except (ValueError, KeyError, TypeError) as e:
+                        text, error = None, e
+                    else:
+                        error = f'поле "{text_field}" не строка'
+                    if not isinstance(text, str):
+                        invalid += 1
+                        print(f'qdrant_processor/ingest>  Пропущена строка {path}:{number}: {error!r}')
+                        continue
+                    yield text
+                if invalid:
+                    print(f'qdrant_processor/ingest>  {path}: пропущено строк без текста: {invalid}')
+            elif split_paragraphs:
+                paragraph = []
+                for line in f:
+                    if line.strip():
+                        paragraph.append(line.strip())
+                    elif paragraph:
+                        yield ' '.join(paragraph)
+                        paragraph = []
+                if paragraph:
+                    yield ' '.join(paragraph)
+            else:
+                yield f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пакетная загрузка документов в Qdrant')
+    parser.add_argument('paths', nargs='+', help='файлы (.txt, .md, .jsonl) или директории с ними')
+    parser.add_argument('--collection', default='university_docs', help='название коллекции')
+    parser.add_argument('--split-paragraphs', action='store_true', help='загружать абзацы текстовых файлов отдельно')
+    parser.add_argument('--text-field', default='text', help='поле с текстом в JSONL')
+    parser.add_argument('--batch-size', type=int, default=UPSERT_BATCH_SIZE, help='текстов в одной записи в Qdrant')
+    parser.add_argument('--embed-batch-size', type=int, default=EMBED_BATCH_SIZE, help='текстов в одном обращении за эмбеддингами')
+    parser.add_argument('--concurrency', type=int, default=EMBED_CONCURRENCY, help='одновременных обращений за эмбеддингами')
+    parser.add_argument('--passage-size', type=int, default=PASSAGE_SIZE, help='максимальная длина фрагмента в символах')
+    parser.add_argument('--passage-overlap', type=int, default=PASSAGE_OVERLAP, help='перекрытие соседних фрагментов в символах')
+    args = parser.parse_args()
+
+    processor = QdrantProcessor(collection_name=args.collection)
+    stats = processor.upload_many(
+        iter_documents(args.paths, args.split_paragraphs, args.text_field, with_sources=True),
+        batch_size=args.batch_size,
+        embed_batch_size=args.embed_batch_size,
+        concurrency=args.concurrency,
+        passage_size=args.passage_size,
+        overlap=args.passage_overlap
+    )
+    print(
+        f"Готово: обработано {stats['processed']}, загружено {stats['uploaded']} ({stats['passages']} фрагментов), "
+        f"пропущено {stats['skipped']} за {stats['seconds']} с ({stats['per_second']} текстов/с)"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import math
+import re
+import threading
+from collections import Counter
+
+
+# Частотные слова, не несущие смысла для поиска
+STOP_WORDS = {
+    'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так', 'его',
+    'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было', 'вот', 'от',
+    'меня', 'еще', 'нет', 'о', 'из', 'ему', 'теперь', 'когда', 'даже', 'ну', 'ли', 'если', 'уже', 'или',
+    'ни', 'быть', 'был', 'него', 'до', 'вас', 'нибудь', 'уж', 'вам', 'там', 'потом', 'себя', 'ничего',
+    'ей', 'может', 'они', 'тут', 'где', 'есть', 'надо', 'ней', 'для', 'мы', 'тебя', 'их', 'чем', 'была',
+    'сам', 'чтоб', 'без', 'будто', 'чего', 'раз', 'тоже', 'себе', 'под', 'будет', 'ж', 'тогда', 'кто',
+    'этот', 'того', 'потому', 'этого', 'какой', 'ним', 'здесь', 'этом', 'один', 'мой', 'тем', 'чтобы',
+    'нее', 'были', 'куда', 'зачем', 'всех', 'можно', 'при', 'об', 'это', 'эти', 'the', 'a', 'an', 'of',
+    'and', 'or', 'to', 'in', 'is'
+}
+
+# Окончания русских слов, отбрасываемые при нормализации (от длинных к коротким)
+ENDINGS = sorted({
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ием', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ых', 'их', 'ые', 'ым', 'ой', 'ей', 'ий', 'ый', 'ое', 'ее', 'ая', 'яя', 'ую', 'юю', 'ом', 'ем', 'ов', 'ев',
+    'ия', 'ие', 'ию', 'ии', 'ам', 'ям', 'ться', 'тся', 'ть', 'ешь', 'ишь', 'ете', 'ите', 'ет', 'ит',
+    'ют', 'ут', 'ят', 'им', 'ал', 'ял', 'ил', 'ыл', 'ла', 'ли', 'ло', 'ость', 'ости',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'
+}, key=len, reverse=True)
+
+MIN_STEM_LENGTH = 3
+
+
+def stem(word: str) -> str:
+    """Упрощённое приведение русского слова к основе отбрасыванием окончания"""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """Разбиение текста на нормализованные термы: нижний регистр, без стоп-слов, основы слов"""
+    words = re.findall(r'\w+', text.lower().replace('ё', 'е'))
+    return [stem(word) for word in words if word not in STOP_WORDS]
+
+
+class LexicalIndex:
+    """
+    Инвертированная статистика термов для ранжирования документов по BM25.
+    Частоты термов в документах и документные частоты считаются при добавлении
+    документа, поэтому при поиске тексты кандидатов повторно не разбираются.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._documents = {}
+        self._lengths = {}
+        self._df = Counter()
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._documents
+
+    def add(self, doc_id, text: str):
+        """Добавление (или замена) документа в индексе"""
+        tokens = tokenize(text)
+        with self._lock:
+            self._remove(doc_id)
+            frequencies = Counter(tokens)
+            self._documents[doc_id] = frequencies
+            self._lengths[doc_id] = len(tokens)
+            self._df.update(frequencies.keys())
+            self._total_length += len(tokens)
+
+    def _remove(self, doc_id):
+        frequencies = self._documents.pop(doc_id, None)
+        if frequencies is None:
+            return
+        self._df.subtract(frequencies.keys())
+        self._total_length -= self._lengths.pop(doc_id)
+
+    def remove(self, doc_id):
+        """Удаление документа из индекса"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def scores(self, query: str, doc_ids: list) -> dict:
+        """
+        Оценка документов по BM25 относительно запроса
+
+        Args:
+            query: текст запроса
+            doc_ids: идентификаторы оцениваемых документов
+
+        Returns:
+            Словарь "идентификатор документа - оценка BM25"
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._documents)
+            if not count or not terms:
+                return {doc_id: 0.0 for doc_id in doc_ids}
+            average_length = self._total_length / count or 1.0
+            idf = {
+                term: math.log(1 + (count - self._df[term] + 0.5) / (self._df[term] + 0.5))
+                for term in terms if self._df[term] > 0
+            }
+            result = {}
+            for doc_id in doc_ids:
+                frequencies = self._documents.get(doc_id)
+                if frequencies is None:
+                    result[doc_id] = 0.0
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                result[doc_id] = sum((
+                    weight * frequencies[term] * (self.k1 + 1) / (frequencies[term] + norm)
+                    for term, weight in idf.items() if term in frequencies
+                ), 0.0)
+            return result
@@ -0,0 +1,104 @@
+import math
+import operator
+import threading
+from collections import Counter
+from hashlib import blake2b
+
+from utils.qdrant_processor.lexical_index import tokenize
+
+SHINGLE_SIZE = 3   # слов в одном шингле
+SKETCH_SIZE = 32   # минимальных хэшей шинглов в сигнатуре (bottom-k MinHash)
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """Множество шинглов текста: последовательности из size нормализованных слов"""
+    tokens = tokenize(text)
+    if len(tokens) <= size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def sketch(text: str, size: int = SKETCH_SIZE) -> tuple:
+    """
+    MinHash-сигнатура текста: size наименьших 64-битных хэшей его шинглов.
+    Доля общих значений среди наименьших хэшей объединения двух сигнатур оценивает
+    коэффициент Жаккара множеств шинглов текстов
+    """
+    hashes = {int.from_bytes(blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big') for shingle in shingles(text)}
+    return tuple(sorted(hashes)[:size])
+
+
+def similarity(first: tuple, second: tuple, size: int = SKETCH_SIZE) -> float:
+    """Оценка коэффициента Жаккара текстов по их сигнатурам"""
+    if not first or not second:
+        return 0.0
+    union = sorted(set(first) | set(second))[:size]
+    shared = set(first) & set(second)
+    return sum(1 for value in union if value in shared) / len(union)
+
+
+def cosine(first: list, second: list) -> float:
+    norm = math.sqrt(sum(map(operator.mul, first, first)) * sum(map(operator.mul, second, second)))
+    return sum(map(operator.mul, first, second)) / norm if norm else 0.0
+
+
+class SketchIndex:
+    """
+    Поиск почти дубликатов по MinHash-сигнатурам.
+    Инвертированный индекс "значение хэша - документы" отбирает кандидатов с общими
+    значениями сигнатуры, после чего их сходство оценивается по сигнатурам целиком.
+    """
+    def __init__(self, min_shared: int = 4):
+        """
+        Args:
+            min_shared: минимальное количество общих значений сигнатуры у кандидата
+        """
+        self.min_shared = min_shared
+        self._sketches = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sketches)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._sketches
+
+    def add(self, doc_id, signature: tuple):
+        """Добавление (или замена) сигнатуры документа"""
+        with self._lock:
+            self._remove(doc_id)
+            self._sketches[doc_id] = signature
+            for value in signature:
+                self._postings.setdefault(value, set()).add(doc_id)
+
+    def _remove(self, doc_id):
+        signature = self._sketches.pop(doc_id, None)
+        for value in signature or ():
+            documents = self._postings.get(value)
+            documents.discard(doc_id)
+            if not documents:
+                del self._postings[value]
+
+    def remove(self, doc_id):
+        """Удаление документа из индекса"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def similar(self, signature: tuple, threshold: float) -> list:
+        """
+        Документы, похожие на сигнатуру
+
+        Args:
+            signature: сигнатура текста (sketch)
+            threshold: минимальная оценка коэффициента Жаккара
+
+        Returns:
+            Список пар (идентификатор документа, оценка), от более похожих к менее
+        """
+        min_shared = min(self.min_shared, len(signature))
+        with self._lock:
+            shared = Counter(doc_id for value in signature for doc_id in self._postings.get(value, ()))
+            candidates = [(doc_id, self._sketches[doc_id]) for doc_id, count in shared.items() if count >= min_shared]
+        scored = [(doc_id, similarity(signature, other)) for doc_id, other in candidates]
+        return sorted((item for item in scored if item[1] >= threshold), key=lambda item: item[1], reverse=True)
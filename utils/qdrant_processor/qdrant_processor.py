@@ -1,109 +1,421 @@
-import os
-import time
-import hashlib
-import re
-from dotenv import load_dotenv
-from langchain_community.embeddings.yandex import YandexGPTEmbeddings
-from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, Filter, FieldCondition, MatchValue
-
-# Загрузка переменных окружения
-load_dotenv()
-
-class QdrantProcessor:
-    def __init__(self, collection_name="university_docs", vector_size=256):
-        self.qdrant = QdrantClient(
-            url="http://qdrant:6333"
-        )
-        self.collection_name = collection_name
-        self.embeddings = YandexGPTEmbeddings(
-            api_key=os.getenv("YANDEX_API_KEY"),
-            folder_id=os.getenv("YANDEX_FOLDER_ID")
-        )
-        self.vector_size = vector_size
-        self._ensure_collection()
-
-    def _ensure_collection(self):
-        try:
-            self.qdrant.get_collection(self.collection_name)
-            print(f"Коллекция '{self.collection_name}' уже существует.")
-        except Exception:
-            print(f"Создаём коллекцию '{self.collection_name}'...")
-            self.qdrant.create_collection(
-                collection_name=self.collection_name,
-                vectors_config={"size": self.vector_size, "distance": "Cosine"}
-            )
-
-    def _generate_id(self, text):
-        return int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % (10 ** 12)
-
-    def _is_uploaded(self, doc_id):
-        try:
-            result = self.qdrant.scroll(
-                collection_name=self.collection_name,
-                scroll_filter=Filter(
-                    must=[FieldCondition(key="doc_id", match=MatchValue(value=doc_id))]
-                ),
-                limit=1
-            )
-            return len(result[0]) > 0
-        except Exception:
-            return False
-
-    def upload_text(self, text: str):
-        cleaned = text.replace("\n", " ").strip()
-        doc_id = self._generate_id(cleaned)
-
-        if self._is_uploaded(doc_id):
-            print(f"Документ уже загружен (doc_id={doc_id})")
-            return
-
-        vector = self.embeddings.embed_documents([cleaned])[0]
-
-        point = PointStruct(
-            id=doc_id,
-            vector=vector,
-            payload={
-                "text": cleaned,
-                "doc_id": doc_id
-            }
-        )
-        self.qdrant.upsert(collection_name=self.collection_name, points=[point])
-        print("Текст успешно загружен в Qdrant.")
-
-    @staticmethod
-    def keyword_score(text: str, query: str) -> float:
-        query = query.lower()
-        text = text.lower()
-        return len(re.findall(re.escape(query), text))
-
-    def search(self, query: str, limit: int = 1, rerank_limit: int = 20):
-        vector = self.embeddings.embed_documents([query])[0]
-        filters = []
-
-        result = self.qdrant.search(
-            collection_name=self.collection_name,
-            query_vector=vector,
-            limit=rerank_limit,
-            query_filter=Filter(must=filters) if filters else None,
-            with_payload=True
-        )
-
-        reranked = sorted(
-            result,
-            key=lambda r: self.keyword_score(r.payload.get('text', ''), query),
-            reverse=True
-        )
-
-        return [
-            {
-                "score": r.score,
-                "text": r.payload.get("text", "")
-            } for r in reranked[:limit]
-        ]
-
-if __name__ == '__main__':
-    qdrant_db = QdrantProcessor()
-    # Пример загрузки и поиска
-    #qdrant_db.upload_text("Python - язык программирования")
-    print(qdrant_db.search("экология и природопользование и python"))
+import os
+import threading
+import time
+import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from dotenv import load_dotenv
+from qdrant_client.models import PointStruct, Filter, FieldCondition, Range, IsEmptyCondition, PayloadField
+
+from utils import metrics
+from utils.clients import get_embeddings, get_qdrant
+from utils.qdrant_processor import collection_profiles
+from utils.qdrant_processor.chunking import split_passages, PASSAGE_SIZE, PASSAGE_OVERLAP
+from utils.qdrant_processor.embedding_cache import EmbeddingCache
+from utils.qdrant_processor.lexical_index import LexicalIndex
+from utils.qdrant_processor.near_duplicates import SketchIndex, cosine, sketch
+
+# Загрузка переменных окружения
+load_dotenv()
+
+EMBED_BATCH_SIZE = 16   # текстов в одном обращении за эмбеддингами
+EMBED_CONCURRENCY = 4   # одновременных обращений за эмбеддингами
+UPSERT_BATCH_SIZE = 256 # точек в одной записи в Qdrant
+NEAR_DUPLICATE_TEXT = 0.5          # сходство шинглов, при котором фрагмент проверяется по вектору
+NEAR_DUPLICATE_TEXT_STRICT = 0.85  # сходство шинглов, при котором фрагмент - дубликат без проверки вектора
+NEAR_DUPLICATE_VECTOR = 0.95       # косинусная близость векторов почти дубликатов
+
+HITS_FLUSH_INTERVAL = 60  # секунды между записью счётчиков попаданий фрагментов в выдачу
+
+NEAR_DUPLICATES_TOTAL = metrics.counter(
+    'studenthelper_near_duplicates_total', 'Фрагменты, не загруженные в Qdrant как почти дубликаты'
+)
+
+class QdrantProcessor:
+    def __init__(self, collection_name="university_docs", vector_size=256, client=None, profile=None):
+        self.qdrant = client or get_qdrant()
+        self.collection_name = collection_name
+        # Профиль производительности коллекции (см. collection_profiles.PROFILES)
+        self.profile = profile or os.getenv("QDRANT_PROFILE", "default")
+        self.search_params = collection_profiles.search_params(self.profile)
+        self.embeddings = get_embeddings()
+        self.vector_size = vector_size
+        self.embeddings_cache = EmbeddingCache(
+            path=os.getenv("EMBEDDINGS_CACHE_DIR", ".cache/embeddings"),
+            vector_size=vector_size
+        )
+        self.lexical_index = LexicalIndex()
+        self.sketch_index = SketchIndex()
+        # Попадания фрагментов в выдачу, ещё не записанные в payload (hits, last_hit_at)
+        self._pending_hits = Counter()
+        self._hits_lock = threading.Lock()
+        self._hits_thread = None
+        metrics.gauge(
+            'studenthelper_embeddings_cache', 'Состояние кэша эмбеддингов', self.embeddings_cache.stats, ('kind',)
+        )
+        self._ensure_collection()
+        self._load_indexes()
+
+    def _ensure_collection(self):
+        try:
+            self.qdrant.get_collection(self.collection_name)
+        except Exception:
+            print(f"Создаём коллекцию '{self.collection_name}' (профиль {self.profile})...")
+            collection_profiles.create_collection(self.qdrant, self.collection_name, self.vector_size, self.profile)
+            return
+        print(f"Коллекция '{self.collection_name}' уже существует.")
+        try:
+            changes = collection_profiles.apply_profile(self.qdrant, self.collection_name, self.profile)
+            if changes:
+                print(f"Коллекция '{self.collection_name}' переведена на профиль {self.profile}: {', '.join(changes)}")
+        except Exception as e:
+            print(f"Не удалось применить профиль {self.profile} к коллекции '{self.collection_name}': {e}")
+
+    def _index_point(self, doc_id, text: str):
+        """Добавление фрагмента в лексический индекс и индекс почти дубликатов"""
+        self.lexical_index.add(doc_id, text)
+        self.sketch_index.add(doc_id, sketch(text))
+
+    def _load_indexes(self, batch_size: int = 256):
+        """Построение лексического индекса и индекса почти дубликатов по текстам, уже загруженным в коллекцию"""
+        offset = None
+        try:
+            while True:
+                points, offset = self.qdrant.scroll(
+                    collection_name=self.collection_name,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=["text", "doc_id"],
+                    with_vectors=False
+                )
+                for point in points:
+                    self._index_point(point.payload.get("doc_id", point.id), point.payload.get("text", ""))
+                if offset is None:
+                    break
+            print(f"Лексический индекс построен: {len(self.lexical_index)} документов.")
+        except Exception as e:
+            print(f"Не удалось построить лексический индекс: {e}")
+
+    @staticmethod
+    def _hash_text(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _generate_id(self, text):
+        return int(self._hash_text(text), 16) % (10 ** 12)
+
+    def embed(self, texts: list) -> list:
+        """Получение эмбеддингов текстов: из кэша, а для отсутствующих в нём - от YandexGPT"""
+        keys = [self._hash_text(text) for text in texts]
+        vectors = [self.embeddings_cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with metrics.span('embed_remote'):
+                computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                self.embeddings_cache.put(keys[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def _passages(self, text: str, passage_size: int = PASSAGE_SIZE, overlap: int = PASSAGE_OVERLAP,
+                  source: str = "manual") -> dict:
+        """
+        Разбиение документа на перекрывающиеся фрагменты
+
+        Returns:
+            Словарь {id точки: payload} с текстом фрагмента, id документа (parent_id), номером фрагмента,
+            временем загрузки (created_at, unix-время), источником (source) и счётчиком попаданий в выдачу (hits).
+            Документ из одного фрагмента хранится под id документа, как и до разбиения на фрагменты
+        """
+        cleaned = text.replace("\n", " ").strip()
+        if not cleaned:
+            return {}
+        parent_id = self._generate_id(cleaned)
+        passages = split_passages(cleaned, passage_size, overlap)
+        created_at = time.time()
+        points = {}
+        for i, passage in enumerate(passages):
+            doc_id = parent_id if len(passages) == 1 else self._generate_id(f"{parent_id}:{i}")
+            points[doc_id] = {
+                "text": passage,
+                "doc_id": doc_id,
+                "parent_id": parent_id,
+                "passage": i,
+                "passages": len(passages),
+                "created_at": created_at,
+                "source": source,
+                "hits": 0
+            }
+        return points
+
+    def upload_text(self, text: str, source: str = "manual"):
+        points = self._upload_batch([(text, source)])
+        if not points:
+            print("Документ уже загружен")
+            return
+        self.qdrant.upsert(collection_name=self.collection_name, points=points)
+        for point in points:
+            self._index_point(point.id, point.payload["text"])
+        print(f"Текст успешно загружен в Qdrant ({len(points)} фрагментов).")
+
+    def _upload_batch(self, texts: list, executor: ThreadPoolExecutor = None, embed_batch_size: int = EMBED_BATCH_SIZE,
+                      passage_size: int = PASSAGE_SIZE, overlap: int = PASSAGE_OVERLAP) -> list:
+        """
+        Подготовка точек для пачки текстов: разбиение на фрагменты, проверка наличия одним запросом и параллельное получение эмбеддингов.
+        Элемент пачки - текст или пара (текст, источник)
+        """
+        documents = {}
+        for item in texts:
+            text, source = item if isinstance(item, tuple) else (item, "manual")
+            for doc_id, payload in self._passages(text, passage_size, overlap, source).items():
+                documents.setdefault(doc_id, payload)
+        if not documents:
+            return []
+
+        existing = self.qdrant.retrieve(
+            collection_name=self.collection_name,
+            ids=list(documents),
+            with_payload=False,
+            with_vectors=False
+        )
+        for point in existing:
+            documents.pop(point.id, None)
+
+        ids = list(documents)
+        chunks = [ids[i:i + embed_batch_size] for i in range(0, len(ids), embed_batch_size)]
+        embed_chunk = lambda chunk: self.embed([documents[doc_id]["text"] for doc_id in chunk])
+        vectors = executor.map(embed_chunk, chunks) if executor else map(embed_chunk, chunks)
+        points = []
+        for chunk, chunk_vectors in zip(chunks, vectors):
+            for doc_id, vector in zip(chunk, chunk_vectors):
+                points.append(PointStruct(id=doc_id, vector=vector, payload=documents[doc_id]))
+        return self._drop_near_duplicates(points)
+
+    def _drop_near_duplicates(self, points: list) -> list:
+        """
+        Отбрасывание фрагментов, почти совпадающих с уже загруженными или с предыдущими фрагментами пачки.
+        Кандидаты отбираются по MinHash-сигнатурам; при умеренном сходстве текстов дубликат
+        подтверждается близостью векторов
+        """
+        batch_index = SketchIndex()
+        batch = {point.id: point for point in points}
+        candidates = {}
+        for point in points:
+            signature = sketch(point.payload["text"])
+            similar = self.sketch_index.similar(signature, NEAR_DUPLICATE_TEXT) + batch_index.similar(signature, NEAR_DUPLICATE_TEXT)
+            candidates[point.id] = similar
+            batch_index.add(point.id, signature)
+
+        stored_ids = {doc_id for similar in candidates.values() for doc_id, _ in similar if doc_id not in batch}
+        stored = {}
+        if stored_ids:
+            stored = {point.id: point for point in self.qdrant.retrieve(
+                collection_name=self.collection_name,
+                ids=list(stored_ids),
+                with_payload=["parent_id", "doc_id"],
+                with_vectors=True
+            )}
+
+        kept, dropped = [], set()
+        for point in points:
+            for doc_id, score in candidates[point.id]:
+                other = batch.get(doc_id) or stored.get(doc_id)
+                # Соседние фрагменты одного документа пересекаются намеренно; отброшенные фрагменты пачки не в счёт
+                if other is None or doc_id in dropped:
+                    continue
+                if other.payload.get("parent_id", other.payload.get("doc_id", other.id)) == point.payload["parent_id"]:
+                    continue
+                if score >= NEAR_DUPLICATE_TEXT_STRICT or cosine(point.vector, other.vector) >= NEAR_DUPLICATE_VECTOR:
+                    dropped.add(point.id)
+                    break
+            else:
+                kept.append(point)
+        if dropped:
+            NEAR_DUPLICATES_TOTAL.inc(len(dropped))
+            print(f"Пропущено почти дубликатов: {len(dropped)}")
+        return kept
+
+    def upload_many(self, texts, batch_size: int = UPSERT_BATCH_SIZE, embed_batch_size: int = EMBED_BATCH_SIZE,
+                    concurrency: int = EMBED_CONCURRENCY, passage_size: int = PASSAGE_SIZE,
+                    overlap: int = PASSAGE_OVERLAP) -> dict:
+        """
+        Пакетная загрузка текстов в коллекцию (с разбиением на перекрывающиеся фрагменты)
+
+        Args:
+            texts: итерируемый набор текстов или пар (текст, источник) (читается потоково, пачками по batch_size)
+            batch_size: количество текстов в пачке на проверку наличия и запись в Qdrant
+            embed_batch_size: количество фрагментов в одном обращении за эмбеддингами
+            concurrency: количество одновременных обращений за эмбеддингами
+            passage_size: максимальная длина фрагмента в символах
+            overlap: длина перекрытия соседних фрагментов в символах
+
+        Returns:
+            Словарь со статистикой загрузки: обработано, загружено (текстов и фрагментов), пропущено, время и скорость
+        """
+        texts = iter(texts)
+        processed = uploaded = passages = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                batch = list(islice(texts, batch_size))
+                if not batch:
+                    break
+                points = self._upload_batch(batch, executor, embed_batch_size, passage_size, overlap)
+                if points:
+                    self.qdrant.upsert(collection_name=self.collection_name, points=points, wait=False)
+                    for point in points:
+                        self._index_point(point.id, point.payload["text"])
+                processed += len(batch)
+                uploaded += len({point.payload["parent_id"] for point in points})
+                passages += len(points)
+                elapsed = time.perf_counter() - started
+                print(f"Обработано {processed} текстов, загружено {uploaded} ({passages} фрагментов, {processed / elapsed:.1f} текстов/с)")
+
+        elapsed = time.perf_counter() - started
+        return {
+            "processed": processed,
+            "uploaded": uploaded,
+            "passages": passages,
+            "skipped": processed - uploaded,
+            "seconds": round(elapsed, 3),
+            "per_second": round(processed / elapsed, 1) if elapsed else 0.0
+        }
+
+    def record_hits(self, ids: list):
+        """Учёт использования фрагментов в ответах (записывается в payload фоновым потоком)"""
+        with self._hits_lock:
+            self._pending_hits.update(ids)
+            if self._hits_thread is None:
+                self._hits_thread = threading.Thread(target=self._run_hits, daemon=True)
+                self._hits_thread.start()
+
+    def flush_hits(self):
+        """
+        Запись накопленных попаданий в payload фрагментов (hits, last_hit_at).
+        Счётчик увеличивается чтением и записью, поэтому одновременные записи из разных
+        процессов могут потерять часть попаданий - для вытеснения это допустимо
+        """
+        with self._hits_lock:
+            pending, self._pending_hits = self._pending_hits, Counter()
+        if not pending:
+            return
+        now = time.time()
+        try:
+            stored = self.qdrant.retrieve(
+                collection_name=self.collection_name,
+                ids=list(pending),
+                with_payload=["hits"],
+                with_vectors=False
+            )
+            for point in stored:
+                self.qdrant.set_payload(
+                    collection_name=self.collection_name,
+                    payload={"hits": (point.payload.get("hits") or 0) + pending[point.id], "last_hit_at": now},
+                    points=[point.id],
+                    wait=False
+                )
+        except Exception as e:
+            print(f"Не удалось записать попадания фрагментов: {e}")
+
+    def _run_hits(self):
+        while True:
+            time.sleep(HITS_FLUSH_INTERVAL)
+            self.flush_hits()
+
+    def search(self, query: str, limit: int = 1, rerank_limit: int = 20, hybrid: bool = True, alpha: float = 0.7,
+               per_parent: int = None, budget: int = None, max_age: float = None, half_life: float = None,
+               record_hits: bool = True):
+        """
+        Поиск фрагментов текстов, близких к запросу
+
+        Args:
+            query: текст запроса
+            limit: количество возвращаемых фрагментов
+            rerank_limit: количество кандидатов из векторного поиска для переранжирования
+            hybrid: переранжирование кандидатов с учётом оценки BM25 из лексического индекса
+            alpha: вес векторной оценки при смешивании с лексической
+            per_parent: максимальное количество фрагментов одного документа (None - без ограничения)
+            budget: максимальная суммарная длина текстов фрагментов в символах (None - без ограничения);
+                первый фрагмент возвращается всегда
+            max_age: только фрагменты, загруженные не раньше max_age секунд назад
+                (фрагменты без времени загрузки не отбрасываются)
+            half_life: период в секундах, за который оценка фрагмента при ранжировании уменьшается вдвое
+            record_hits: учесть найденные фрагменты как использованные; False - если вызывающий код
+                сам вызовет record_hits для фрагментов, которые действительно попали в ответ
+
+        Returns:
+            Список словарей с id точки (id), косинусной близостью (score), смешанной оценкой (hybrid_score),
+            текстом (text), id документа (parent_id) и номером фрагмента в нём (passage)
+        """
+        vector = self.embed([query])[0]
+        filters = []
+        now = time.time()
+        if max_age is not None:
+            filters.append(Filter(should=[
+                FieldCondition(key="created_at", range=Range(gte=now - max_age)),
+                IsEmptyCondition(is_empty=PayloadField(key="created_at"))
+            ]))
+
+        with metrics.span('qdrant_search'):
+            result = self.qdrant.search(
+                collection_name=self.collection_name,
+                query_vector=vector,
+                limit=max(rerank_limit, limit),
+                query_filter=Filter(must=filters) if filters else None,
+                search_params=self.search_params,
+                with_payload=True
+            )
+
+        hybrid_scores = {r.id: r.score for r in result}
+        if hybrid and result:
+            for r in result:
+                # Документы, загруженные другими процессами, добавляются в индекс по мере появления
+                doc_id = r.payload.get("doc_id", r.id)
+                if doc_id not in self.lexical_index:
+                    self._index_point(doc_id, r.payload.get("text", ""))
+            lexical = self.lexical_index.scores(query, [r.payload.get("doc_id", r.id) for r in result])
+            max_lexical = max(lexical.values()) or 1.0
+            hybrid_scores = {
+                r.id: alpha * r.score + (1 - alpha) * lexical[r.payload.get("doc_id", r.id)] / max_lexical
+                for r in result
+            }
+
+        if half_life:
+            # Затухание оценки с возрастом: устаревшие фрагменты уступают свежим с близкой оценкой
+            for r in result:
+                age = max(0.0, now - (r.payload.get("created_at") or now))
+                hybrid_scores[r.id] *= 0.5 ** (age / half_life)
+
+        reranked = sorted(result, key=lambda r: hybrid_scores[r.id], reverse=True)
+
+        selected, per_document, used = [], {}, 0
+        for r in reranked:
+            if len(selected) >= limit:
+                break
+            # Точки, загруженные до разбиения на фрагменты, считаются отдельными документами
+            parent_id = r.payload.get("parent_id", r.payload.get("doc_id", r.id))
+            text = r.payload.get("text", "")
+            if per_parent is not None and per_document.get(parent_id, 0) >= per_parent:
+                continue
+            if budget is not None and selected and used + len(text) > budget:
+                continue
+            per_document[parent_id] = per_document.get(parent_id, 0) + 1
+            used += len(text)
+            selected.append({
+                "id": r.id,
+                "score": r.score,
+                "hybrid_score": hybrid_scores[r.id],
+                "text": text,
+                "parent_id": parent_id,
+                "passage": r.payload.get("passage", 0),
+                "created_at": r.payload.get("created_at")
+            })
+        if record_hits:
+            self.record_hits([item["id"] for item in selected])
+        return selected
+
+if __name__ == '__main__':
+    qdrant_db = QdrantProcessor()
+    # Пример загрузки и поиска
+    #qdrant_db.upload_text("Python - язык программирования")
+    print(qdrant_db.search("экология и природопользование и python"))
@@ -0,0 +1,58 @@
+"""
+Объединение одновременных одинаковых запросов (single-flight): пока по ключу выполняется
+запрос, остальные вызовы с тем же ключом не выполняют свой, а дожидаются его результата.
+"""
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''Группа запросов, объединяемых по ключу'''
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs) -> tuple:
+        """
+        Выполнение function(*args, **kwargs) не более одного раза одновременно для ключа
+
+        Returns:
+            Пара (результат, True если результат получен чужим вызовом).
+            Исключение выполняющего вызова передаётся всем ожидающим.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def forget(self, key):
+        '''Следующий вызов по ключу выполнит новый запрос, не дожидаясь текущего'''
+        with self._lock:
+            self._calls.pop(key, None)